@@ -0,0 +1,222 @@
+"""
+Admission control for chat requests.
+
+`RateLimiter` is a per-client token bucket: each client key (an IP address
+or a session id) may make `burst` requests at once and `rate` per second on
+average. Buckets live in a bounded LRU, so a flood of distinct keys cannot
+grow memory; an evicted bucket just starts full again.
+
+`ConcurrencyGate` caps concurrent upstream calls. Callers beyond `limit` wait
+in a queue of at most `max_queue` for up to `timeout` seconds; when the
+queue is full or the wait times out, `Overloaded` is raised right away so the
+request can be shed or answered locally instead of piling up.
+`AsyncConcurrencyGate` is the asyncio equivalent for the ASGI mode.
+
+  limiter = RateLimiter(rate=5, burst=20)
+  allowed, retry_after = limiter.allow(client_ip)
+  gate = ConcurrencyGate(limit=32, max_queue=64, timeout=5)
+  with gate:
+      ...  # upstream call
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+QUEUE_FULL = 'queue_full'
+QUEUE_TIMEOUT = 'queue_timeout'
+
+
+class Overloaded(Exception):
+    """The upstream concurrency gate could not admit the call."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__('upstream overloaded (%s)' % reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Thread-safe per-key token buckets.
+
+    rate: tokens added per second; 0 or less disables limiting.
+    burst: bucket capacity.
+    max_clients: buckets kept; the least recently used is dropped beyond it.
+    """
+
+    def __init__(self, rate=5.0, burst=20, max_clients=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self.limited = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, cost=1.0):
+        """Take `cost` tokens from `key`'s bucket.
+
+        Returns (allowed, retry_after) where retry_after is the number of
+        seconds until the request would be allowed (0.0 when it is).
+        """
+        if self.rate <= 0:
+            return True, 0.0
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0.0
+            self.limited += 1
+            return False, (cost - bucket[0]) / self.rate
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._buckets), 'rate': self.rate, 'burst': self.burst,
+                    'limited': self.limited}
+
+
+class _GateBase:
+    def __init__(self, limit=32, max_queue=64, timeout=5.0, retry_after=1.0):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # what shed callers are told; the gate cannot know when load will drop
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timeouts = 0
+
+    def _wait(self, timeout):
+        return self.timeout if timeout is None else max(0.0, min(self.timeout, timeout))
+
+    def _timed_out(self, timeout):
+        if timeout is not None and timeout < self.timeout:
+            raise TimeoutError('no upstream slot before the deadline')
+        raise Overloaded(QUEUE_TIMEOUT, self.retry_after)
+
+    def _take_free(self):
+        if self.active >= self.limit or self.waiting:
+            return False
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'queued': self.waiting,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'timeouts': self.timeouts,
+        }
+
+
+class ConcurrencyGate(_GateBase):
+    """Counting semaphore with a bounded, time-limited wait queue."""
+
+    def __init__(self, limit=32, max_queue=64, timeout=5.0, retry_after=1.0):
+        super().__init__(limit, max_queue, timeout, retry_after)
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Take a slot or raise Overloaded.
+
+        `timeout` (seconds) shortens the queue wait for this caller, e.g. to
+        its request deadline; running out of it raises TimeoutError instead.
+        """
+        with self._cond:
+            if self.active >= self.limit:
+                if self.waiting >= self.max_queue:
+                    self.shed += 1
+                    raise Overloaded(QUEUE_FULL, self.retry_after)
+                self.waiting += 1
+                try:
+                    if not self._cond.wait_for(lambda: self.active < self.limit, self._wait(timeout)):
+                        self.timeouts += 1
+                        self._timed_out(timeout)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+
+    def try_acquire(self):
+        """Take a free slot without waiting; returns False if there is none."""
+        with self._cond:
+            return self._take_free()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class AsyncConcurrencyGate(_GateBase):
+    """asyncio version of ConcurrencyGate; use with `async with`."""
+
+    def __init__(self, limit=32, max_queue=64, timeout=5.0, retry_after=1.0):
+        super().__init__(limit, max_queue, timeout, retry_after)
+        self._cond = None  # created on first use, inside the running loop
+
+    def _condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, timeout=None):
+        async with self._condition():
+            if self.active >= self.limit:
+                if self.waiting >= self.max_queue:
+                    self.shed += 1
+                    raise Overloaded(QUEUE_FULL, self.retry_after)
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self._cond.wait_for(lambda: self.active < self.limit),
+                                           self._wait(timeout))
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    self._timed_out(timeout)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+
+    def try_acquire(self):
+        # runs on the event loop thread, so no lock is needed
+        return self._take_free()
+
+    async def release(self):
+        async with self._condition():
+            self.active -= 1
+            self._cond.notify()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+        return False
@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+"""
+ASGI serving mode for high-concurrency chat serving.
+
+Exposes the same routes as the Flask app in `server.py` (`/api/chat`,
+`/api/chat/stream`, `/api/chat/batch`, the `/admin/*` endpoints and the
+static frontend), but upstream completions are awaited on an
+`upstream.AsyncUpstreamClient` instead of holding a worker thread for the
+length of the call, so one process can keep thousands of conversations in
+flight. Routing, the local responder, the response cache and the runtime
+API key are shared with `server.py`; the Flask app and its test client keep
+working unchanged. Shared work that can block is run with
+`asyncio.to_thread` so it never stalls the event loop: local answers
+(catalog and FAQ lookups), relevance scoring, the response cache's SQLite
+tier, shared-state polls, admin writes and capture log writes.
+
+Run (needs an ASGI server, e.g. `pip install uvicorn`):
+  uvicorn asgi:app --host 127.0.0.1 --port 5000
+"""
+import asyncio
+import json
+import math
+import os
+import time
+import urllib.parse
+
+import admission
+import capture
+import deadlines
+import keypool
+import metrics
+import profiling
+import server
+import singleflight
+import upstream
+
+inflight = singleflight.AsyncSingleFlight(max_waiters=server.inflight.max_waiters)
+
+# same limits as the Flask app's gate; the per-client rate limiter is shared
+upstream_gate = admission.AsyncConcurrencyGate(
+    limit=server.upstream_gate.limit,
+    max_queue=server.upstream_gate.max_queue,
+    timeout=server.upstream_gate.timeout,
+)
+server.upstream_gates.append(upstream_gate)
+# shares the latency window with the Flask app's hedger
+hedger = deadlines.AsyncHedger(server.upstream_latency, enabled=server.hedger.enabled)
+
+# async upstream clients by API key; keys come from server.key_pool
+_upstream_clients = {}
+
+
+def get_upstream(api_key):
+    """Return the shared async upstream client for `api_key` (see server.get_upstream)."""
+    client = _upstream_clients.get(api_key)
+    if client is None:
+        client = _upstream_clients[api_key] = upstream.AsyncUpstreamClient(
+            api_key,
+            base_url=os.environ.get('OPENAI_BASE_URL', upstream.DEFAULT_BASE_URL),
+            chat_model=server.UPSTREAM_MODEL,
+            observer=server._observe_key,
+        )
+    return client
+
+
+async def _cache_get(key):
+    # the SQLite tier blocks; the in-memory LRU alone does not need a thread
+    if server.chat_cache.persistent:
+        return await asyncio.to_thread(server.chat_cache.get, key)
+    return server.chat_cache.get(key)
+
+
+async def _cache_set(key, value):
+    if server.chat_cache.persistent:
+        return await asyncio.to_thread(server.chat_cache.set, key, value)
+    server.chat_cache.set(key, value)
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.body = body
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        self.remote_addr = (scope.get('client') or ('',))[0]
+
+    def get_json(self):
+        try:
+            data = json.loads(self.body or b'null')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _respond(send, status, body, content_type='application/json', headers=()):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    raw_headers = [(b'content-type', content_type.encode('latin-1')),
+                   (b'content-length', str(len(body)).encode('latin-1'))]
+    raw_headers += [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _respond_stream(send, chunks, content_type, headers=()):
+    raw_headers = [(b'content-type', content_type.encode('latin-1'))]
+    raw_headers += [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': raw_headers})
+    async for chunk in chunks:
+        await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def _retry_headers(body, status):
+    if status != 429:
+        return ()
+    return [('retry-after', str(max(1, math.ceil(body.get('retry_after', 1)))))]
+
+
+def _cache_bypassed(req, data):
+    return data.get('cache') is False or 'no-cache' in req.headers.get('cache-control', '')
+
+
+def _admin_denied(req):
+    """Return (body, status) unless this is an authorized localhost admin call."""
+    if req.remote_addr not in ('127.0.0.1', '::1', 'localhost'):
+        return {'error': 'admin endpoints only allowed from localhost'}, 403
+    admin_token = req.headers.get('x-admin-token') or (req.get_json() or {}).get('admin_token')
+    if not admin_token or admin_token != os.environ.get('ADMIN_TOKEN'):
+        return {'error': 'unauthorized'}, 401
+    return None
+
+
+async def _upstream_reply(message, api_key, history=None, deadline=None):
+    client = get_upstream(api_key)
+    if deadline is None:
+        deadline = time.monotonic() + server.DEADLINE
+
+    async def attempt(deadline):
+        sent = time.perf_counter()
+        reply = await client.complete(server.SYSTEM_PROMPT, message, max_tokens=250, history=history,
+                                      deadline=deadline)
+        if server.capture_log is not None:
+            await asyncio.to_thread(server.capture_log.upstream, message, reply, time.perf_counter() - sent)
+        return reply
+
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        cooldown = server.key_pool.cooldown_left(api_key)
+        if cooldown > 0:
+            raise admission.Overloaded(keypool.COOLDOWN, cooldown)
+        await upstream_gate.acquire(deadline - time.monotonic())
+        try:
+            with server.key_pool.using(api_key):
+                reply = await hedger.call(attempt, deadline, gate=upstream_gate)
+        finally:
+            await upstream_gate.release()
+        outcome = 'ok'
+    except admission.Overloaded:
+        outcome = 'shed'
+        raise
+    except (TimeoutError, asyncio.TimeoutError):
+        outcome = 'timeout'
+        raise
+    finally:
+        server.UPSTREAM_SECONDS.observe(time.perf_counter() - start, variant=client.variant or 'unknown',
+                                        outcome=outcome)
+    return await asyncio.to_thread(server._guard_reply, message, reply)
+
+
+async def _upstream_answer(data, api_key, bypass_cache=False, session_id=None, deadline=None):
+    message = data['message']
+    cutoff = (deadline or server.request_deadline(data)) - server.DEADLINE_MARGIN
+    history = server._history(session_id, message)
+    key = server._chat_key(message, history)
+    if not bypass_cache:
+        cached = await _cache_get(key)
+        if cached is not None:
+            server.CHAT_RESPONSES.inc(source='cached')
+            return {'reply': cached, 'cached': True}, 200
+    try:
+        reply, shared = await inflight.do(key, lambda: _upstream_reply(message, api_key, history, cutoff),
+                                          timeout=max(0.0, cutoff - time.monotonic()))
+    except (TimeoutError, asyncio.TimeoutError):
+        return await asyncio.to_thread(server._deadline_answer, message)
+    except admission.Overloaded as e:
+        return await asyncio.to_thread(server._overloaded_answer, message, e.reason, e.retry_after)
+    except upstream.UpstreamError as e:
+        if e.status != 429:
+            return server._upstream_failed(e)
+        return await asyncio.to_thread(server._overloaded_answer, message, 'upstream_429',
+                                       server._upstream_retry_after(e))
+    except Exception as e:
+        return server._upstream_failed(e)
+    if not shared:
+        await _cache_set(key, reply)
+    server.CHAT_RESPONSES.inc(source='coalesced' if shared else 'upstream')
+    return {'reply': reply}, 200
+
+
+async def handle_chat(data, bypass_cache=False, session_id=None, deadline=None):
+    api_key = server._api_key()
+    # catalog lookups and FAQ scoring
+    answered = await asyncio.to_thread(server._local_answer, data, api_key)
+    if answered is None:
+        answered = await _upstream_answer(data, api_key, bypass_cache, session_id, deadline)
+    server._record_turn(session_id, data, *answered)
+    return answered
+
+
+async def api_chat(req, send):
+    with server.CHAT_TOTAL.time():
+        with server.PHASE_PARSE.time():
+            data = req.get_json() or {}
+        deadline = server.request_deadline(data, req.headers.get('x-deadline-ms'))
+        session_id = server._session_id(data, req.headers.get('x-session-id'))
+        answered = server._rate_limited(req.remote_addr, session_id)
+        if answered is None:
+            answered = await handle_chat(data, _cache_bypassed(req, data), session_id, deadline)
+        body, status = answered
+        with server.PHASE_SERIALIZE.time():
+            raw = json.dumps(body).encode('utf-8')
+        await _respond(send, status, raw, headers=_retry_headers(body, status))
+
+
+async def api_chat_stream(req, send):
+    data = req.get_json() or {}
+    cutoff = server.request_deadline(data, req.headers.get('x-deadline-ms')) - server.DEADLINE_MARGIN
+    session_id = server._session_id(data, req.headers.get('x-session-id'))
+    answered = server._rate_limited(req.remote_addr, session_id)
+    api_key = server._api_key()
+    if answered is None:
+        answered = await asyncio.to_thread(server._local_answer, data, api_key)
+    sse = server._sse
+    headers = [('cache-control', 'no-cache'), ('x-accel-buffering', 'no')]
+
+    async def events(*items):
+        for item in items:
+            yield item
+
+    async def single(body, status):
+        if status != 200:
+            return await _respond(send, status, body, headers=_retry_headers(body, status))
+        server._record_turn(session_id, data, body, status)
+        return await _respond_stream(send, events(sse('token', {'text': body.get('reply', '')}), sse('done', body)),
+                                     'text/event-stream', headers)
+
+    if answered is not None:
+        return await single(*answered)
+
+    message = data['message']
+    history = server._history(session_id, message)
+    key = server._chat_key(message, history)
+    if not _cache_bypassed(req, data):
+        cached = await _cache_get(key)
+        if cached is not None:
+            server._record_turn(session_id, data, {'reply': cached}, 200)
+            return await _respond_stream(send, events(sse('token', {'text': cached}),
+                                                      sse('done', {'reply': cached, 'cached': True})),
+                                         'text/event-stream', headers)
+
+    cooldown = server.key_pool.cooldown_left(api_key)
+    if cooldown > 0:
+        return await single(*await asyncio.to_thread(server._overloaded_answer, message, keypool.COOLDOWN, cooldown))
+    # the slot is taken before responding, so a full queue can still be a 429
+    try:
+        await upstream_gate.acquire(cutoff - time.monotonic())
+    except (TimeoutError, asyncio.TimeoutError):
+        return await single(*await asyncio.to_thread(server._deadline_answer, message))
+    except admission.Overloaded as e:
+        return await single(*await asyncio.to_thread(server._overloaded_answer, message, e.reason, e.retry_after))
+
+    async def generate():
+        parts = []
+        sent = time.perf_counter()
+        try:
+            async for piece in get_upstream(api_key).stream(server.SYSTEM_PROMPT, message, max_tokens=250,
+                                                            history=history, deadline=cutoff):
+                parts.append(piece)
+                yield sse('token', {'text': piece})
+        except (upstream.UpstreamError, TimeoutError, asyncio.TimeoutError) as e:
+            timed_out = not isinstance(e, upstream.UpstreamError)
+            if parts or not (timed_out or e.status == 429):
+                yield server._sse_error(e)
+                return
+            if timed_out:
+                body, status = await asyncio.to_thread(server._deadline_answer, message)
+            else:
+                body, status = await asyncio.to_thread(server._overloaded_answer, message, 'upstream_429',
+                                                       server._upstream_retry_after(e))
+            if status != 200:
+                yield sse('error', body)
+                return
+            server._record_turn(session_id, data, body, status)
+            yield sse('token', {'text': body.get('reply', '')})
+            yield sse('done', body)
+            return
+        except Exception as e:
+            yield server._sse_error(e)
+            return
+        if server.capture_log is not None:
+            await asyncio.to_thread(server.capture_log.upstream, message, ''.join(parts), time.perf_counter() - sent)
+        streamed = ''.join(parts).strip()
+        reply = await asyncio.to_thread(server._guard_reply, message, streamed)
+        if reply != streamed:
+            yield sse('replace', {'text': reply})
+        await _cache_set(key, reply)
+        server._record_turn(session_id, data, {'reply': reply}, 200)
+        yield sse('done', {'reply': reply})
+
+    try:
+        with server.key_pool.using(api_key):
+            await _respond_stream(send, generate(), 'text/event-stream', headers)
+    finally:
+        await upstream_gate.release()
+
+
+async def api_chat_batch(req, send):
+    data = req.get_json() or {}
+    session_id = server._session_id(data, req.headers.get('x-session-id'))
+    limited = server._rate_limited(req.remote_addr, session_id)
+    if limited is not None:
+        return await _respond(send, 429, limited[0], headers=_retry_headers(*limited))
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return await _respond(send, 400, {'error': 'no items'})
+    if len(items) > server.BATCH_MAX_ITEMS:
+        return await _respond(send, 413, {'error': 'too many items', 'max_items': server.BATCH_MAX_ITEMS})
+    bypass = _cache_bypassed(req, data)
+    api_key = server._api_key()
+    # per-item deadlines from when an item gets a slot, as in the Flask app
+    budget = server.request_deadline(data, req.headers.get('x-deadline-ms'), now=0.0)
+    batch_deadline = time.monotonic() + server.BATCH_DEADLINE
+    slots = asyncio.Semaphore(server.BATCH_WORKERS)
+    results, upstream, limited = await asyncio.to_thread(server._batch_plan, items, api_key, req.remote_addr,
+                                                         session_id)
+    headers = _retry_headers(*limited) if limited is not None else ()
+
+    async def answer(i, item):
+        async with slots:
+            deadline = server._batch_item_deadline(budget, batch_deadline)
+            if deadline is None:
+                return i, await asyncio.to_thread(server._deadline_answer, item['message'])
+            return i, await _upstream_answer(item, api_key, bypass, None, deadline)
+
+    def result(i, answered):
+        body, status = answered
+        return dict(body, index=i, status=status)
+
+    tasks = [asyncio.ensure_future(answer(i, item)) for i, item in upstream]
+    if data.get('stream') or 'application/x-ndjson' in req.headers.get('accept', ''):
+        async def generate():
+            for i, answered in enumerate(results):
+                if answered is not None:
+                    yield json.dumps(result(i, answered)) + '\n'
+            for done in asyncio.as_completed(tasks):
+                yield json.dumps(result(*await done)) + '\n'
+        return await _respond_stream(send, generate(), 'application/x-ndjson', headers=headers)
+    for i, answered in await asyncio.gather(*tasks):
+        results[i] = answered
+    await _respond(send, 200, {'results': [result(i, answered) for i, answered in enumerate(results)]},
+                   headers=headers)
+
+
+async def admin_set_key(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    key = (req.get_json() or {}).get('key')
+    if not key:
+        return await _respond(send, 400, {'error': 'no key provided'})
+    await asyncio.to_thread(server.set_single_key, key)
+    await _respond(send, 200, {'ok': True})
+
+
+async def admin_clear_key(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    await asyncio.to_thread(server.set_single_key, None)
+    await _respond(send, 200, {'ok': True})
+
+
+async def admin_keys(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    await _respond(send, 200, {'keys': server.key_pool.stats()})
+
+
+async def admin_add_key(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    payload = req.get_json() or {}
+    key = payload.get('key')
+    if not key:
+        return await _respond(send, 400, {'error': 'no key provided'})
+    await _respond(send, 200, {'ok': True, 'id': await asyncio.to_thread(server.add_key, key, payload.get('id'))})
+
+
+async def admin_drain_key(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    if not await asyncio.to_thread(server.drain_key, (req.get_json() or {}).get('id')):
+        return await _respond(send, 404, {'error': 'unknown key id'})
+    await _respond(send, 200, {'ok': True})
+
+
+async def admin_remove_key(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    removed = await asyncio.to_thread(server.remove_key, (req.get_json() or {}).get('id'))
+    if removed is None:
+        return await _respond(send, 404, {'error': 'unknown key id'})
+    client = _upstream_clients.pop(removed, None)
+    if client is not None:
+        await client.aclose()
+    await _respond(send, 200, {'ok': True})
+
+
+async def admin_cache_stats(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    await _respond(send, 200, server.chat_cache.stats())
+
+
+async def admin_cache_clear(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    await asyncio.to_thread(server.clear_chat_cache)
+    await _respond(send, 200, {'ok': True})
+
+
+async def admin_inflight_stats(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    await _respond(send, 200, inflight.stats())
+
+
+async def admin_admission_stats(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    await _respond(send, 200, {'rate_limiter': server.rate_limiter.stats(), 'upstream': upstream_gate.stats()})
+
+
+async def admin_catalog_reload(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    try:
+        # parsing a large catalog file should not stall the event loop
+        await asyncio.get_running_loop().run_in_executor(None, server.product_catalog.load)
+    except (OSError, ValueError, KeyError) as e:
+        return await _respond(send, 500, {'error': 'catalog reload failed', 'details': str(e)})
+    await asyncio.to_thread(server.catalog_reloaded)
+    await _respond(send, 200, {'ok': True, 'version': server.product_catalog.version,
+                               'items': len(server.product_catalog)})
+
+
+async def admin_profile_status(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    await _respond(send, 200, profiler.status())
+
+
+async def admin_profile_start(req, send):
+    """Profile the chat routes of this app; the body is as for server.py's route."""
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    if profiler.active:
+        return await _respond(send, 409, {'error': 'a profiling session is already running'})
+    try:
+        status = profiler.start(**server._profile_options(req.get_json() or {}))
+    except (TypeError, ValueError) as e:
+        return await _respond(send, 400, {'error': str(e)})
+    await _respond(send, 200, status)
+
+
+async def admin_profile_stop(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    await _respond(send, 200, profiler.stop())
+
+
+async def admin_profile_result(req, send):
+    denied = _admin_denied(req)
+    if denied:
+        return await _respond(send, denied[1], denied[0])
+    query = urllib.parse.parse_qs(req.scope.get('query_string', b'').decode('latin-1'))
+    try:
+        data, content_type, filename = profiler.result((query.get('format') or [None])[0])
+    except LookupError as e:
+        return await _respond(send, 404, {'error': str(e)})
+    except ValueError as e:
+        return await _respond(send, 400, {'error': str(e)})
+    await _respond(send, 200, data, content_type,
+                   headers=[('content-disposition', 'attachment; filename=%s' % filename)])
+
+
+async def api_catalog(req, send):
+    etag = '"%s"' % server.product_catalog.version
+    headers = [('etag', etag), ('cache-control', 'no-cache')]
+    if etag in req.headers.get('if-none-match', ''):
+        return await _respond(send, 304, b'', headers=headers)
+    await _respond(send, 200, await asyncio.to_thread(server.catalog_snapshot), headers=headers)
+
+
+async def metrics_endpoint(req, send):
+    if not server.registry.enabled:
+        return await _respond(send, 404, {'error': 'metrics disabled'})
+    await _respond(send, 200, server.registry.render().encode('utf-8'), metrics.CONTENT_TYPE)
+
+
+async def static_file(req, send):
+    status, headers, body = server.assets.respond(
+        req.path, req.headers.get('accept-encoding'), req.headers.get('if-none-match'))
+    headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body if req.method != 'HEAD' else b''})
+
+
+ROUTES = {
+    ('POST', '/api/chat'): api_chat,
+    ('POST', '/api/chat/stream'): api_chat_stream,
+    ('POST', '/api/chat/batch'): api_chat_batch,
+    ('GET', '/api/catalog'): api_catalog,
+    ('POST', '/admin/set_key'): admin_set_key,
+    ('POST', '/admin/clear_key'): admin_clear_key,
+    ('GET', '/admin/keys'): admin_keys,
+    ('POST', '/admin/keys'): admin_add_key,
+    ('POST', '/admin/keys/drain'): admin_drain_key,
+    ('POST', '/admin/keys/remove'): admin_remove_key,
+    ('GET', '/admin/cache'): admin_cache_stats,
+    ('POST', '/admin/cache/clear'): admin_cache_clear,
+    ('GET', '/admin/inflight'): admin_inflight_stats,
+    ('GET', '/admin/admission'): admin_admission_stats,
+    ('POST', '/admin/catalog/reload'): admin_catalog_reload,
+    ('GET', '/admin/profile'): admin_profile_status,
+    ('POST', '/admin/profile/start'): admin_profile_start,
+    ('POST', '/admin/profile/stop'): admin_profile_stop,
+    ('GET', '/admin/profile/result'): admin_profile_result,
+    ('GET', '/metrics'): metrics_endpoint,
+}
+
+
+async def _dispatch(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for client in list(_upstream_clients.values()):
+                    await client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    if server.shared is not None and server.shared.due():
+        # a SQLite query, and adopting what changed may reload the catalog
+        await asyncio.to_thread(server._poll_shared)
+    req = Request(scope, await _read_body(receive))
+    handler = ROUTES.get((req.method, req.path))
+    if handler is None and req.method in ('GET', 'HEAD'):
+        handler = static_file
+    if handler is None:
+        return await _respond(send, 405, {'error': 'method not allowed'})
+    if req.path.startswith('/api/') and server.product_catalog.version:
+        send = _with_catalog_version(send)
+    if server.capture_log is None or req.path not in capture.ROUTES:
+        return await handler(req, send)
+    await _captured(handler, req, send)
+
+
+class App:
+    """The ASGI callable; like Flask's `app.wsgi_app`, `asgi_app` is what a
+    profiling session wraps while it runs."""
+
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        await self.asgi_app(scope, receive, send)
+
+
+app = App(_dispatch)
+# admin-started profiling sessions over the chat routes; see profiling.py
+profiler = profiling.AsgiProfiler(app)
+
+
+def _with_catalog_version(send):
+    # replies cached by the frontend are dropped when this changes (as in server.py)
+    version = server.product_catalog.version.encode('latin-1')
+
+    async def versioned_send(message):
+        if message['type'] == 'http.response.start':
+            message = dict(message, headers=list(message['headers']) + [(b'x-catalog-version', version)])
+        await send(message)
+    return versioned_send
+
+
+async def _captured(handler, req, send):
+    """Run `handler` and log the request to server.capture_log."""
+    status = []
+    started = time.time()
+    start = time.perf_counter()
+
+    async def capture_send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        await send(message)
+
+    try:
+        await handler(req, capture_send)
+    finally:
+        # redaction looks up model names and the write may rotate the file
+        await asyncio.to_thread(server.capture_log.request, req.path, req.body, req.headers,
+                                status[0] if status else None, time.perf_counter() - start, started)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('asgi.py needs an ASGI server: pip install uvicorn')
+    uvicorn.run(app, host='127.0.0.1', port=int(os.environ.get('PORT', 5000)))
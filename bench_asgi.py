@@ -0,0 +1,118 @@
+"""
+Concurrency load test for the ASGI server mode.
+
+Drives `asgi.app` in-process with N concurrent `/api/chat` requests against
+a local asyncio stub upstream that answers after a fixed delay, and reports
+wall time, throughput and latency percentiles. With a 2 s upstream, a
+thread-per-request server needs N threads to finish in ~2 s; the ASGI mode
+does it on one event loop in one process.
+
+  python bench_asgi.py                       # 10, 100, 1000 concurrent, 2 s upstream
+  python bench_asgi.py --concurrency 1000 --latency 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import admission
+import asgi
+import response_cache
+import server
+
+
+async def _stub_upstream(latency):
+    """Minimal keep-alive chat completions stub that sleeps `latency` seconds."""
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in head.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                payload = json.loads(await reader.readexactly(length))
+                await asyncio.sleep(latency)
+                reply = 'Thrift tip: check the label of ' + payload['messages'][-1]['content']
+                body = json.dumps({'choices': [{'message': {'content': reply}}]}).encode('utf-8')
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s'
+                             % (len(body), body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    srv = await asyncio.start_server(handle, '127.0.0.1', 0, backlog=4096)
+    return srv, 'http://127.0.0.1:%d/v1' % srv.sockets[0].getsockname()[1]
+
+
+async def _request(i):
+    body = json.dumps({'message': 'vintage item %d' % i}).encode('utf-8')
+    scope = {'type': 'http', 'method': 'POST', 'path': '/api/chat', 'client': ('127.0.0.1', 0),
+             'headers': [(b'content-type', b'application/json')]}
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    start = time.perf_counter()
+    await asgi.app(scope, receive, send)
+    return status[0], time.perf_counter() - start
+
+
+def _pct(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100.0 * len(sorted_values)))]
+
+
+async def run(concurrency, latency):
+    srv, base_url = await _stub_upstream(latency)
+    os.environ['OPENAI_BASE_URL'] = base_url
+    server.runtime_api_key = 'sk-bench'
+    # distinct messages and no cache, so every request really goes upstream
+    server.chat_cache = response_cache.ResponseCache(max_entries=0)
+    # measure the event loop, not admission control: one client address and
+    # every request admitted upstream at once
+    server.rate_limiter = admission.RateLimiter(rate=0)
+    asgi.upstream_gate = admission.AsyncConcurrencyGate(limit=concurrency, max_queue=0)
+    asgi._upstream_clients = {}
+    try:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[_request(i) for i in range(concurrency)])
+        wall = time.perf_counter() - start
+    finally:
+        for client in asgi._upstream_clients.values():
+            await client.aclose()
+        srv.close()
+        await srv.wait_closed()
+    latencies = sorted(t for _, t in results)
+    errors = sum(1 for status, _ in results if status != 200)
+    return {
+        'concurrency': concurrency,
+        'upstream_latency_s': latency,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(concurrency / wall, 1),
+        'p50_s': round(_pct(latencies, 50), 3),
+        'p99_s': round(_pct(latencies, 99), 3),
+        'errors': errors,
+        'upstream_connections': sum(client.created for client in asgi._upstream_clients.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='*', default=[10, 100, 1000])
+    parser.add_argument('--latency', type=float, default=2.0)
+    args = parser.parse_args()
+    for n in args.concurrency:
+        print(json.dumps(asyncio.run(run(n, args.latency))))
+
+
+if __name__ == '__main__':
+    main()
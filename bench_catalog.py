@@ -0,0 +1,82 @@
+"""
+Lookup benchmark for the catalog store.
+
+Generates a synthetic catalog of N items, loads it, and times exact, prefix,
+fuzzy and choices lookups and finding model names in a message (`mentions`),
+printing one JSON line per size.
+
+  python bench_catalog.py                 # 1k, 10k, 100k items
+  python bench_catalog.py --sizes 100000 --lookups 2000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import catalog
+
+_BRANDS = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Soylent', 'Hooli', 'Vandelay', 'Wonka']
+_CATEGORIES = ['laptop', 'jacket', 'lamp', 'camera', 'watch', 'guitar', 'chair', 'bag']
+
+
+def _items(n):
+    rnd = random.Random(n)
+    return [{
+        'sku': 'SKU-%07d' % i,
+        'name': '%s %s %d' % (rnd.choice(_BRANDS), rnd.choice(['Pro', 'Air', 'Max', 'Mini', 'Classic']), i),
+        'category': _CATEGORIES[i % len(_CATEGORIES)],
+        'rank': rnd.randint(1, 1000),
+        'summary': 'summary %d' % i,
+        'description': 'description %d' % i,
+    } for i in range(n)]
+
+
+def _typo(name, rnd):
+    i = rnd.randrange(len(name))
+    return name[:i] + name[i + 1:]
+
+
+def _per_call_us(fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(a)
+    return round((time.perf_counter() - start) / len(args) * 1e6, 1)
+
+
+def run(n, lookups):
+    items = _items(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'catalog.json')
+        with open(path, 'w') as f:
+            json.dump({'version': 1, 'items': items}, f)
+        start = time.perf_counter()
+        cat = catalog.Catalog(path)
+        load_s = time.perf_counter() - start
+
+    rnd = random.Random(0)
+    names = [rnd.choice(items)['name'] for _ in range(lookups)]
+    return {
+        'items': n,
+        'fuzzy_index': cat.fuzzy_index,
+        'load_s': round(load_s, 3),
+        'exact_us': _per_call_us(cat.exact, names),
+        'prefix_us': _per_call_us(lambda s: cat.prefix(s[:6]), names),
+        'fuzzy_us': _per_call_us(cat.fuzzy, [_typo(s, rnd) for s in names[:max(1, lookups // 10)]]),
+        'choices_us': _per_call_us(cat.choices, [rnd.choice(_CATEGORIES) for _ in range(lookups)]),
+        'mentions_us': _per_call_us(cat.mentions, ['is the %s any good?' % s for s in names]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+    for n in args.sizes:
+        print(json.dumps(run(n, args.lookups)))
+
+
+if __name__ == '__main__':
+    main()
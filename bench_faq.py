@@ -0,0 +1,103 @@
+"""
+Build and query benchmark for the FAQ retrieval index.
+
+Builds indexes of the bundled corpus padded with synthetic Q&A entries
+(1k, 100k and 1M by default) in a temporary directory, then times queries
+against the memory-mapped index. Prints one JSON line per size with build
+time, index size on disk, open time and query latency percentiles:
+
+  python bench_faq.py
+  python bench_faq.py --entries 1000000 --queries 2000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import faq
+
+ITEMS = ['lamp', 'chair', 'dresser', 'jacket', 'coat', 'ring', 'necklace', 'watch', 'vase', 'bowl', 'teapot',
+         'record', 'camera', 'quilt', 'rug', 'mirror', 'clock', 'handbag', 'boots', 'sweater', 'jeans', 'skillet',
+         'typewriter', 'radio', 'painting', 'print', 'doll', 'toy', 'book', 'laptop', 'bicycle', 'desk', 'table']
+MATERIALS = ['brass', 'silver', 'teak', 'oak', 'walnut', 'leather', 'wool', 'cashmere', 'porcelain', 'glass',
+             'cast iron', 'copper', 'bakelite', 'ceramic', 'denim', 'silk', 'pine', 'chrome', 'enamel', 'pewter']
+ERAS = ['victorian', 'art deco', '1950s', '1960s', '1970s', '1980s', 'mid-century', 'edwardian', 'georgian', '1990s']
+ASKS = ['How do I date a {era} {material} {item}?', 'What is a {era} {material} {item} worth?',
+        'How do I clean a {material} {item}?', 'Where can I sell a {era} {item}?',
+        'How can I tell if a {material} {item} is {era}?', 'Is a {material} {item} from the {era} collectible?']
+SAYS = ['Check the maker mark on the {item} and compare it with dated {era} references.',
+        'Clean {material} gently and test any cleaner on a hidden spot of the {item} first.',
+        'Look at sold listings for {era} {material} pieces in similar condition to price the {item}.',
+        'Original hardware and finish add value to a {era} {item}; repairs and replaced parts lower it.']
+QUERIES = ['is my ring real gold', 'how old is my teak dresser', 'clean a brass lamp', 'sell a 1970s camera',
+           'what is my art deco silver vase worth', 'best day to go to the thrift store', 'used laptop checks',
+           'how to date levis', 'is this chair antique', 'get smell out of thrifted clothes']
+
+
+def synthetic(n, seed=0):
+    rnd = random.Random(seed)
+    for _ in range(n):
+        words = {'item': rnd.choice(ITEMS), 'material': rnd.choice(MATERIALS), 'era': rnd.choice(ERAS)}
+        answer = ' '.join(s.format(**words) for s in rnd.sample(SAYS, 2))
+        yield rnd.choice(ASKS).format(**words), answer
+
+
+def corpus(n):
+    real = list(faq.read_entries(faq.DEFAULT_SOURCE))
+    yield from real
+    yield from synthetic(max(0, n - len(real)))
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+def run(n, queries, workdir):
+    path = os.path.join(workdir, 'faq-%d' % n)
+    start = time.perf_counter()
+    faq.build(corpus(n), path)
+    build_s = time.perf_counter() - start
+    size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+    start = time.perf_counter()
+    index = faq.FaqIndex(path)
+    open_ms = (time.perf_counter() - start) * 1000
+    latencies = []
+    answered = 0
+    for i in range(queries):
+        start = time.perf_counter()
+        hits = index.search(QUERIES[i % len(QUERIES)], k=5)
+        latencies.append(time.perf_counter() - start)
+        answered += bool(hits)
+    return {
+        'entries': len(index),
+        'build_s': round(build_s, 2),
+        'index_mb': round(size / 1e6, 1),
+        'open_ms': round(open_ms, 2),
+        'queries': queries,
+        'answered': answered,
+        'p50_ms': round(pct(latencies, 50) * 1000, 3),
+        'p99_ms': round(pct(latencies, 99) * 1000, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, nargs='*', default=[1000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='bench-faq-')
+    try:
+        for n in args.entries:
+            print(json.dumps(run(n, args.queries, workdir)), flush=True)
+            shutil.rmtree(os.path.join(workdir, 'faq-%d' % n), ignore_errors=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
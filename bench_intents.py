@@ -0,0 +1,79 @@
+"""
+Micro-benchmark for the intent engine.
+
+Measures messages/sec for `IntentEngine.classify` with 10, 1k and 50k
+registered keywords, next to the old style of running `any(k in text ...)`
+over every keyword list. Run:
+
+  python bench_intents.py
+"""
+import random
+import string
+import time
+
+import intents
+
+MESSAGES = [
+    'hi',
+    'laptop',
+    'Tell me about MacBook Air',
+    'How do I estimate the value of a vintage lamp?',
+    'any thrift tips for finding good denim jackets at the weekend market',
+    'I found an old ceramic bowl with a stamp on the bottom, what is this?',
+    'thanks, bye',
+    'what is the weather going to be like tomorrow afternoon in the city',
+]
+
+
+def _random_keywords(n, seed=0):
+    rnd = random.Random(seed)
+    words = set()
+    while len(words) < n:
+        words.add(''.join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(5, 12))))
+    return sorted(words)
+
+
+def build_engine(n_patterns):
+    # the real keywords first (truncated for the smallest size), padded with
+    # random ones so the automaton has the requested number of patterns
+    engine = intents.IntentEngine()
+    real = list(intents.DEFAULT_KEYWORDS)
+    real += [(name, intents.MODEL, False) for name in intents.DEFAULT_MODELS]
+    for kw, intent, whole_word in real[:n_patterns]:
+        engine.add(kw, intent, whole_word=whole_word)
+    for kw in _random_keywords(max(0, n_patterns - len(engine))):
+        engine.add(kw, intents.TIPS)
+    return engine.build()
+
+
+def _time(fn, messages, min_seconds=0.5):
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for m in messages:
+            fn(m)
+        count += len(messages)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return count / elapsed
+
+
+def main():
+    print('%10s %18s %18s %10s' % ('patterns', 'engine msg/s', 'linear msg/s', 'build s'))
+    for n in (10, 1000, 50000):
+        t0 = time.perf_counter()
+        engine = build_engine(n)
+        build_s = time.perf_counter() - t0
+        keywords = [p[0] for p in engine._patterns]
+
+        def linear(text, keywords=keywords):
+            t = text.lower()
+            return any(k in t for k in keywords)
+
+        engine_rate = _time(engine.classify, MESSAGES)
+        linear_rate = _time(linear, MESSAGES, min_seconds=0.2)
+        print('%10d %18.0f %18.0f %10.3f' % (len(engine), engine_rate, linear_rate, build_s))
+
+
+if __name__ == '__main__':
+    main()
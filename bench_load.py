@@ -0,0 +1,308 @@
+"""
+Load and latency benchmark for /api/chat.
+
+Sends a configurable mix of chat requests at several concurrency levels,
+either in-process through `server.app.test_client()` or over real HTTP
+(against a server this script starts, or any `--url`). Upstream requests go
+to a local stub that can add latency, jitter and errors. Each level prints
+one JSON line with throughput, error rate and p50/p95/p99 latency, overall
+and per message kind.
+
+  python bench_load.py                                    # in-process, 1/8/32 workers
+  python bench_load.py --mode http --concurrency 16 --requests 2000
+  python bench_load.py --mix greeting=1,upstream=4 --upstream-latency 0.05 --upstream-error-rate 0.02
+  python bench_load.py --upstream-jitter 2 --deadline-ms 500 --hedge   # bound p99 of a slow tail
+  python bench_load.py --out baseline.json                # record a baseline
+  python bench_load.py --baseline baseline.json           # exit 1 on regression
+
+Message kinds: greeting, laptop, select (pick from the choices list),
+generic (rule-based fallback) and upstream (unique message, cache bypassed,
+answered by the stub).
+"""
+import argparse
+import concurrent.futures
+import http.client
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import admission
+import server
+from stub_upstream import StubUpstream
+
+KINDS = ('greeting', 'laptop', 'select', 'generic', 'upstream')
+DEFAULT_MIX = 'greeting=2,laptop=1,select=1,generic=1,upstream=5'
+
+# a run regresses when a latency percentile grows, or throughput drops, by
+# more than the tolerance, or the error rate rises by more than this much
+ERROR_RATE_SLACK = 0.01
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError('unknown message kind %r (expected one of %s)' % (kind, ', '.join(KINDS)))
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def make_payload(kind, i):
+    if kind == 'greeting':
+        return {'message': 'hi'}
+    if kind == 'laptop':
+        return {'message': 'which laptop should I get?'}
+    if kind == 'select':
+        return {'message': '', 'action': 'select', 'selection': 'Dell XPS 13'}
+    if kind == 'generic':
+        return {'message': 'qwerty %d' % i, 'local': True}
+    return {'message': 'vintage item %d' % i, 'cache': False}
+
+
+def workload(mix, n, seed=0):
+    """Return a shuffled list of n (kind, payload) pairs drawn from `mix`."""
+    rnd = random.Random(seed)
+    kinds = list(mix)
+    picks = rnd.choices(kinds, weights=[mix[k] for k in kinds], k=n)
+    return [(kind, make_payload(kind, i)) for i, kind in enumerate(picks)]
+
+
+class InProcessTransport:
+    """Posts through Flask test clients, one per worker thread."""
+
+    name = 'inproc'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def post(self, payload, path='/api/chat', headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = server.app.test_client()
+        resp = client.post(path, json=payload, headers=headers)
+        # read streamed bodies to the end, and close so the server side finishes
+        resp.get_data()
+        resp.close()
+        return resp.status_code
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """Posts over keep-alive HTTP connections, one per worker thread."""
+
+    name = 'http'
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def post(self, payload, path='/api/chat', headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        conn = self._conn()
+        try:
+            conn.request('POST', self.prefix + path, body, {**(headers or {}), 'Content-Type': 'application/json'})
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+
+    def close(self):
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+
+
+def pct(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100.0 * len(sorted_values)))]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _summary(samples):
+    latencies = sorted(t for _, _, t in samples)
+    errors = sum(1 for _, status, _ in samples if status is None or status >= 400)
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'p50_ms': _ms(pct(latencies, 50)),
+        'p95_ms': _ms(pct(latencies, 95)),
+        'p99_ms': _ms(pct(latencies, 99)),
+    }
+
+
+def run_level(transport, concurrency, work):
+    """Send `work` over `transport` from `concurrency` threads; return a result dict."""
+    samples = []
+    lock = threading.Lock()
+    todo = iter(work)
+
+    def worker():
+        while True:
+            with lock:
+                item = next(todo, None)
+            if item is None:
+                return
+            kind, payload = item
+            start = time.perf_counter()
+            try:
+                status = transport.post(payload)
+            except Exception:
+                status = None
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples.append((kind, status, elapsed))
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - start
+
+    overall = _summary(samples)
+    latencies = sorted(t for _, _, t in samples)
+    result = {
+        'mode': transport.name,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(len(samples) / wall, 1) if wall else None,
+        'error_rate': round(overall['errors'] / len(samples), 4) if samples else 0.0,
+        'p50_ms': overall['p50_ms'],
+        'p95_ms': overall['p95_ms'],
+        'p99_ms': overall['p99_ms'],
+        'max_ms': _ms(latencies[-1]) if latencies else None,
+        'by_kind': {},
+    }
+    for kind, group in itertools.groupby(sorted(samples, key=lambda s: s[0]), key=lambda s: s[0]):
+        result['by_kind'][kind] = _summary(list(group))
+    return result
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare runs against baseline runs with the same mode and concurrency.
+
+    Returns a list of regression descriptions (empty when nothing regressed).
+    """
+    base = {(r['mode'], r['concurrency']): r for r in baseline}
+    problems = []
+    for r in results:
+        b = base.get((r['mode'], r['concurrency']))
+        if b is None:
+            continue
+        label = '%s c=%d' % (r['mode'], r['concurrency'])
+        for field in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if b.get(field) and r.get(field) is not None and r[field] > b[field] * (1 + tolerance):
+                problems.append('%s: %s %.3f > baseline %.3f' % (label, field, r[field], b[field]))
+        if b.get('throughput_rps') and r['throughput_rps'] < b['throughput_rps'] * (1 - tolerance):
+            problems.append('%s: throughput_rps %.1f < baseline %.1f' % (label, r['throughput_rps'], b['throughput_rps']))
+        if r['error_rate'] > b.get('error_rate', 0.0) + ERROR_RATE_SLACK:
+            problems.append('%s: error_rate %.4f > baseline %.4f' % (label, r['error_rate'], b.get('error_rate', 0.0)))
+    return problems
+
+
+def _serve_http():
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            pass
+
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, 'http://127.0.0.1:%d' % httpd.server_port
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=['inproc', 'http'], default='inproc')
+    parser.add_argument('--url', help='benchmark a running server instead of starting one (http mode)')
+    parser.add_argument('--concurrency', type=int, nargs='*', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=500, help='requests per concurrency level')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='kind=weight,... (default %(default)s)')
+    parser.add_argument('--upstream-latency', type=float, default=0.02)
+    parser.add_argument('--upstream-jitter', type=float, default=0.0)
+    parser.add_argument('--upstream-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--deadline-ms', type=float, help='request deadline of the in-process server')
+    parser.add_argument('--hedge', action='store_true', help='hedge slow upstream calls (in-process server)')
+    parser.add_argument('--out', help='write all runs to this JSON file (e.g. to record a baseline)')
+    parser.add_argument('--baseline', help='compare against runs in this JSON file; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+
+    stub = StubUpstream(latency=args.upstream_latency, jitter=args.upstream_jitter,
+                        fail_status=500 if args.upstream_error_rate else None,
+                        error_rate=args.upstream_error_rate, seed=args.seed).start()
+    httpd = None
+    if not args.url:
+        # the in-process server answers upstream kinds from the stub
+        os.environ['OPENAI_BASE_URL'] = stub.base_url
+        server.runtime_api_key = 'sk-bench'
+        server._upstream_clients = {}
+        # every simulated client shares one address; measure the server, not the limiter
+        server.rate_limiter = admission.RateLimiter(rate=0)
+        if args.deadline_ms:
+            server.DEADLINE = args.deadline_ms / 1000.0
+        server.hedger.enabled = args.hedge
+    try:
+        if args.mode == 'http':
+            url = args.url
+            if url is None:
+                httpd, url = _serve_http()
+            transport = HttpTransport(url)
+        else:
+            transport = InProcessTransport()
+        results = []
+        for concurrency in args.concurrency:
+            result = run_level(transport, concurrency, workload(mix, args.requests, args.seed))
+            result['mix'] = mix
+            results.append(result)
+            print(json.dumps(result))
+        transport.close()
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+        stub.stop()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'runs': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f)['runs'], args.tolerance)
+        print(json.dumps({'baseline': args.baseline, 'regressions': problems}))
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Headless benchmark for the virtualized chat message list.
+
+Measures what the Tkinter view does per append and per scroll step without
+a display: appending to `MessageModel` (estimate + Fenwick insert), finding
+the visible range at a scroll offset, and replacing estimated heights with
+measured ones. With `--tk` (needs a display) it also drives a real
+`MessageView` and reports the widget count, which stays bounded by the
+window height.
+
+  python bench_message_view.py                  # 1k, 10k, 50k messages
+  python bench_message_view.py --sizes 50000 --tk
+"""
+import argparse
+import json
+import random
+import time
+
+import message_view
+
+VIEWPORT = 600  # px, roughly the chat area of the default 1200x768 window
+
+
+def _text(rnd):
+    return ' '.join('word%d' % rnd.randrange(1000) for _ in range(rnd.randint(3, 120)))
+
+
+def _estimate(text, sender):
+    return message_view.estimate_height(text, chars_per_line=95, line_height=17, padding=28)
+
+
+def run_model(n, scrolls):
+    rnd = random.Random(n)
+    texts = [_text(rnd) for _ in range(n)]
+    model = message_view.MessageModel(_estimate)
+
+    start = time.perf_counter()
+    for i, text in enumerate(texts):
+        model.append(text, 'user' if i % 2 else 'assistant')
+    insert_s = time.perf_counter() - start
+
+    total = model.total_height()
+    offsets = [rnd.uniform(0, max(0, total - VIEWPORT)) for _ in range(scrolls)]
+    widest = 0
+    start = time.perf_counter()
+    for top in offsets:
+        rng = model.visible(top, VIEWPORT, overscan=3)
+        widest = max(widest, len(rng))
+        for index in rng:
+            model.offset(index)
+    scroll_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for index in rnd.sample(range(n), min(n, scrolls)):
+        model.set_height(index, model.height(index) + rnd.randint(-10, 10))
+    measure_s = time.perf_counter() - start
+
+    return {
+        'messages': n,
+        'insert_us': round(insert_s / n * 1e6, 2),
+        'scroll_us': round(scroll_s / scrolls * 1e6, 2),
+        'set_height_us': round(measure_s / min(n, scrolls) * 1e6, 2),
+        'max_visible': widest,
+    }
+
+
+def run_tk(n, scrolls):
+    import tkinter as tk
+
+    root = tk.Tk()
+    root.geometry('1200x%d' % VIEWPORT)
+    view = message_view.MessageView(root)
+    view.pack(fill=tk.BOTH, expand=True)
+    root.update()
+    rnd = random.Random(n)
+
+    start = time.perf_counter()
+    for i in range(n):
+        view.append(_text(rnd), 'user' if i % 2 else 'assistant')
+        if i % 100 == 99:
+            root.update()
+    root.update()
+    insert_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(scrolls):
+        view.canvas.yview_moveto(rnd.random())
+        view._stick_to_bottom = False
+        root.update()
+    scroll_s = time.perf_counter() - start
+    widgets = view.widget_count
+    root.destroy()
+    return {
+        'messages': n,
+        'tk_insert_us': round(insert_s / n * 1e6, 2),
+        'tk_scroll_ms': round(scroll_s / scrolls * 1e3, 3),
+        'widgets': widgets,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000, 50000])
+    parser.add_argument('--scrolls', type=int, default=2000)
+    parser.add_argument('--tk', action='store_true', help='also drive a real MessageView (needs a display)')
+    args = parser.parse_args()
+    for n in args.sizes:
+        result = run_model(n, args.scrolls)
+        if args.tk:
+            result.update(run_tk(n, min(args.scrolls, 200)))
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Accuracy and cost of the reply relevance guard.
+
+Trains `relevance.RelevanceModel` on `data/relevance_train.json` and reports
+accuracy on the held-out `data/relevance_eval.json`, next to the old check
+(any of twelve thrift keywords as a substring). Then times scoring, one
+message per call and in batches, for short messages and for reply-length
+texts. Prints one JSON line per measurement:
+
+  python bench_relevance.py
+  python bench_relevance.py --threshold 0.4 --batch 1 256
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+import relevance
+
+# the substring check the model replaced, kept here for comparison
+OLD_KEYWORDS = ['thrift', 'vintage', 'antique', 'value', 'estimate', 'brand', 'condition', 'zippers',
+                'stains', 'identify', 'label', 'seams']
+
+
+def keyword_accuracy(texts, labels):
+    predicted = np.array([any(k in t.lower() for k in OLD_KEYWORDS) for t in texts])
+    return float(np.mean(predicted == (labels > 0.5)))
+
+
+def _us_per_text(fn, texts, batch, min_seconds=0.3):
+    batches = [texts[i:i + batch] for i in range(0, len(texts), batch)]
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for b in batches:
+            fn(b)
+        count += len(texts)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / count * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--batch', type=int, nargs='*', default=[1, 64, 1024])
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    model = relevance.load(reply_threshold=args.threshold)
+    train_s = time.perf_counter() - start
+    train_texts, train_labels = relevance.load_examples(relevance.TRAIN_PATH)
+    eval_texts, eval_labels = relevance.load_examples(relevance.EVAL_PATH)
+    scores = model.score(eval_texts)
+    predicted = scores >= args.threshold
+    on_topic = eval_labels > 0.5
+    print(json.dumps({
+        'bench': 'accuracy',
+        'threshold': args.threshold,
+        'train_examples': len(train_texts),
+        'eval_examples': len(eval_texts),
+        'train_accuracy': round(model.evaluate(train_texts, train_labels), 4),
+        'eval_accuracy': round(float(np.mean(predicted == on_topic)), 4),
+        'eval_false_refusals': int(np.sum(on_topic & ~predicted)),
+        'eval_false_passes': int(np.sum(~on_topic & predicted)),
+        'keyword_eval_accuracy': round(keyword_accuracy(eval_texts, eval_labels), 4),
+        'train_s': round(train_s, 4),
+    }))
+
+    # reply-length texts: several eval examples joined, about 1000 characters
+    long_texts = [' '.join(eval_texts[i:i + 12]) for i in range(0, len(eval_texts) - 12)]
+    for name, texts in (('short', eval_texts), ('reply', long_texts)):
+        texts = texts * max(1, 1024 // len(texts))
+        for batch in args.batch:
+            print(json.dumps({
+                'bench': 'score',
+                'texts': name,
+                'avg_chars': round(sum(map(len, texts)) / len(texts)),
+                'batch': batch,
+                'us_per_text': round(_us_per_text(model.score, texts, batch), 2),
+            }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Memory and prompt-size benchmark for server-side chat sessions.
+
+Memory: fills a `sessions.SessionStore` with N active sessions of
+`--turns` exchanges each and reports traced memory per level, then keeps
+creating sessions past `max_sessions` to show the total stays flat once
+eviction kicks in.
+
+Prompt size: plays one long conversation and reports, per turn, the
+estimated prompt tokens of resending the whole transcript versus the
+budgeted window + summary, and the time to build the context.
+
+  python bench_sessions.py
+  python bench_sessions.py --sessions 10000 50000 100000 --turns 10 --budget 1024
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+import sessions
+
+SYSTEM_PROMPT = 'You are QUPAL, a thrift-shopping assistant. ' * 6
+
+_WORDS = ('vintage wool coat label seams zipper brand condition estimate value leather '
+          'made in label stitching lining era tag thrift worth antique lamp brass').split()
+
+
+def _sentence(rnd, lo, hi):
+    return ' '.join(rnd.choice(_WORDS) for _ in range(rnd.randint(lo, hi))).capitalize() + '.'
+
+
+def _question(rnd):
+    return _sentence(rnd, 6, 20) + '?'
+
+
+def _answer(rnd):
+    return ' '.join(_sentence(rnd, 8, 20) for _ in range(rnd.randint(2, 5)))
+
+
+def run_memory(levels, turns, seed=0):
+    rnd = random.Random(seed)
+    # a pool of texts, so the measurement is the store and not the generator
+    questions = [_question(rnd) for _ in range(500)]
+    answers = [_answer(rnd) for _ in range(500)]
+    cap = max(levels)
+    store = sessions.SessionStore(max_sessions=cap, idle_ttl=1e9)
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    out = []
+    created = 0
+    for level in sorted(levels) + [cap + cap // 2]:
+        start = time.perf_counter()
+        added = level - created
+        while created < level:
+            session_id = 'session-%d' % created
+            for t in range(turns):
+                store.record(session_id, questions[(created + t) % 500], answers[(created * 7 + t) % 500])
+            created += 1
+        elapsed = time.perf_counter() - start
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - base
+        out.append({
+            'created': created,
+            'active': len(store),
+            'turns': turns,
+            'mem_mb': round(used / 1e6, 1),
+            'bytes_per_session': round(used / len(store)),
+            'record_us_traced': round(elapsed / max(1, added * turns) * 1e6, 2),
+        })
+    tracemalloc.stop()
+    return out
+
+
+def run_prompt(turns, budget, seed=0):
+    rnd = random.Random(seed)
+    store = sessions.SessionStore()
+    transcript = []
+    out = []
+    for turn in range(1, turns + 1):
+        message = _question(rnd)
+        start = time.perf_counter()
+        reserve = sessions.prompt_tokens(SYSTEM_PROMPT, [], message)
+        history = store.history('s', budget, reserve)
+        build_us = (time.perf_counter() - start) * 1e6
+        out.append({
+            'turn': turn,
+            'full_tokens': sessions.prompt_tokens(SYSTEM_PROMPT, transcript, message),
+            'budgeted_tokens': sessions.prompt_tokens(SYSTEM_PROMPT, history, message),
+            'history_messages': len(history),
+            'build_us': round(build_us, 1),
+        })
+        reply = _answer(rnd)
+        store.record('s', message, reply)
+        transcript += [{'role': 'user', 'content': message}, {'role': 'assistant', 'content': reply}]
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='*', default=[10000, 50000, 100000])
+    parser.add_argument('--turns', type=int, default=10, help='exchanges per session in the memory run')
+    parser.add_argument('--conversation', type=int, default=60, help='turns in the prompt-size run')
+    parser.add_argument('--budget', type=int, default=1024, help='context budget in estimated tokens')
+    args = parser.parse_args()
+    for row in run_memory(args.sessions, args.turns):
+        print(json.dumps(row))
+    for row in run_prompt(args.conversation, args.budget):
+        if row['turn'] in (1, 2, 5) or row['turn'] % 10 == 0:
+            print(json.dumps(row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Read overhead of the shared state store on the request path.
+
+Compares reading a config value from a plain module global (what
+`runtime_api_key` was) with `SharedState.get()` at the default poll interval
+and with a check on every read, both while idle and while another process
+keeps writing. Also reports how long a write in one process takes to be
+seen by another at each interval.
+
+  python bench_shared_state.py
+  python bench_shared_state.py --reads 1000000 --intervals 0 0.01 0.1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import shared_state
+
+runtime_api_key = 'sk-bench'
+
+_WRITER = '''
+import sys, time
+import shared_state
+state = shared_state.SharedState(sys.argv[1])
+end = time.time() + float(sys.argv[2])
+while time.time() < end:
+    state.set('stamp', time.time())
+    time.sleep(float(sys.argv[3]))
+'''
+
+
+def _writer(path, seconds, period):
+    return subprocess.Popen([sys.executable, '-c', _WRITER, path, str(seconds), str(period)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def _per_read_ns(read, reads):
+    start = time.perf_counter()
+    for _ in range(reads):
+        read()
+    return (time.perf_counter() - start) / reads * 1e9
+
+
+def _global():
+    return runtime_api_key
+
+
+def run_reads(path, reads, intervals, churn):
+    rows = [{'bench': 'read', 'store': 'global', 'churn': churn, 'ns_per_read': round(_per_read_ns(_global, reads), 1)}]
+    for interval in intervals:
+        state = shared_state.SharedState(path, interval=interval)
+        state.set('runtime_api_key', 'sk-bench')
+        refreshes = state.refreshes
+        ns = _per_read_ns(lambda: state.get('runtime_api_key'), reads)
+        rows.append({'bench': 'read', 'store': 'shared', 'interval_s': interval, 'churn': churn,
+                     'ns_per_read': round(ns, 1), 'refreshes': state.refreshes - refreshes})
+        state.close()
+    return rows
+
+
+def run_propagation(path, interval, seconds, period):
+    state = shared_state.SharedState(path, interval=interval)
+    lags = []
+    last = state.get('stamp')
+    writer = _writer(path, seconds, period)
+    while writer.poll() is None:
+        stamp = state.get('stamp')
+        if stamp != last:
+            lags.append(time.time() - stamp)
+            last = stamp
+        time.sleep(0.0005)
+    state.close()
+    lags.sort()
+    return {'bench': 'propagation', 'interval_s': interval, 'samples': len(lags),
+            'p50_ms': round(lags[len(lags) // 2] * 1000, 2) if lags else None,
+            'p99_ms': round(lags[int(len(lags) * 0.99)] * 1000, 2) if lags else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reads', type=int, default=300000)
+    parser.add_argument('--intervals', type=float, nargs='+', default=[0.1, 0.0])
+    parser.add_argument('--write-period', type=float, default=0.01, help='seconds between writes by the other process')
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'state.db')
+        shared_state.SharedState(path).close()
+        for row in run_reads(path, args.reads, args.intervals, churn=False):
+            print(json.dumps(row))
+        writer = _writer(path, 60, args.write_period)
+        try:
+            for row in run_reads(path, args.reads, args.intervals, churn=True):
+                print(json.dumps(row))
+        finally:
+            writer.kill()
+            writer.wait()
+        for interval in args.intervals:
+            print(json.dumps(run_propagation(path, interval, 2.0, args.write_period * 5)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Opt-in capture of chat traffic for deterministic replay (see replay.py).
+
+`Middleware` wraps the WSGI app and appends one JSON line per chat request
+to a `CaptureLog`: route, body, the headers that change behaviour, status,
+server time and start time. Upstream replies are logged on their own lines
+as they arrive (`upstream()`), so a replay can serve them from a stub
+instead of calling the real API. Files rotate at `max_bytes`, keeping
+`backups` older ones (`capture.log.1` is the newest of those); every file
+starts with a header line.
+
+Records are buffered and written out by a background thread every
+`flush_interval` seconds, and by `close()` (registered with `atexit` by the
+server).
+
+Redaction (`redact`):
+  none  messages are logged as sent.
+  hash  intent keywords (greetings, categories, model names, topics) are
+        kept and every other word becomes a salted hash token, the same
+        token for the same word; `message` and `selection` are both
+        redacted. The replayed request takes the same branch of `api_chat`,
+        and repeats stay repeats for the cache and coalescing. Upstream
+        replies are replaced with filler of the same length, and session
+        ids are hashed.
+
+  log = CaptureLog('capture.log', redact='hash', engine=lambda: server.chat_engine)
+  app.wsgi_app = Middleware(app.wsgi_app, log)
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+
+import profiling
+
+FORMAT_VERSION = 1
+ROUTES = ('/api/chat', '/api/chat/stream', '/api/chat/batch')
+# request headers that change how a chat request is answered
+HEADERS = ('x-session-id', 'x-deadline-ms', 'accept')
+REDACT_MODES = ('none', 'hash')
+
+_WORD_RE = re.compile(r'[^\W_]+')
+_FILLER = 'Thrift tip: check the label, seams and fabric before you buy. '
+
+
+def _json(record):
+    return json.dumps(record, separators=(',', ':'), ensure_ascii=False)
+
+
+class Redactor:
+    """Makes messages safe to log while keeping what decides their handling."""
+
+    def __init__(self, mode='none', salt=None, engine=None):
+        if mode not in REDACT_MODES:
+            raise ValueError('redact must be one of %s' % ', '.join(REDACT_MODES))
+        self.mode = mode
+        self.salt = (salt if salt is not None else os.urandom(16).hex()).encode('utf-8')
+        self._engine = engine
+
+    def _token(self, word):
+        return 'q' + hashlib.blake2b(word.lower().encode('utf-8'), digest_size=4, key=self.salt[:64]).hexdigest()
+
+    def message(self, text):
+        if self.mode == 'none' or not isinstance(text, str) or not text:
+            return text
+        keep = []
+        engine = self._engine() if self._engine is not None else None
+        if engine is not None:
+            keep = [(m.start, m.end) for m in engine.matches(text)]
+        out = []
+        pos = 0
+        for m in _WORD_RE.finditer(text):
+            if any(start <= m.start() and m.end() <= end for start, end in keep):
+                continue
+            out.append(text[pos:m.start()])
+            out.append(self._token(m.group()))
+            pos = m.end()
+        out.append(text[pos:])
+        return ''.join(out)
+
+    def reply(self, text):
+        if self.mode == 'none':
+            return text
+        n = len(text or '')
+        return (_FILLER * (n // len(_FILLER) + 1))[:n]
+
+    def session(self, session_id):
+        if self.mode == 'none' or not session_id:
+            return session_id
+        return self._token(str(session_id))
+
+    def body(self, data):
+        if self.mode == 'none' or not isinstance(data, dict):
+            return data
+        data = dict(data)
+        # a selection is user-chosen text too; catalog model names survive as keywords
+        for field in ('message', 'selection'):
+            if field in data:
+                data[field] = self.message(data[field])
+        if 'session_id' in data:
+            data['session_id'] = self.session(data['session_id'])
+        if isinstance(data.get('items'), list):
+            data['items'] = [self.message(item) if isinstance(item, str) else self.body(item)
+                             for item in data['items']]
+        return data
+
+
+class CaptureLog:
+    """Append-only, size-rotated JSON-lines log of chat traffic; thread-safe."""
+
+    def __init__(self, path, max_bytes=64 << 20, backups=5, redact='none', salt=None, engine=None,
+                 clock=time.time, flush_interval=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.redactor = Redactor(redact, salt, engine)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._dirty = False
+        self._closed = threading.Event()
+        self.records = 0
+        threading.Thread(target=self._flush_loop, name='capture-flush', daemon=True).start()
+
+    def request(self, route, body, headers, status, seconds, started):
+        try:
+            data = json.loads(body or b'null')
+        except ValueError:
+            data = None
+        record = {'t': round(started, 4), 'r': route, 'b': self.redactor.body(data), 's': status,
+                  'ms': round(seconds * 1000, 3)}
+        kept = {name: headers[name] for name in HEADERS if headers.get(name)}
+        if 'x-session-id' in kept:
+            kept['x-session-id'] = self.redactor.session(kept['x-session-id'])
+        if kept:
+            record['h'] = kept
+        self._write(record)
+
+    def upstream(self, message, reply, seconds):
+        """Log the upstream reply to `message`, so a replay can serve it."""
+        self._write({'t': round(self._clock(), 4), 'u': self.redactor.message(message),
+                     'reply': self.redactor.reply(reply), 'ms': round(seconds * 1000, 3)})
+
+    def _write(self, record):
+        line = (_json(record) + '\n').encode('utf-8')
+        with self._lock:
+            if self._file is None or self._size + len(line) > self.max_bytes:
+                self._rotate()
+            # a buffered write per request; _flush_loop writes it out within flush_interval
+            self._file.write(line)
+            self._size += len(line)
+            self._dirty = True
+            self.records += 1
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            if self._dirty:
+                self.flush()
+
+    def _rotate(self):
+        # caller holds self._lock
+        if self._file is not None:
+            self._file.close()
+            if self.backups > 0:
+                for i in range(self.backups - 1, 0, -1):
+                    if os.path.exists('%s.%d' % (self.path, i)):
+                        os.replace('%s.%d' % (self.path, i), '%s.%d' % (self.path, i + 1))
+                os.replace(self.path, self.path + '.1')
+            else:
+                os.remove(self.path)
+        self._file = open(self.path, 'ab', buffering=1 << 16)
+        self._size = self._file.tell()
+        if self._size == 0:
+            header = {'capture': FORMAT_VERSION, 'redact': self.redactor.mode, 'started': round(self._clock(), 4)}
+            line = (_json(header) + '\n').encode('utf-8')
+            self._file.write(line)
+            self._size += len(line)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            self._dirty = False
+
+    def close(self):
+        """Flush and close the file and stop the flusher; safe to call more than once."""
+        self._closed.set()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._dirty = False
+
+
+def read(path):
+    """Return (requests, upstream replies) from a log and its rotated files, oldest first."""
+    names = [path]
+    while os.path.exists('%s.%d' % (path, len(names))):
+        names.append('%s.%d' % (path, len(names)))
+    requests = []
+    replies = []
+    for name in reversed(names):
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                if 'r' in record:
+                    requests.append(record)
+                elif 'u' in record:
+                    replies.append(record)
+    requests.sort(key=lambda r: r['t'])
+    return requests, replies
+
+
+class Middleware:
+    """WSGI middleware that logs chat requests to a CaptureLog."""
+
+    def __init__(self, app, log):
+        self.app = app
+        self.log = log
+
+    def __call__(self, environ, start_response):
+        route = environ.get('PATH_INFO', '')
+        if route not in ROUTES or environ.get('REQUEST_METHOD') != 'POST':
+            return self.app(environ, start_response)
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        body = environ['wsgi.input'].read(length) if length else b''
+        environ['wsgi.input'] = io.BytesIO(body)
+        headers = {name: environ.get('HTTP_' + name.upper().replace('-', '_')) for name in HEADERS}
+        status = []
+        started = time.time()
+        start = time.perf_counter()
+
+        def capture_start(status_line, response_headers, exc_info=None):
+            status.append(int(status_line.split(' ', 1)[0]))
+            return start_response(status_line, response_headers, exc_info)
+
+        result = self.app(environ, capture_start)
+        return profiling.ClosingIterator(result, lambda: self.log.request(
+            route, body, headers, status[0] if status else None, time.perf_counter() - start, started))
+
@@ -0,0 +1,272 @@
+"""
+Indexed product catalog store.
+
+The catalog is imported once from a JSON or CSV file into SQLite: a B-tree
+index on the normalized name serves exact and prefix lookups, an FTS5
+trigram index supplies candidates for fuzzy (typo-tolerant) matching, and a
+(category, rank) index drives the `choices` lists. `load()` builds a fresh
+database and swaps it in, so the catalog can be reloaded while requests
+are being served (`watch=True` polls the source file for changes).
+
+JSON: {"version": 1, "items": [{"sku", "name", "category", "rank",
+"summary", "description"}, ...]}; CSV: a header row with the same fields.
+`summary` is the short text shown when a model is selected, `description`
+the longer one used when a message mentions the model.
+"""
+import csv
+import difflib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+CatalogItem = namedtuple('CatalogItem', 'sku name category rank summary description')
+
+_FIELDS = 'sku, name, category, rank, summary, description'
+
+# a run of letters and digits; names match on these word boundaries
+_WORD = re.compile(r'[^\W_]+')
+
+
+def normalize_name(name):
+    return ' '.join((name or '').lower().split())
+
+
+def _read_items(path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if path.lower().endswith('.csv'):
+        rows = list(csv.DictReader(raw.decode('utf-8-sig').splitlines()))
+    else:
+        data = json.loads(raw.decode('utf-8'))
+        rows = data['items'] if isinstance(data, dict) else data
+    items = []
+    for i, row in enumerate(rows):
+        name = (row.get('name') or '').strip()
+        if not name:
+            continue
+        items.append(CatalogItem(
+            sku=str(row.get('sku') or 'ITEM-%d' % i),
+            name=name,
+            category=normalize_name(row.get('category') or 'other'),
+            rank=int(row.get('rank') or 0),
+            summary=row.get('summary') or row.get('description') or name,
+            description=row.get('description') or row.get('summary') or name,
+        ))
+    return items, hashlib.sha256(raw).hexdigest()[:12]
+
+
+class Catalog:
+    """Thread-safe catalog lookups over an in-memory SQLite database."""
+
+    def __init__(self, path, watch=False, watch_interval=2.0):
+        self.path = path
+        self.watch_interval = watch_interval
+        self.version = None
+        self._lock = threading.Lock()
+        self._conn = None
+        self._mtime = None
+        self._count = 0
+        self._listeners = []
+        self._first_words = set()
+        self._name_len = 0
+        self.fuzzy_index = None
+        self.load()
+        if watch:
+            threading.Thread(target=self._watch, name='catalog-watch', daemon=True).start()
+
+    def __len__(self):
+        return self._count
+
+    def on_load(self, fn):
+        """Call `fn(catalog)` now and after every (re)load."""
+        self._listeners.append(fn)
+        fn(self)
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        items, version = _read_items(self.path)
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        conn.execute(
+            'CREATE TABLE items (id INTEGER PRIMARY KEY, sku TEXT UNIQUE, name TEXT NOT NULL, '
+            'name_norm TEXT NOT NULL, category TEXT NOT NULL, rank INTEGER NOT NULL, '
+            'summary TEXT NOT NULL, description TEXT NOT NULL)'
+        )
+        conn.executemany(
+            'INSERT OR REPLACE INTO items (sku, name, name_norm, category, rank, summary, description) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(it.sku, it.name, normalize_name(it.name), it.category, it.rank, it.summary, it.description)
+             for it in items],
+        )
+        conn.execute('CREATE INDEX items_name ON items (name_norm)')
+        conn.execute('CREATE INDEX items_category ON items (category, rank, name_norm)')
+        try:
+            conn.execute("CREATE VIRTUAL TABLE items_fts USING fts5(name_norm, content='items', "
+                         "content_rowid='id', tokenize='trigram')")
+            fuzzy_index = 'trigram'
+        except sqlite3.OperationalError:
+            # SQLite < 3.34 has no trigram tokenizer; fall back to word tokens
+            conn.execute("CREATE VIRTUAL TABLE items_fts USING fts5(name_norm, content='items', content_rowid='id')")
+            fuzzy_index = 'word'
+        conn.execute("INSERT INTO items_fts (items_fts) VALUES ('rebuild')")
+        # document frequency of every indexed term, copied out of fts5vocab
+        # (which scans the whole index on every query) into a B-tree table
+        conn.execute("CREATE VIRTUAL TABLE items_vocab USING fts5vocab(items_fts, 'row')")
+        conn.execute('CREATE TABLE items_terms (term TEXT PRIMARY KEY, doc INTEGER NOT NULL) WITHOUT ROWID')
+        conn.execute('INSERT INTO items_terms SELECT term, doc FROM items_vocab')
+        conn.execute('DROP TABLE items_vocab')
+        conn.commit()
+        count = conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+        first_words = set()
+        name_len = 0
+        for (name,) in conn.execute('SELECT name_norm FROM items'):
+            word = _WORD.match(name)
+            if word is not None:
+                first_words.add(word.group())
+            name_len = max(name_len, len(name))
+
+        with self._lock:
+            old = self._conn
+            self._conn, self.version, self._mtime = conn, version, mtime
+            self._count, self.fuzzy_index = count, fuzzy_index
+            self._first_words, self._name_len = first_words, name_len
+        if old is not None:
+            old.close()
+        for fn in self._listeners:
+            fn(self)
+
+    def changed(self):
+        try:
+            return os.stat(self.path).st_mtime_ns != self._mtime
+        except OSError:
+            return False
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                if self.changed():
+                    self.load()
+            except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+                print('catalog reload failed:', str(e))
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def exact(self, name):
+        """Item whose name matches `name` ignoring case and spacing, or None."""
+        rows = self._query('SELECT %s FROM items WHERE name_norm = ? LIMIT 1' % _FIELDS, (normalize_name(name),))
+        return CatalogItem(*rows[0]) if rows else None
+
+    def prefix(self, prefix, limit=10):
+        """Items whose normalized name starts with `prefix`, in name order."""
+        p = normalize_name(prefix)
+        rows = self._query(
+            'SELECT %s FROM items WHERE name_norm >= ? AND name_norm < ? ORDER BY name_norm LIMIT ?' % _FIELDS,
+            (p, p + '\U0010ffff', limit),
+        )
+        return [CatalogItem(*r) for r in rows]
+
+    def fuzzy(self, text, limit=5, cutoff=0.6, candidates=10, terms=3):
+        """Return [(score, item)] for names similar to `text`, best first.
+
+        The FTS index narrows the catalog to `candidates` names holding all
+        of the `terms` rarest trigrams of `text` or, when a typo leaves no
+        name with all of them, to the best bm25 matches for any of them.
+        Only those are re-ranked by edit similarity, outside the lock.
+        Common trigrams ("pro", "air") are left out of the index query,
+        since they match a large part of a big catalog.
+        """
+        q = normalize_name(text)
+        if not q:
+            return []
+        if self.fuzzy_index == 'trigram' and len(q) >= 3:
+            grams = {q[i:i + 3] for i in range(len(q) - 2)}
+        else:
+            grams = set(q.split())
+        with self._lock:
+            conn = self._conn
+            counts = conn.execute(
+                'SELECT term, doc FROM items_terms WHERE term IN (%s)' % ','.join('?' * len(grams)),
+                sorted(grams),
+            ).fetchall()
+            rarest = ['"%s"' % t.replace('"', '""') for t, _ in sorted(counts, key=lambda c: (c[1], c[0]))[:terms]]
+            rows = []
+            # the names holding all of them are few, and difflib ranks them
+            # anyway; bm25 would cost more than the rest of the lookup
+            for match, order in ((' AND '.join(rarest), ''), (' OR '.join(rarest), ' ORDER BY rank')):
+                if rows or not match:
+                    break
+                rows = conn.execute(
+                    'SELECT %s FROM items WHERE id IN '
+                    '(SELECT rowid FROM items_fts WHERE items_fts MATCH ?%s LIMIT ?)' % (_FIELDS, order),
+                    (match, candidates),
+                ).fetchall()
+        scored = []
+        for row in rows:
+            item = CatalogItem(*row)
+            score = difflib.SequenceMatcher(None, q, normalize_name(item.name)).ratio()
+            if score >= cutoff:
+                scored.append((score, item))
+        scored.sort(key=lambda s: (-s[0], s[1].rank, s[1].name))
+        return scored[:limit]
+
+    def suggest(self, name, cutoff=0.8):
+        """Name of the closest item to `name`, for a "did you mean" hint, or None.
+
+        Only a hint: a selection is answered from `exact()` and never from a
+        near miss, since "Dell XPS 15" is not the XPS 13.
+        """
+        best = self.fuzzy(name, limit=1, cutoff=cutoff)
+        return best[0][1].name if best else None
+
+    def mentions(self, text):
+        """Return [(start, end, name)] for every item named in `text`.
+
+        Names match as whole words, ignoring case, and also in the plural
+        with a trailing "s"; `name` is the normalized item name. Only spans
+        starting with the first word of some name are looked up, all in one
+        indexed query, so the cost does not grow with the catalog.
+        """
+        t = (text or '').lower()
+        with self._lock:
+            first_words, name_len = self._first_words, self._name_len
+        words = list(_WORD.finditer(t))
+        spans = {}
+        for i, word in enumerate(words):
+            if word.group() not in first_words:
+                continue
+            start = word.start()
+            for end in (w.end() for w in words[i:]):
+                if end - start > name_len + 1:
+                    break
+                span = t[start:end]
+                spans[(start, end)] = (span, span[:-1]) if span.endswith('s') else (span,)
+        if not spans:
+            return []
+        wanted = sorted({name for names in spans.values() for name in names})
+        found = {r[0] for r in self._query(
+            'SELECT DISTINCT name_norm FROM items WHERE name_norm IN (%s)' % ','.join('?' * len(wanted)), wanted)}
+        out = []
+        for (start, end), names in sorted(spans.items(), key=lambda s: (s[0][1], s[0][0])):
+            name = next((n for n in names if n in found), None)
+            if name is not None:
+                out.append((start, end, name))
+        return out
+
+    def choices(self, category, limit=8):
+        """Display names for a category's `choices` list, best ranked first."""
+        rows = self._query('SELECT name FROM items WHERE category = ? ORDER BY rank, name_norm LIMIT ?',
+                           (normalize_name(category), limit))
+        return [r[0] for r in rows]
+
+    def categories(self):
+        return [r[0] for r in self._query('SELECT DISTINCT category FROM items ORDER BY category')]
+
+    def names(self):
+        return [r[0] for r in self._query('SELECT name FROM items ORDER BY rank, name_norm')]
@@ -0,0 +1,303 @@
+"""
+Keep-alive client for the chat server, used by the Tkinter app.
+
+`ChatClient` posts /api/chat requests to `server.py` (or `asgi.py`) over one
+persistent connection owned by a background I/O thread. Requests that queue
+up while a round trip is in progress are pipelined: written back to back on
+the connection and their responses read in order, so N queued messages cost
+one round trip instead of N. The server answers them one after another, so
+a session's history still builds up in the order the messages were sent.
+
+A small LRU (`response_cache.ResponseCache`) keeps the replies that do not
+depend on the conversation: `select` lookups, category choice lists, replies
+the server marks `"local": true` (its rules, FAQ and catalog answers) and,
+without a session, every other successful reply. Degraded replies and
+errors are never kept.
+
+Servers that close the connection after every response (the Flask
+development server does) are asked one request per connection instead.
+
+When the server cannot be reached, requests fail with `ServerUnavailable`
+so the caller can answer locally. The client then waits `retry_interval`
+seconds before trying the server again, so a server that is down costs one
+connect timeout, not one per message.
+"""
+import http.client
+import json
+import queue
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from urllib.parse import urlsplit
+
+import response_cache
+
+# connection errors that mean a kept-alive socket went stale (as in upstream.py)
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                 ConnectionResetError, BrokenPipeError)
+
+
+class ServerUnavailable(Exception):
+    """The chat server could not be reached, or did not answer in time."""
+
+
+class ServerError(Exception):
+    """The chat server answered with an error status."""
+
+    def __init__(self, status, body):
+        super().__init__('server returned %s: %s' % (status, (body or {}).get('error', '')))
+        self.status = status
+        self.body = body or {}
+
+
+def cache_key(body):
+    """Local cache key of an /api/chat body; the fields that decide its reply."""
+    return '\x1f'.join((
+        body.get('action') or '',
+        response_cache.normalize_message(body.get('message')),
+        response_cache.normalize_message(body.get('selection')),
+        '1' if body.get('local') else '',
+    ))
+
+
+class ChatClient:
+    """Pipelined keep-alive client for one chat server; thread-safe.
+
+    base_url: the server, e.g. http://127.0.0.1:5000
+    session_id: sent as X-Session-Id so the server keeps the conversation.
+    pipeline: most requests written to the connection before reading.
+    """
+
+    def __init__(self, base_url, session_id=None, timeout=30.0, connect_timeout=3.0, pipeline=8,
+                 cache_size=256, cache_ttl=600.0, retry_interval=10.0, clock=time.monotonic):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.scheme == 'https' else 80)
+        self.path = parts.path.rstrip('/') + '/api/chat'
+        self.session_id = session_id
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pipeline = max(1, pipeline)
+        self.retry_interval = retry_interval
+        self.cache = response_cache.ResponseCache(max_entries=cache_size, ttl=cache_ttl, clock=clock)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._sock = None
+        self._fp = None
+        self._down_until = 0.0
+        self._closed = False
+        self.closes_connections = False
+        self.requests = 0
+        self.round_trips = 0
+        self.connections = 0
+        self.unavailable = 0
+        self._thread = threading.Thread(target=self._run, name='chat-client', daemon=True)
+        self._thread.start()
+
+    def ask(self, body, timeout=None):
+        """Return the server's reply body for one /api/chat `body`.
+
+        Raises ServerUnavailable, or ServerError for an error status.
+        """
+        future = self.submit(body)
+        try:
+            return future.result(self.timeout + self.connect_timeout if timeout is None else timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise ServerUnavailable('no reply from the chat server in time')
+
+    def submit(self, body):
+        """Queue one request; returns a Future of its reply body."""
+        return self.submit_many([body])[0]
+
+    def submit_many(self, bodies):
+        """Queue several requests to go out together; returns their Futures."""
+        futures = []
+        jobs = []
+        for body in bodies:
+            future = Future()
+            futures.append(future)
+            cached = self.cache.get(cache_key(body))
+            if cached is not None:
+                future.set_result(dict(cached))
+            elif self._closed:
+                future.set_exception(ServerUnavailable('client closed'))
+            elif self._clock() < self._down_until:
+                # the server was unreachable a moment ago; do not wait on it again yet
+                with self._lock:
+                    self.unavailable += 1
+                future.set_exception(ServerUnavailable('chat server unavailable'))
+            else:
+                jobs.append((body, future))
+        if jobs:
+            self._queue.put(jobs)
+        return futures
+
+    def _run(self):
+        while True:
+            jobs = self._queue.get()
+            if jobs is None:
+                break
+            # everything queued behind it goes out on the same round trip
+            while len(jobs) < self.pipeline:
+                try:
+                    more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    self._queue.put(None)
+                    break
+                jobs += more
+            jobs = [(body, future) for body, future in jobs if future.set_running_or_notify_cancel()]
+            for i in range(0, len(jobs), self.pipeline):
+                self._exchange(jobs[i:i + self.pipeline])
+        self._disconnect()
+
+    def _exchange(self, jobs):
+        if self._clock() < self._down_until:
+            self._fail(jobs, 'chat server unavailable')
+            return
+        retried = False
+        while jobs:
+            reused = self._sock is not None
+            answered = 0
+            # a server that closes after every response gets one request per connection
+            sent = jobs[:1] if self.closes_connections else jobs
+            try:
+                if self._sock is None:
+                    self._connect()
+                self._send(sent)
+                self.round_trips += 1
+                for body, future in sent:
+                    status, data, keep_alive = self._read_response()
+                    answered += 1
+                    self._resolve(body, future, status, data)
+                    if not keep_alive:
+                        # anything sent after it was never read; send it again on a new connection
+                        self.closes_connections = True
+                        self._disconnect()
+                        break
+            except (OSError, http.client.HTTPException) as e:
+                self._disconnect()
+                # a kept-alive connection the server dropped while idle: resend once
+                if reused and answered == 0 and not retried and isinstance(e, _STALE_ERRORS):
+                    retried = True
+                    continue
+                self._down_until = self._clock() + self.retry_interval
+                self._fail(jobs[answered:], 'chat server unavailable: %s' % e)
+                return
+            jobs = jobs[answered:]
+
+    def _fail(self, jobs, reason):
+        with self._lock:
+            self.unavailable += len(jobs)
+        for _, future in jobs:
+            future.set_exception(ServerUnavailable(reason))
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        if self.scheme == 'https':
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        sock.settimeout(self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._fp = sock.makefile('rb')
+        self.connections += 1
+
+    def _disconnect(self):
+        if self._fp is not None:
+            self._fp.close()
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._fp = None
+
+    def _send(self, jobs):
+        head = 'POST %s HTTP/1.1\r\nHost: %s:%d\r\nContent-Type: application/json\r\nAccept: application/json\r\n' % (
+            self.path, self.host, self.port)
+        if self.session_id:
+            head += 'X-Session-Id: %s\r\n' % self.session_id
+        out = []
+        for body, _ in jobs:
+            data = json.dumps(body).encode('utf-8')
+            out.append(('%sContent-Length: %d\r\n\r\n' % (head, len(data))).encode('latin-1'))
+            out.append(data)
+        self._sock.sendall(b''.join(out))
+        self.requests += len(jobs)
+
+    def _read_response(self):
+        """Read one response off the connection; returns (status, JSON body or None, keep_alive)."""
+        line = self._fp.readline(65537)
+        if not line:
+            raise http.client.RemoteDisconnected('chat server closed the connection')
+        parts = line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+            raise http.client.BadStatusLine(line)
+        status = int(parts[1])
+        headers = http.client.parse_headers(self._fp)
+        connection = (headers.get('Connection') or '').lower()
+        keep_alive = connection != 'close' and (parts[0] != 'HTTP/1.0' or connection == 'keep-alive')
+        if (headers.get('Transfer-Encoding') or '').lower() == 'chunked':
+            data = self._read_chunked()
+        elif headers.get('Content-Length') is not None:
+            length = int(headers['Content-Length'])
+            data = self._fp.read(length)
+            if len(data) < length:
+                raise http.client.IncompleteRead(data, length - len(data))
+        else:
+            data, keep_alive = self._fp.read(), False
+        try:
+            return status, json.loads(data), keep_alive
+        except ValueError:
+            return status, None, keep_alive
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self._fp.readline(1026).split(b';', 1)[0], 16)
+            if size == 0:
+                # trailers end with an empty line
+                while self._fp.readline(65537) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(self._fp.read(size))
+            self._fp.readline(3)
+
+    def _resolve(self, body, future, status, data):
+        if status != 200 or not isinstance(data, dict):
+            future.set_exception(ServerError(status, data if isinstance(data, dict) else None))
+            return
+        if self._keep(body, data):
+            self.cache.set(cache_key(body), data)
+        future.set_result(data)
+
+    def _keep(self, body, data):
+        if not isinstance(data.get('reply'), str) or data.get('degraded'):
+            return False
+        # with a session, free-text replies depend on the conversation so far,
+        # unless the server answered them with its local rules
+        return body.get('action') == 'select' or 'choices' in data or bool(data.get('local')) \
+            or not self.session_id
+
+    def stats(self):
+        with self._lock:
+            unavailable = self.unavailable
+        return {'requests': self.requests, 'round_trips': self.round_trips, 'connections': self.connections,
+                'unavailable': unavailable, 'cache': self.cache.stats()}
+
+    def close(self):
+        """Stop the I/O thread; requests still queued fail with ServerUnavailable."""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=1.0)
+        while True:
+            try:
+                jobs = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if jobs is not None:
+                self._fail(jobs, 'client closed')
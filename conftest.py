@@ -0,0 +1,19 @@
+import pytest
+
+import admission
+import keypool
+import server
+
+
+@pytest.fixture(autouse=True)
+def _fresh_rate_limiter(monkeypatch):
+    # every test client request comes from 127.0.0.1; keep tests from
+    # spending each other's rate-limit budget
+    monkeypatch.setattr(server, 'rate_limiter', admission.RateLimiter(
+        rate=server.rate_limiter.rate, burst=server.rate_limiter.burst))
+
+
+@pytest.fixture(autouse=True)
+def _fresh_key_pool(monkeypatch):
+    # keys added through the admin endpoints must not outlive their test
+    monkeypatch.setattr(server, 'key_pool', keypool.KeyPool(cooldown=server.key_pool.cooldown))
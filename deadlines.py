@@ -0,0 +1,202 @@
+"""
+Request deadlines and hedged upstream calls.
+
+Deadlines are absolute `time.monotonic()` values. `Hedger.call(fn, deadline)`
+runs `fn(deadline)` on a worker pool and waits for it no longer than the
+deadline, raising `DeadlineExceeded` when it passes (the attempt itself is
+left to finish in the background; `fn` should bound its own I/O with the
+deadline it is given). When hedging is enabled and the first attempt is
+still running after the recent p95 latency, a second identical attempt is
+started and whichever succeeds first wins. Hedges are only sent when an
+optional gate (see `admission.ConcurrencyGate.try_acquire`) has a free
+slot, so they cannot add load once the upstream is saturated.
+
+`LatencyTracker` keeps the durations of recent successful attempts for the
+p95. `AsyncHedger` is the asyncio equivalent for the ASGI mode.
+"""
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import deque
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request deadline passed before the upstream answered."""
+
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+class LatencyTracker:
+    """Rolling window of recent call durations with a cached quantile."""
+
+    def __init__(self, window=200, min_samples=20, quantile=0.95):
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._cached = None
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._cached = None
+
+    def value(self):
+        """The quantile of the window, or None until min_samples are in."""
+        with self._lock:
+            if self._cached is None and len(self._samples) >= self.min_samples:
+                ordered = sorted(self._samples)
+                self._cached = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+            return self._cached
+
+
+class _HedgerBase:
+    def __init__(self, tracker, enabled=True, min_delay=0.05):
+        self.tracker = tracker
+        self.enabled = enabled
+        # never hedge sooner than this, however fast recent calls were
+        self.min_delay = min_delay
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+        self.deadlines = 0
+
+    def hedge_delay(self):
+        if not self.enabled:
+            return None
+        p95 = self.tracker.value()
+        return None if p95 is None else max(self.min_delay, p95)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'p95': self.tracker.value(),
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'hedges_skipped': self.hedges_skipped,
+            'deadlines': self.deadlines,
+        }
+
+
+class Hedger(_HedgerBase):
+    def __init__(self, pool, tracker, enabled=True, min_delay=0.05):
+        super().__init__(tracker, enabled, min_delay)
+        self._pool = pool
+
+    def _timed(self, fn, deadline):
+        start = time.monotonic()
+        result = fn(deadline)
+        self.tracker.observe(time.monotonic() - start)
+        return result
+
+    def _hedge(self, fn, deadline, gate):
+        try:
+            return self._timed(fn, deadline)
+        finally:
+            if gate is not None:
+                gate.release()
+
+    def call(self, fn, deadline, gate=None, holding=False):
+        """Return the first successful `fn(deadline)` result, or raise.
+
+        Raises the attempt's own exception when every attempt failed, and
+        DeadlineExceeded when none finished in time. With `holding`, the
+        caller has already taken a `gate` slot for the first attempt; it is
+        released when that attempt finishes, which may be after call returns.
+        """
+        try:
+            first = self._pool.submit(self._timed, fn, deadline)
+        except BaseException:
+            if holding:
+                gate.release()
+            raise
+        if holding:
+            # a thread cannot be stopped, so the slot stays taken until it ends
+            first.add_done_callback(lambda _: gate.release())
+        pending = {first}
+        hedge = None
+        delay = self.hedge_delay()
+        if delay is not None and time.monotonic() + delay < deadline:
+            done, _ = concurrent.futures.wait(pending, timeout=delay)
+            if not done:
+                if gate is None or gate.try_acquire():
+                    hedge = self._pool.submit(self._hedge, fn, deadline, gate)
+                    pending.add(hedge)
+                    self.hedged += 1
+                else:
+                    self.hedges_skipped += 1
+        error = None
+        while pending:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            done, pending = concurrent.futures.wait(pending, timeout=timeout,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        self.deadlines += 1
+        raise DeadlineExceeded('no upstream reply before the deadline')
+
+
+class AsyncHedger(_HedgerBase):
+    """Hedger for coroutines; `fn(deadline)` returns an awaitable."""
+
+    async def _timed(self, fn, deadline):
+        start = time.monotonic()
+        result = await fn(deadline)
+        self.tracker.observe(time.monotonic() - start)
+        return result
+
+    async def call(self, fn, deadline, gate=None):
+        first = asyncio.ensure_future(self._timed(fn, deadline))
+        pending = {first}
+        hedge = None
+        try:
+            delay = self.hedge_delay()
+            if delay is not None and time.monotonic() + delay < deadline:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    if gate is None or gate.try_acquire():
+                        hedge = asyncio.ensure_future(self._timed(fn, deadline))
+                        if gate is not None:
+                            # also runs when the hedge is cancelled before it starts
+                            hedge.add_done_callback(lambda _: asyncio.ensure_future(gate.release()))
+                        pending.add(hedge)
+                        self.hedged += 1
+                    else:
+                        self.hedges_skipped += 1
+            error = None
+            while pending:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            if error is not None and not pending:
+                raise error
+            self.deadlines += 1
+            raise DeadlineExceeded('no upstream reply before the deadline')
+        finally:
+            # unlike threads, the losing or late attempts can be stopped
+            for task in (first, hedge):
+                if task is None:
+                    continue
+                if task.done():
+                    if not task.cancelled():
+                        task.exception()  # mark it retrieved
+                else:
+                    task.cancel()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Offline FAQ retrieval for the local responders.
+
+A Q&A corpus (`data/faq.json`: {"version": 1, "entries": [{"question",
+"answer"}, ...]}) is built once into a directory of NumPy arrays: a TF-IDF
+inverted index over hashed terms (for each term bucket, the entries it
+occurs in and its weight there, every entry normalized to unit length) and
+the questions and answers as one UTF-8 blob with offsets. `FaqIndex` opens
+the arrays with `mmap_mode='r'`, so a large index lives in the page cache
+rather than process memory and is shared by every process that opens it.
+
+A query is one pass: the postings of its few terms are gathered, summed per
+entry and the best `k` taken with argpartition. Scores are cosine
+similarities; hits below `min_score` are dropped so the caller can fall back
+to its generic reply.
+
+  index = faq.load()  # builds data/faq.json into a cache directory once
+  index.search('is my ring real gold?', k=3)
+  python faq.py build corpus.json /path/to/index
+"""
+import array
+import hashlib
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+from collections import Counter, namedtuple
+
+import numpy as np
+
+import relevance
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'faq.json')
+FORMAT_VERSION = 1
+
+Hit = namedtuple('Hit', 'score entry question answer')
+
+STOPWORDS = frozenset('''
+a about all also am an and any are as at be been but by can could did do does doing for from get got had has
+have how i if in into is it its just me might my no not of on or our please should so some tell than that the
+their them then there these they this those to us was we were what when where which who why will with would
+you your
+'''.split())
+
+
+_SUFFIXES = (('ies', 'y'), ('ing', ''), ('es', ''), ('ed', ''), ('s', ''))
+
+
+def stem(word):
+    """Crude suffix folding, so "thrifting", "thrifted" and "thrifts" meet."""
+    if len(word) > 4:
+        for suffix, replacement in _SUFFIXES:
+            if word.endswith(suffix) and not word.endswith('ss'):
+                return word[:-len(suffix)] + replacement
+    return word
+
+
+def terms(text):
+    """Index terms of a text: stemmed lowercase words without stopwords."""
+    return [stem(word) for word in relevance.words(text) if word not in STOPWORDS]
+
+
+def _bucket(term, mask):
+    return zlib.crc32(term.encode('utf-8')) & mask
+
+
+def read_entries(path):
+    """Yield (question, answer) pairs from a corpus file."""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    for entry in data['entries'] if isinstance(data, dict) else data:
+        question = (entry.get('question') or '').strip()
+        answer = (entry.get('answer') or '').strip()
+        if question and answer:
+            yield question, answer
+
+
+def build(entries, path, bits=20, source=None):
+    """Build an index of (question, answer) pairs into directory `path`.
+
+    Questions count twice, so a query phrased like a known question beats
+    one that only shares words with an answer.
+    """
+    mask = (1 << bits) - 1
+    term_ids = array.array('q')
+    entry_ids = array.array('l')
+    tfs = array.array('d')
+    text = bytearray()
+    offsets = array.array('q', [0])
+    n = 0
+    for question, answer in entries:
+        counts = Counter(_bucket(t, mask) for t in terms(question) * 2 + terms(answer))
+        for term, count in counts.items():
+            term_ids.append(term)
+            entry_ids.append(n)
+            tfs.append(1.0 + math.log(count))
+        for part in (question, answer):
+            text += part.encode('utf-8')
+            offsets.append(len(text))
+        n += 1
+
+    term_ids = np.frombuffer(term_ids, dtype=np.int64)
+    entry_ids = np.frombuffer(entry_ids, dtype=np.dtype('l')).astype(np.int32)
+    df = np.bincount(term_ids, minlength=mask + 1)
+    idf = (np.log((n + 1) / (df + 1.0)) + 1.0).astype(np.float32)
+    weights = np.frombuffer(tfs, dtype=np.float64) * idf[term_ids]
+    norms = np.sqrt(np.bincount(entry_ids, weights=weights * weights, minlength=n))
+    weights /= norms[entry_ids]
+    order = np.argsort(term_ids, kind='stable')
+
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)) or '.', prefix='.faq-')
+    np.save(os.path.join(tmp, 'term_ptr.npy'), np.concatenate([[0], np.cumsum(df)]).astype(np.int64))
+    np.save(os.path.join(tmp, 'postings.npy'), entry_ids[order])
+    np.save(os.path.join(tmp, 'weights.npy'), weights[order].astype(np.float32))
+    np.save(os.path.join(tmp, 'idf.npy'), idf)
+    np.save(os.path.join(tmp, 'text.npy'), np.frombuffer(bytes(text), dtype=np.uint8))
+    np.save(os.path.join(tmp, 'text_ptr.npy'), np.frombuffer(offsets, dtype=np.int64))
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'version': FORMAT_VERSION, 'entries': n, 'bits': bits, 'source': source}, f)
+    # swap the finished index in, so readers never see a partial one
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return n
+
+
+class FaqIndex:
+    """Read-only, memory-mapped FAQ index; safe to share between threads."""
+
+    def __init__(self, path, min_score=0.3):
+        self.path = path
+        self.min_score = min_score
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != FORMAT_VERSION:
+            raise ValueError('unsupported FAQ index version in %s' % path)
+        self._mask = (1 << self.meta['bits']) - 1
+
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        self._term_ptr = load('term_ptr')
+        self._postings = load('postings')
+        self._weights = load('weights')
+        self._idf = load('idf')
+        self._text = load('text')
+        self._text_ptr = load('text_ptr')
+
+    def __len__(self):
+        return self.meta['entries']
+
+    def _text_at(self, i):
+        return self._text[self._text_ptr[i]:self._text_ptr[i + 1]].tobytes().decode('utf-8')
+
+    def entry(self, i):
+        return self._text_at(2 * i), self._text_at(2 * i + 1)
+
+    def search(self, query, k=3, min_score=None):
+        """The best `k` entries for `query` as Hit tuples, best first."""
+        min_score = self.min_score if min_score is None else min_score
+        counts = Counter(_bucket(t, self._mask) for t in terms(query))
+        if not counts:
+            return []
+        buckets = np.fromiter(counts, dtype=np.int64, count=len(counts))
+        q = (1.0 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))) * self._idf[buckets]
+        q /= np.sqrt(np.dot(q, q))
+        starts = self._term_ptr[buckets]
+        ends = self._term_ptr[buckets + 1]
+        if not (ends > starts).any():
+            return []
+        ids = np.concatenate([self._postings[s:e] for s, e in zip(starts, ends)])
+        contrib = np.concatenate([self._weights[s:e] * w for s, e, w in zip(starts, ends, q)])
+        if len(ids) * 16 < len(self):
+            # few postings: sum per distinct entry instead of over every entry
+            candidates, slot = np.unique(ids, return_inverse=True)
+            scores = np.bincount(slot, weights=contrib)
+        else:
+            candidates = None
+            scores = np.bincount(ids, weights=contrib, minlength=len(self))
+        # only entries that clear the threshold can be returned, so rank just those
+        top = np.flatnonzero(scores >= max(min_score, 1e-9))
+        if len(top) > k:
+            top = top[np.argpartition(-scores[top], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        hits = []
+        for i in top:
+            score = float(scores[i])
+            entry = int(candidates[i]) if candidates is not None else int(i)
+            question, answer = self.entry(entry)
+            hits.append(Hit(score, entry, question, answer))
+        return hits
+
+    def answer(self, query):
+        """The best answer scoring at least min_score, or None."""
+        hits = self.search(query, k=1)
+        return hits[0].answer if hits else None
+
+
+def _source_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def load(source=DEFAULT_SOURCE, index_dir=None, min_score=0.3):
+    """Open the index for corpus `source`, building it first if needed.
+
+    The index goes to `index_dir`, by default a directory in the system temp
+    dir named after the corpus contents, and is rebuilt when the corpus
+    changes.
+    """
+    digest = _source_digest(source)
+    if index_dir is None:
+        index_dir = os.path.join(tempfile.gettempdir(), 'qupal-faq-%s' % digest)
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        current = meta.get('version') == FORMAT_VERSION and meta.get('source') == digest
+    except (OSError, ValueError):
+        current = False
+    if not current:
+        try:
+            build(read_entries(source), index_dir, source=digest)
+        except OSError:
+            # another process may have built the same index at the same time
+            if not os.path.exists(os.path.join(index_dir, 'meta.json')):
+                raise
+    return FaqIndex(index_dir, min_score=min_score)
+
+
+def main(argv):
+    if len(argv) != 3 or argv[0] != 'build':
+        print('usage: python faq.py build CORPUS.json INDEX_DIR', file=sys.stderr)
+        return 2
+    n = build(read_entries(argv[1]), argv[2], source=_source_digest(argv[1]))
+    print('indexed %d entries into %s' % (n, argv[2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,225 @@
+"""
+Shared intent engine for the local (rule-based) responders.
+
+All greeting, model-name and topic keywords are compiled once at import into a
+single Aho-Corasick automaton, so classifying a message is one pass over its
+characters no matter how many keywords are registered. Each keyword belongs to
+an intent, and intents carry an explicit priority: when a message matches
+several intents the one with the lowest priority number wins, instead of
+whichever `if` happened to be checked first.
+
+Both `server.py` and the Tkinter app in `main.py` use `ENGINE`; the server
+builds its own engine from the product catalog's categories with
+`default_engine(models, categories)` and rebuilds it when the catalog is
+reloaded. Catalog model names are too many to compile in; they are found by
+the catalog itself through `add_matcher()`.
+"""
+from collections import namedtuple
+
+# Lower number wins when a message matches several intents.
+GREETING = 'greeting'
+MODEL = 'model'
+CATEGORY = 'category'
+IDENTIFY = 'identify'
+VALUE = 'value'
+TIPS = 'tips'
+BYE = 'bye'
+
+PRIORITIES = {
+    GREETING: 0,
+    MODEL: 10,
+    CATEGORY: 20,
+    IDENTIFY: 30,
+    VALUE: 40,
+    TIPS: 50,
+    BYE: 60,
+}
+
+# (keyword, intent, whole_word). Greetings are whole-word so that "hi" does not
+# fire inside "thrift" or "this".
+DEFAULT_KEYWORDS = [
+    ('hello', GREETING, True),
+    ('hi', GREETING, True),
+    ('hey', GREETING, True),
+    ('greetings', GREETING, True),
+    ('good morning', GREETING, True),
+    ('good afternoon', GREETING, True),
+    ('good evening', GREETING, True),
+    ('vintage', IDENTIFY, False),
+    ('identify', IDENTIFY, False),
+    ('what is this', IDENTIFY, False),
+    ('value', VALUE, False),
+    ('estimate', VALUE, False),
+    ('worth', VALUE, False),
+    ('tips', TIPS, False),
+    ('thrift', TIPS, False),
+    ('bye', BYE, False),
+    ('thanks', BYE, False),
+]
+
+# Product categories (a mention asks which model the user wants) and model
+# names. Both match as whole words and report the lowercase name as the value.
+DEFAULT_CATEGORIES = ['laptop']
+
+DEFAULT_MODELS = [
+    'macbook air',
+    'dell xps 13',
+    'lenovo thinkpad x1 carbon',
+    'hp spectre x360',
+]
+
+Match = namedtuple('Match', 'intent value start end priority')
+
+
+class IntentEngine:
+    """Multi-pattern keyword matcher with per-intent priorities.
+
+    Add keywords with `add()`, then call `build()` (or just `classify()`,
+    which builds lazily). Matching is case-insensitive.
+    """
+
+    def __init__(self, priorities=None):
+        self.priorities = dict(PRIORITIES if priorities is None else priorities)
+        self._patterns = []  # (keyword, intent, value, whole_word, priority)
+        self._matchers = []  # (intent, fn, priority)
+        self._goto = None
+        self._fail = None
+        self._out = None
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def add(self, keyword, intent, value=None, whole_word=False, priority=None):
+        keyword = keyword.lower()
+        if not keyword:
+            raise ValueError('empty keyword')
+        if priority is None:
+            priority = self.priorities.get(intent, max(self.priorities.values(), default=0) + 10)
+        self._patterns.append((keyword, intent, value if value is not None else keyword, whole_word, priority))
+        self._goto = None
+
+    def add_matcher(self, intent, fn, priority=None):
+        """Also report `intent` wherever `fn(text)` finds it.
+
+        `fn` returns [(start, end, value)] in `text`; use it for keyword
+        sets too large to compile into the automaton, such as every model
+        name in the catalog.
+        """
+        if priority is None:
+            priority = self.priorities.get(intent, max(self.priorities.values(), default=0) + 10)
+        self._matchers.append((intent, fn, priority))
+
+    def build(self):
+        # trie: one transition dict per node; _out[n] lists pattern ids ending at n
+        goto = [{}]
+        out = [[]]
+        for pid, (kw, _intent, _value, _ww, _prio) in enumerate(self._patterns):
+            node = 0
+            for ch in kw:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                node = nxt
+            out[node].append(pid)
+
+        # breadth-first failure links; outputs are merged along them so the
+        # scan loop never has to walk the failure chain to report matches
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                cand = goto[f].get(ch, 0)
+                fail[nxt] = cand if cand != nxt else 0
+                if out[fail[nxt]]:
+                    out[nxt] = out[nxt] + out[fail[nxt]]
+
+        self._goto, self._fail, self._out = goto, fail, out
+        return self
+
+    def _iter_matches(self, text):
+        if not self._matchers:
+            return self._scan(text)
+        found = list(self._scan(text))
+        for intent, fn, prio in self._matchers:
+            found.extend(Match(intent, value, start, end, prio) for start, end, value in fn(text or ''))
+        found.sort(key=lambda m: m.end)
+        return found
+
+    def _scan(self, text):
+        if self._goto is None:
+            self.build()
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self._patterns
+        t = (text or '').lower()
+        n = len(t)
+        node = 0
+        for i, ch in enumerate(t):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not out[node]:
+                continue
+            for pid in out[node]:
+                kw, intent, value, whole_word, prio = patterns[pid]
+                start = i - len(kw) + 1
+                if whole_word and ((start > 0 and t[start - 1].isalnum()) or (i + 1 < n and t[i + 1].isalnum())):
+                    continue
+                yield Match(intent, value, start, i + 1, prio)
+
+    def matches(self, text):
+        """Every keyword match in `text`, in order of where they end."""
+        return list(self._iter_matches(text))
+
+    def scan(self, text):
+        """Return {intent: first Match} for every intent present in `text`."""
+        found = {}
+        for m in self._iter_matches(text):
+            if m.intent not in found:
+                found[m.intent] = m
+        return found
+
+    def classify(self, text, only=None):
+        """Return the highest-priority Match in `text` (or None).
+
+        `only` restricts classification to a subset of intents. Ties on
+        priority go to the earliest match in the message.
+        """
+        best = None
+        for m in self._iter_matches(text):
+            if only is not None and m.intent not in only:
+                continue
+            if best is None or m.priority < best.priority:
+                best = m
+        return best
+
+
+def default_engine(models=None, categories=None):
+    engine = IntentEngine()
+    for kw, intent, whole_word in DEFAULT_KEYWORDS:
+        engine.add(kw, intent, whole_word=whole_word)
+    # categories and models are whole words, so "hat" does not fire inside
+    # "what"; each also matches its plural ("laptops"), valued as the singular
+    for name in DEFAULT_CATEGORIES if categories is None else categories:
+        _add_name(engine, name, CATEGORY)
+    for name in DEFAULT_MODELS if models is None else models:
+        _add_name(engine, name, MODEL)
+    return engine.build()
+
+
+def _add_name(engine, name, intent):
+    name = ' '.join(name.lower().split())
+    if name:
+        engine.add(name, intent, whole_word=True)
+        engine.add(name + 's', intent, value=name, whole_word=True)
+
+
+ENGINE = default_engine()
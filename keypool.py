@@ -0,0 +1,239 @@
+"""
+Pool of upstream API keys balanced by their remaining rate limit.
+
+Each response from the upstream API carries `x-ratelimit-remaining-requests`
+/ `-tokens` and `x-ratelimit-reset-requests` / `-tokens` headers; `observe()`
+records them per key. `choose()` picks the key with the most requests left
+(less the calls already in flight on it), so traffic spreads over every
+key's quota instead of exhausting one. A 429 puts the key in a cooldown for
+its `Retry-After` (or reset) time. Keys that have not answered yet rank
+first, so a new key is put to use straight away.
+
+Callers take a key once per request and keep that string to the end, so
+draining or removing a key never changes the key of a call in flight:
+
+  pool = KeyPool()
+  pool.add('sk-...')
+  key = pool.choose()
+  with pool.using(key):
+      client_for(key).complete(...)  # client reports headers to pool.observe
+"""
+import contextlib
+import hashlib
+import re
+import threading
+import time
+
+ACTIVE = 'active'
+DRAINING = 'draining'
+
+# shed reason for requests whose key is resting after a 429
+COOLDOWN = 'key_cooldown'
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_UNITS = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+
+
+def parse_duration(value):
+    """Seconds in a rate-limit reset value such as '1s', '6m0s', '20ms' or '0.5'."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _UNITS[unit] for n, unit in parts)
+
+
+def key_id(api_key):
+    """Stable public name for a key; the key itself is never reported."""
+    return 'key-' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]
+
+
+def _header_int(headers, name):
+    value = headers.get(name)
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _Key:
+    def __init__(self, api_key, name):
+        self.api_key = api_key
+        self.id = name
+        self.state = ACTIVE
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.reset_at = None
+        self.cooldown_until = 0.0
+
+
+class KeyPool:
+    """Thread-safe set of API keys.
+
+    cooldown: seconds a key rests after a 429 that names no retry time.
+    """
+
+    def __init__(self, cooldown=10.0, clock=time.monotonic):
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys = {}  # api_key -> _Key, in insertion order
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, api_key, name=None):
+        """Add a key (or reactivate a draining one); returns its id."""
+        with self._lock:
+            entry = self._keys.get(api_key)
+            if entry is None:
+                entry = self._keys[api_key] = _Key(api_key, name or key_id(api_key))
+            entry.state = ACTIVE
+            return entry.id
+
+    def _find(self, name):
+        for entry in self._keys.values():
+            if entry.id == name:
+                return entry
+        return None
+
+    def drain(self, name):
+        """Stop routing new requests to a key; calls in flight finish on it."""
+        with self._lock:
+            entry = self._find(name)
+            if entry is None:
+                return False
+            entry.state = DRAINING
+            return True
+
+    def remove(self, name):
+        """Forget a key; returns it, or None for an unknown id.
+
+        Requests that already hold the key keep using it.
+        """
+        with self._lock:
+            entry = self._find(name)
+            if entry is None:
+                return None
+            del self._keys[entry.api_key]
+            return entry.api_key
+
+    def export(self):
+        """The keys with their ids and states, as a JSON-friendly list for sync()."""
+        with self._lock:
+            return [[entry.api_key, entry.id, entry.state] for entry in self._keys.values()]
+
+    def sync(self, keys):
+        """Make the pool hold exactly `keys` (from export()); returns the keys dropped.
+
+        Keys already in the pool keep their quota and load figures.
+        """
+        with self._lock:
+            current = self._keys
+            self._keys = {}
+            for api_key, name, state in keys:
+                entry = current.pop(api_key, None) or _Key(api_key, name)
+                entry.id = name
+                entry.state = state
+                self._keys[api_key] = entry
+            return list(current)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+    def _headroom(self, entry, now):
+        # requests left in the current window, less the calls not yet counted
+        if entry.remaining_requests is None or (entry.reset_at is not None and now >= entry.reset_at):
+            return float('inf')
+        return entry.remaining_requests - entry.in_flight
+
+    def choose(self):
+        """The active key with the most quota left, or None when there is none.
+
+        When every active key is cooling down, the one that recovers first is
+        returned; `cooldown_left()` tells the caller to shed instead of
+        calling the upstream.
+        """
+        now = self._clock()
+        with self._lock:
+            best = None
+            best_rank = None
+            for entry in self._keys.values():
+                if entry.state != ACTIVE:
+                    continue
+                cooling = entry.cooldown_until > now
+                rank = (not cooling, -entry.cooldown_until if cooling else self._headroom(entry, now),
+                        entry.remaining_tokens if entry.remaining_tokens is not None else float('inf'),
+                        -entry.in_flight)
+                if best_rank is None or rank > best_rank:
+                    best, best_rank = entry, rank
+            return best.api_key if best is not None else None
+
+    def cooldown_left(self, api_key):
+        with self._lock:
+            entry = self._keys.get(api_key)
+            return max(0.0, entry.cooldown_until - self._clock()) if entry is not None else 0.0
+
+    @contextlib.contextmanager
+    def using(self, api_key):
+        """Count a call in flight on `api_key` for the duration of the block."""
+        with self._lock:
+            entry = self._keys.get(api_key)
+            if entry is not None:
+                entry.in_flight += 1
+                entry.requests += 1
+        try:
+            yield
+        finally:
+            if entry is not None:
+                with self._lock:
+                    entry.in_flight -= 1
+
+    def observe(self, api_key, status, headers):
+        """Record the rate-limit headers (lowercase names) of one upstream response."""
+        now = self._clock()
+        remaining = _header_int(headers, 'x-ratelimit-remaining-requests')
+        tokens = _header_int(headers, 'x-ratelimit-remaining-tokens')
+        reset = parse_duration(headers.get('x-ratelimit-reset-requests'))
+        with self._lock:
+            entry = self._keys.get(api_key)
+            if entry is None:
+                return
+            if remaining is not None:
+                entry.remaining_requests = remaining
+                entry.reset_at = now + reset if reset is not None else None
+            if tokens is not None:
+                entry.remaining_tokens = tokens
+            if status == 429:
+                entry.throttled += 1
+                wait = parse_duration(headers.get('retry-after'))
+                if wait is None:
+                    wait = reset if reset is not None else self.cooldown
+                entry.cooldown_until = max(entry.cooldown_until, now + wait)
+                # out of quota until the cooldown ends
+                entry.remaining_requests = 0
+                entry.reset_at = entry.cooldown_until
+
+    def stats(self):
+        now = self._clock()
+        with self._lock:
+            return [{
+                'id': entry.id,
+                'state': entry.state,
+                'in_flight': entry.in_flight,
+                'requests': entry.requests,
+                'throttled': entry.throttled,
+                'remaining_requests': entry.remaining_requests,
+                'remaining_tokens': entry.remaining_tokens,
+                'cooldown': round(max(0.0, entry.cooldown_until - now), 3),
+            } for entry in self._keys.values()]
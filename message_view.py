@@ -0,0 +1,269 @@
+"""
+Virtualized chat message list for the Tkinter client.
+
+`MessageModel` keeps the whole history compactly (texts, a sender byte and a
+pixel height per message) with a Fenwick tree over the heights, so appending
+a message, finding a message's y offset and finding the message at a given
+y are all O(log n). Heights start as an estimate from the text length and
+are replaced by the real height once a bubble has been drawn.
+
+`MessageView` is a Canvas that only materializes Label widgets for the
+bubbles in (or just around) the visible area. Labels that scroll out of view
+are hidden and reused for the ones scrolling in, and every append, scroll
+and resize is coalesced into a single idle relayout. The number of widgets
+stays bounded by the window height, not the length of the conversation.
+
+The model has no Tk dependency; `bench_message_view.py` exercises it
+headlessly.
+"""
+from array import array
+
+ASSISTANT = 0
+USER = 1
+
+_SENDERS = {'assistant': ASSISTANT, 'user': USER}
+
+
+class MessageModel:
+    """Append-only message history with O(log n) offset lookups."""
+
+    def __init__(self, estimate):
+        # estimate(text, sender) -> height in pixels before a bubble is drawn
+        self._estimate = estimate
+        self._texts = []
+        self._senders = bytearray()
+        self._heights = array('i')
+        self._measured = bytearray()
+        self._tree = array('q', [0])  # 1-based Fenwick tree over _heights
+        self._total = 0
+
+    def __len__(self):
+        return len(self._texts)
+
+    def append(self, text, sender='assistant'):
+        sender = _SENDERS.get(sender, sender)
+        height = int(self._estimate(text, sender))
+        self._texts.append(text)
+        self._senders.append(sender)
+        self._heights.append(height)
+        self._measured.append(0)
+        # tree[i] covers (i - lowbit(i), i]; build it from the prefix sums
+        i = len(self._texts)
+        self._tree.append(height + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+        self._total += height
+        return i - 1
+
+    def text(self, index):
+        return self._texts[index]
+
+    def sender(self, index):
+        return self._senders[index]
+
+    def height(self, index):
+        return self._heights[index]
+
+    def measured(self, index):
+        return bool(self._measured[index])
+
+    def total_height(self):
+        return self._total
+
+    def set_height(self, index, height):
+        """Record the drawn height of a message. Returns True if it changed."""
+        self._measured[index] = 1
+        delta = int(height) - self._heights[index]
+        if not delta:
+            return False
+        self._heights[index] += delta
+        self._total += delta
+        i = index + 1
+        tree = self._tree
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+        return True
+
+    def _prefix(self, n):
+        # sum of the first n heights
+        total = 0
+        tree = self._tree
+        while n > 0:
+            total += tree[n]
+            n -= n & -n
+        return total
+
+    def offset(self, index):
+        """y of the top of message `index`."""
+        return self._prefix(index)
+
+    def index_at(self, y):
+        """Index of the message covering y (clamped to the valid range)."""
+        n = len(self._texts)
+        if n == 0:
+            return 0
+        if y <= 0:
+            return 0
+        # binary lifting over the Fenwick tree: largest i with prefix(i) <= y
+        pos = 0
+        step = 1 << (n.bit_length() - 1)
+        tree = self._tree
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= y:
+                pos = nxt
+                y -= tree[nxt]
+            step >>= 1
+        return min(pos, n - 1)
+
+    def visible(self, top, height, overscan=2):
+        """range() of the messages overlapping [top, top + height), plus `overscan` on each side."""
+        n = len(self._texts)
+        if n == 0:
+            return range(0)
+        first = max(0, self.index_at(top) - overscan)
+        last = min(n - 1, self.index_at(top + max(0, height) - 1) + overscan)
+        return range(first, last + 1)
+
+
+def estimate_height(text, chars_per_line, line_height, padding):
+    """Rough drawn height of a wrapped text bubble."""
+    lines = 0
+    for paragraph in text.split('\n'):
+        lines += max(1, -(-len(paragraph) // chars_per_line))
+    return lines * line_height + padding
+
+
+try:
+    import tkinter as tk
+    import tkinter.font as tkfont
+except ImportError:  # headless Python builds
+    tk = None
+
+
+if tk is not None:
+    class MessageView(tk.Frame):
+        """Scrollable, virtualized list of chat bubbles."""
+
+        BUBBLE_BG = {ASSISTANT: '#f0fdff', USER: '#e9e9e9'}
+        # outer gap between bubbles (the old bubble_frame's pady) and the
+        # Label's own padding; kept in sync with the height estimate
+        GAP = 6
+        PADX, PADY = 12, 8
+
+        def __init__(self, master, bg='#ffffff', wrap=760, font=('Helvetica', 11), overscan=3):
+            super().__init__(master, bg=bg)
+            self.wrap = wrap
+            self.font = font
+            self.overscan = overscan
+            self.canvas = tk.Canvas(self, bg=bg, highlightthickness=0)
+            self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+            self.canvas.configure(yscrollcommand=self._on_yscroll)
+            self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            self.canvas.bind('<Configure>', lambda e: self._schedule())
+            for seq in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+                self.canvas.bind(seq, self._on_wheel)
+
+            tkf = tkfont.Font(font=font)
+            chars_per_line = max(1, wrap // max(1, tkf.measure('n')))
+            line_height = tkf.metrics('linespace')
+            padding = 2 * (self.GAP + self.PADY)
+            self.model = MessageModel(lambda text, sender: estimate_height(text, chars_per_line, line_height, padding))
+
+            self._active = {}  # message index -> (canvas item, label)
+            self._free = []
+            self._pending = None
+            self._stick_to_bottom = True
+            self._region = None
+            self._yview = None
+
+        def append(self, text, sender='assistant'):
+            index = self.model.append(text, sender)
+            self._schedule()
+            return index
+
+        @property
+        def widget_count(self):
+            return len(self._active) + len(self._free)
+
+        def _schedule(self):
+            # many appends/scroll events before the next idle -> one relayout
+            if self._pending is None:
+                self._pending = self.after_idle(self._relayout)
+
+        def _at_bottom(self):
+            return self.canvas.yview()[1] >= 0.999
+
+        def _on_scrollbar(self, *args):
+            self.canvas.yview(*args)
+            self._stick_to_bottom = self._at_bottom()
+
+        def _on_wheel(self, event):
+            if getattr(event, 'num', None) == 4 or getattr(event, 'delta', 0) > 0:
+                self.canvas.yview_scroll(-3, 'units')
+            else:
+                self.canvas.yview_scroll(3, 'units')
+            self._stick_to_bottom = self._at_bottom()
+
+        def _on_yscroll(self, first, last):
+            self.scrollbar.set(first, last)
+            # Tk also reports unchanged positions; only real moves need a relayout
+            if (first, last) != self._yview:
+                self._yview = (first, last)
+                self._schedule()
+
+        def _sync_region(self, width, height):
+            region = (0, 0, width, max(self.model.total_height(), height))
+            if region != self._region:
+                self._region = region
+                self.canvas.configure(scrollregion=region)
+            if self._stick_to_bottom and not self._at_bottom():
+                self.canvas.yview_moveto(1.0)
+
+        def _acquire(self):
+            if self._free:
+                return self._free.pop()
+            label = tk.Label(self.canvas, justify=tk.LEFT, wraplength=self.wrap,
+                             padx=self.PADX, pady=self.PADY, font=self.font)
+            item = self.canvas.create_window(0, 0, window=label, anchor='nw')
+            return item, label
+
+        def _place(self, index, item, width):
+            y = self.model.offset(index) + self.GAP
+            if self.model.sender(index) == USER:
+                self.canvas.itemconfigure(item, anchor='ne', state='normal')
+                self.canvas.coords(item, width - 12, y)
+            else:
+                self.canvas.itemconfigure(item, anchor='nw', state='normal')
+                self.canvas.coords(item, 12, y)
+
+        def _relayout(self):
+            self._pending = None
+            model, canvas = self.model, self.canvas
+            width = max(1, canvas.winfo_width())
+            height = max(1, canvas.winfo_height())
+            self._sync_region(width, height)
+
+            wanted = model.visible(canvas.canvasy(0), height, self.overscan)
+            for index in [i for i in self._active if i not in wanted]:
+                item, label = self._active.pop(index)
+                canvas.itemconfigure(item, state='hidden')
+                self._free.append((item, label))
+
+            resized = False
+            for index in wanted:
+                slot = self._active.get(index)
+                if slot is None:
+                    slot = self._active[index] = self._acquire()
+                    slot[1].configure(text=model.text(index), bg=self.BUBBLE_BG[model.sender(index)])
+                if not model.measured(index):
+                    resized |= model.set_height(index, slot[1].winfo_reqheight() + 2 * self.GAP)
+
+            if resized:
+                # real heights replaced estimates, so everything below moved
+                # and the visible range may have shifted; settle on the next
+                # idle (measured bubbles never resize again, so this ends)
+                self._sync_region(width, height)
+                self._schedule()
+            for index, (item, _label) in self._active.items():
+                self._place(index, item, width)
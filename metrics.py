@@ -0,0 +1,250 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Histograms have fixed buckets and keep one count per bucket, so observing a
+value is a bisect and two additions under a lock, and memory does not grow
+with traffic. Counters and callback gauges (values read from elsewhere, like
+the cache stats) complete the set. Everything belongs to a `Registry`; when
+it is disabled, `observe`/`inc` return immediately and `time()` hands out a
+shared no-op context manager.
+
+  registry = Registry()
+  phases = registry.histogram('chat_phase_seconds', 'Time per phase.', ['phase'])
+  PARSE = phases.labels(phase='parse')  # resolve labels once, off the hot path
+  with PARSE.time():
+      ...
+  registry.render()  # text/plain; version=0.0.4
+"""
+import bisect
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds; spans in-process work (~100 us) to slow upstream calls
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, **labels):
+        """Return the child for one label set; hot paths can keep it around."""
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._child())
+        return child
+
+    def _label_str(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (n, _escape(v)) for n, v in pairs)
+
+    def clear(self):
+        # reset in place: hot paths may hold on to children from labels()
+        for child in list(self._children.values()):
+            child.reset()
+
+
+class _CounterChild:
+    __slots__ = ('_registry', '_lock', 'value')
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _child(self):
+        return _CounterChild(self._registry)
+
+    def inc(self, amount=1, **labels):
+        if self._registry.enabled:
+            self.labels(**labels).inc(amount)
+
+    def value(self, **labels):
+        return self.labels(**labels).value
+
+    def samples(self):
+        items = sorted(self._children.items())
+        return [(self.name + self._label_str(k), c.value) for k, c in items]
+
+
+class _HistogramChild:
+    __slots__ = ('_registry', '_buckets', '_lock', 'counts', 'sum')
+
+    def __init__(self, registry, buckets):
+        self._registry = registry
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        # one count per bucket, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        if not self._registry.enabled:
+            return
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager that observes the duration of its block."""
+        if not self._registry.enabled:
+            return _NULL_TIMER
+        return _Timer(self)
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * len(self.counts)
+            self.sum = 0.0
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return _HistogramChild(self._registry, self.buckets)
+
+    def observe(self, value, **labels):
+        if self._registry.enabled:
+            self.labels(**labels).observe(value)
+
+    def time(self, **labels):
+        if not self._registry.enabled:
+            return _NULL_TIMER
+        return _Timer(self.labels(**labels))
+
+    def count(self, **labels):
+        return sum(self.labels(**labels).counts)
+
+    def samples(self):
+        items = []
+        for key, child in sorted(self._children.items()):
+            with child._lock:
+                items.append((key, list(child.counts), child.sum))
+        out = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                out.append((self.name + '_bucket' + self._label_str(key, [('le', le)]), cumulative))
+            out.append((self.name + '_sum' + self._label_str(key), total))
+            out.append((self.name + '_count' + self._label_str(key), cumulative))
+        return out
+
+
+class CallbackGauge(_Metric):
+    """A value read from `fn()` at render time; `type` may be 'counter'."""
+
+    def __init__(self, registry, name, help, fn, type='gauge'):
+        super().__init__(registry, name, help)
+        self._fn = fn
+        self.type = type
+
+    def clear(self):
+        pass
+
+    def samples(self):
+        return [(self.name, self._fn())]
+
+
+class Registry:
+    def __init__(self, prefix='', enabled=True):
+        self.prefix = prefix
+        self.enabled = enabled
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(self, self.prefix + name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, self.prefix + name, help, labelnames, buckets))
+
+    def gauge_callback(self, name, help, fn, type='gauge'):
+        return self._add(CallbackGauge(self, self.prefix + name, help, fn, type))
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for name, value in metric.samples():
+                lines.append('%s %s' % (name, _format(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
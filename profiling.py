@@ -0,0 +1,367 @@
+"""
+On-demand profiling of chat requests in a running server.
+
+`Profiler.start()` wraps the Flask app's WSGI callable (`AsgiProfiler`, the
+ASGI callable of asgi.py) for the length of one session and puts the original back when the session ends, so nothing runs
+per request while profiling is off. A session lasts a fixed number of
+seconds or until it has captured N requests, and can be limited to one
+route (`chat`, `stream`, `batch`) and one response path: `local` requests
+are answered by the local rules, `upstream` ones went on to the upstream
+path (cache, coalescing, upstream call). The server calls `note(UPSTREAM)`
+when a request takes that path.
+
+Modes:
+  sample    a thread wakes every `interval` seconds and records the stack of
+            each thread serving a profiled request; the result is collapsed
+            stacks ("root;caller;leaf count"), the input format of
+            flamegraph.pl and speedscope.
+  cprofile  each profiled request runs under cProfile, one at a time
+            (requests overlapping it are not captured); the result is a
+            pstats dump, or its text summary.
+
+Streaming responses are profiled until the body is fully sent. Work handed
+to other threads (batch items) shows up as waiting in the request thread.
+
+Under ASGI, requests share the event loop thread and are told apart by
+their asyncio task. A sample of a task running on the loop is the loop
+thread's stack from that task down; a sample of a suspended task is its
+await chain, so time spent waiting on the upstream shows up at the await it
+is parked at. In cprofile mode, the profile also holds whatever else the
+loop ran while the profiled request was in flight.
+"""
+import asyncio
+import collections
+import contextvars
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+SAMPLE = 'sample'
+CPROFILE = 'cprofile'
+MODES = (SAMPLE, CPROFILE)
+
+LOCAL = 'local'
+UPSTREAM = 'upstream'
+
+# route names accepted by start(), and the request paths they cover
+ROUTES = {'chat': '/api/chat', 'stream': '/api/chat/stream', 'batch': '/api/chat/batch'}
+
+_MAX_DEPTH = 200
+
+# the record of the request being served; asyncio.to_thread carries it over
+_current = contextvars.ContextVar('profiling_record', default=None)
+
+
+def _label(code):
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+def collapse(frame, stop=None):
+    """The stack of `frame` as "root;...;leaf" function labels, from `stop` if given."""
+    names = []
+    while frame is not None and len(names) < _MAX_DEPTH:
+        names.append(_label(frame.f_code))
+        if frame is stop:
+            break
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def awaiting(coro):
+    """The await chain of a suspended coroutine as "outer;...;inner" labels."""
+    names = []
+    while coro is not None and len(names) < _MAX_DEPTH:
+        frame = getattr(coro, 'cr_frame', None)
+        if frame is None:
+            break
+        names.append(_label(frame.f_code))
+        coro = coro.cr_await
+    return ';'.join(names)
+
+
+class _Record:
+    """One profiled request."""
+
+    def __init__(self, path):
+        self.path = path
+        self.thread = threading.get_ident()
+        self.response_path = LOCAL
+        self.samples = collections.Counter()
+        self.profile = None
+
+
+class _Session:
+    def __init__(self, mode, seconds, requests, route, source, interval):
+        self.mode = mode
+        self.seconds = seconds
+        self.max_requests = requests
+        self.route = route
+        self.source = source
+        self.interval = interval
+        self.started = time.monotonic()
+        self.ended = None
+        self.captured = 0
+        self.skipped = 0
+        self.samples = collections.Counter()
+        self.stats = None
+        self.done = threading.Event()
+
+    def expired(self, now):
+        return self.seconds is not None and now - self.started >= self.seconds
+
+    def full(self):
+        return self.max_requests is not None and self.captured >= self.max_requests
+
+
+class Profiler:
+    """Profiling sessions for the chat routes of a Flask `app`, one at a time."""
+
+    # the attribute of `app` wrapped while a session runs
+    _callable = 'wsgi_app'
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._cprofile_lock = threading.Lock()
+        self._session = None
+        self._records = {}  # _key() -> _Record
+        self._wrapped = None
+
+    @property
+    def active(self):
+        session = self._session
+        return session is not None and not session.done.is_set()
+
+    def start(self, mode=SAMPLE, seconds=None, requests=None, route=None, source=None, interval=0.005):
+        """Begin a session; raises ValueError for bad options or one already running.
+
+        Without `seconds` or `requests` the session lasts 30 seconds.
+        """
+        if mode not in MODES:
+            raise ValueError('mode must be one of %s' % ', '.join(MODES))
+        if route is not None and route not in ROUTES:
+            raise ValueError('route must be one of %s' % ', '.join(ROUTES))
+        if source not in (None, LOCAL, UPSTREAM):
+            raise ValueError('source must be local or upstream')
+        if seconds is not None and not 0 < seconds <= 3600:
+            raise ValueError('seconds must be in (0, 3600]')
+        if requests is not None and requests < 1:
+            raise ValueError('requests must be at least 1')
+        if not 0.0005 <= interval <= 1:
+            raise ValueError('interval must be between 0.5 and 1000 ms')
+        if seconds is None and requests is None:
+            seconds = 30.0
+        with self._lock:
+            if self.active:
+                raise ValueError('a profiling session is already running')
+            session = self._session = _Session(mode, seconds, requests, route, source, interval)
+            self._records = {}
+            self._wrapped = getattr(self.app, self._callable)
+            setattr(self.app, self._callable, self._profiled)
+        if mode == SAMPLE:
+            threading.Thread(target=self._sample, args=(session,), name='profiler', daemon=True).start()
+        elif seconds is not None:
+            timer = threading.Timer(seconds, self._finish, args=(session,))
+            timer.daemon = True
+            timer.start()
+        return self.status()
+
+    def stop(self):
+        """End the running session now; its result stays available."""
+        session = self._session
+        if session is not None:
+            self._finish(session)
+        return self.status()
+
+    def _finish(self, session):
+        with self._lock:
+            if session.done.is_set():
+                return
+            session.done.set()
+            session.ended = time.monotonic()
+            if self._session is session and getattr(self.app, self._callable) == self._profiled:
+                setattr(self.app, self._callable, self._wrapped)
+
+    def note(self, response_path):
+        """Mark the request being served as taking `response_path`."""
+        record = _current.get()
+        if record is not None:
+            record.response_path = response_path
+
+    def _key(self):
+        return threading.get_ident()
+
+    def _stack(self, key, record, frames):
+        frame = frames.get(key)
+        return None if frame is None else collapse(frame)
+
+    def _wanted(self, session, path):
+        if session.route is not None:
+            return path == ROUTES[session.route]
+        return path in ROUTES.values()
+
+    def _profiled(self, environ, start_response):
+        session = self._session
+        path = environ.get('PATH_INFO', '')
+        if session is None or session.done.is_set() or not self._wanted(session, path):
+            return self._wrapped(environ, start_response)
+        record = self._begin(session, path)
+        if record is None:
+            return self._wrapped(environ, start_response)
+        try:
+            body = self._wrapped(environ, start_response)
+        except BaseException:
+            self._end(session, record, keep=False)
+            raise
+        return ClosingIterator(body, lambda: self._end(session, record))
+
+    def _begin(self, session, path):
+        record = _Record(path)
+        if session.mode == CPROFILE:
+            if not self._cprofile_lock.acquire(blocking=False):
+                with self._lock:
+                    session.skipped += 1
+                return None
+            record.profile = cProfile.Profile()
+        with self._lock:
+            self._records[self._key()] = record
+        _current.set(record)
+        if record.profile is not None:
+            record.profile.enable()
+        return record
+
+    def _end(self, session, record, keep=True):
+        if record.profile is not None:
+            record.profile.disable()
+            self._cprofile_lock.release()
+        _current.set(None)
+        with self._lock:
+            self._records.pop(self._key(), None)
+            wanted = keep and not session.full() and (session.source is None
+                                                       or record.response_path == session.source)
+            if wanted:
+                session.captured += 1
+                session.samples.update(record.samples)
+                if record.profile is not None:
+                    if session.stats is None:
+                        session.stats = pstats.Stats(record.profile)
+                    else:
+                        session.stats.add(record.profile)
+        if session.full() or session.expired(time.monotonic()):
+            self._finish(session)
+
+    def _sample(self, session):
+        while not session.done.wait(session.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for key, record in self._records.items():
+                    stack = self._stack(key, record, frames)
+                    if stack:
+                        record.samples[stack] += 1
+            del frames
+            if session.expired(time.monotonic()):
+                self._finish(session)
+
+    def status(self):
+        session = self._session
+        if session is None:
+            return {'state': 'idle'}
+        with self._lock:
+            end = session.ended or time.monotonic()
+            return {
+                'state': 'done' if session.done.is_set() else 'running',
+                'mode': session.mode,
+                'route': session.route,
+                'source': session.source,
+                'seconds': session.seconds,
+                'max_requests': session.max_requests,
+                'elapsed': round(end - session.started, 3),
+                'requests': session.captured,
+                'skipped': session.skipped,
+                'samples': sum(session.samples.values()),
+            }
+
+    def result(self, fmt=None):
+        """The last session's result as (data, content type, file name).
+
+        Formats: `collapsed` (sample mode), `pstats` and `text` (cprofile).
+        Raises LookupError when there is nothing to return yet and
+        ValueError for a format the mode does not produce.
+        """
+        session = self._session
+        if session is None or not session.done.is_set():
+            raise LookupError('no finished profiling session')
+        fmt = fmt or ('collapsed' if session.mode == SAMPLE else 'pstats')
+        if session.mode == SAMPLE:
+            if fmt != 'collapsed':
+                raise ValueError('sample mode produces collapsed stacks only')
+            lines = ['%s %d' % (stack, n) for stack, n in session.samples.most_common()]
+            return ('\n'.join(lines) + '\n' if lines else '').encode('utf-8'), 'text/plain; charset=utf-8', \
+                'qupal-profile.collapsed'
+        if fmt not in ('pstats', 'text'):
+            raise ValueError('cprofile mode produces pstats or text')
+        if session.stats is None:
+            raise LookupError('the session captured no requests')
+        if fmt == 'pstats':
+            # the format pstats.Stats(filename) and snakeviz read
+            return marshal.dumps(session.stats.stats), 'application/octet-stream', 'qupal-profile.pstats'
+        out = io.StringIO()
+        summary = pstats.Stats(stream=out)
+        summary.add(session.stats)
+        summary.sort_stats('cumulative').print_stats(40)
+        return out.getvalue().encode('utf-8'), 'text/plain; charset=utf-8', 'qupal-profile.txt'
+
+
+class AsgiProfiler(Profiler):
+    """Profiling sessions for an ASGI `app` whose `asgi_app` is the callable to wrap."""
+
+    _callable = 'asgi_app'
+
+    def _key(self):
+        return asyncio.current_task()
+
+    def _stack(self, task, record, frames):
+        coro = task.get_coro()
+        if not getattr(coro, 'cr_running', False):
+            return awaiting(coro)
+        frame = frames.get(record.thread)
+        return None if frame is None else collapse(frame, stop=coro.cr_frame)
+
+    async def _profiled(self, scope, receive, send):
+        session = self._session
+        path = scope.get('path', '') if scope['type'] == 'http' else ''
+        if session is None or session.done.is_set() or not self._wanted(session, path):
+            return await self._wrapped(scope, receive, send)
+        record = self._begin(session, path)
+        if record is None:
+            return await self._wrapped(scope, receive, send)
+        try:
+            await self._wrapped(scope, receive, send)
+        except BaseException:
+            self._end(session, record, keep=False)
+            raise
+        self._end(session, record)
+
+
+class ClosingIterator:
+    """Passes a WSGI body through and runs `on_close` once it is closed."""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            close = getattr(self._body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._on_close()
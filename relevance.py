@@ -0,0 +1,177 @@
+"""
+Topic-relevance scoring for the upstream reply guard.
+
+A text becomes hashed n-gram features (words, word bigrams and character
+4-grams of each word) in a fixed number of buckets, and is scored by a
+logistic regression over those buckets. Scoring is vectorized: a whole
+batch of texts turns into one array of bucket ids and the scores are a
+gather plus a bincount. The summed weight of each word's own buckets is
+memoized, so the only per-text Python work is tokenizing and one dict
+lookup per word.
+
+The model is trained when it is loaded, from the labelled examples in
+`data/relevance_train.json`, which takes a few milliseconds.
+`data/relevance_eval.json` is held out; `python bench_relevance.py` reports
+accuracy on it and the scoring cost per message.
+
+  model = relevance.load()
+  model.score(['Check the seams.', 'Paris is in France.'])  # -> array([0.8, 0.2])
+  model.relevant(message, reply)
+"""
+import itertools
+import json
+import os
+import zlib
+
+import numpy as np
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+TRAIN_PATH = os.path.join(_DATA_DIR, 'relevance_train.json')
+EVAL_PATH = os.path.join(_DATA_DIR, 'relevance_eval.json')
+
+# lowercase words are runs of letters and digits; str.translate is much
+# faster than a regex here. Apostrophes are dropped so "don't" is one word.
+_SEPARATORS = {c: ' ' for c in range(128) if not chr(c).isalnum()}
+_SEPARATORS[ord("'")] = None
+
+
+def words(text):
+    return text.lower().translate(_SEPARATORS).split()
+
+
+# odd multiplier that mixes the two word hashes of a bigram
+_BIGRAM_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def load_examples(path):
+    """Return (texts, labels) from a relevance data file; labels are 1 for on-topic."""
+    with open(path, encoding='utf-8') as f:
+        examples = json.load(f)['examples']
+    return [text for _, text in examples], np.array([label for label, _ in examples], dtype=np.float64)
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+class RelevanceModel:
+    """Hashed n-gram logistic regression.
+
+    bits: log2 of the number of feature buckets.
+    reply_threshold, message_threshold: `relevant()` passes a reply when its
+    own score, or the score of the message it answers, reaches these.
+    """
+
+    def __init__(self, bits=18, ngram=4, reply_threshold=0.5, message_threshold=0.5, max_words=100000):
+        self.dim = 1 << bits
+        self.ngram = ngram
+        self.reply_threshold = reply_threshold
+        self.message_threshold = message_threshold
+        self.weights = np.zeros(self.dim)
+        self.bias = 0.0
+        self.max_words = max_words
+        self._words = {}  # word -> (crc32, summed weight of its buckets, bucket count)
+
+    def _buckets(self, word):
+        mask = self.dim - 1
+        padded = '<%s>' % word
+        ids = [zlib.crc32(word.encode('utf-8')) & mask]
+        ids.extend(zlib.crc32(padded[i:i + self.ngram].encode('utf-8')) & mask
+                   for i in range(max(1, len(padded) - self.ngram + 1)))
+        return ids
+
+    def _word(self, word):
+        # a word's own buckets never change after training, so their summed
+        # weight is computed once; only bigrams depend on the neighbours
+        ids = self._buckets(word)
+        if len(self._words) >= self.max_words:
+            self._words.clear()
+        entry = self._words[word] = (float(zlib.crc32(word.encode('utf-8'))), float(self.weights[ids].sum()), len(ids))
+        return entry
+
+    def _bigrams(self, hashes, word_counts):
+        """Bigram bucket ids and their text index, for word hashes in text order."""
+        word_docs = np.repeat(np.arange(len(word_counts)), word_counts)
+        if len(hashes) < 2:
+            return np.zeros(0, dtype=np.int64), word_docs[:0]
+        h = np.asarray(hashes).astype(np.uint64)
+        same = word_docs[:-1] == word_docs[1:]
+        bigrams = (((h[:-1] * _BIGRAM_MIX) ^ h[1:]) & np.uint64(self.dim - 1)).astype(np.int64)
+        return bigrams[same], word_docs[:-1][same]
+
+    def features(self, texts):
+        """Return (bucket ids, text index per id, features per text) for a batch."""
+        hashes = []
+        ids = []
+        word_counts = []
+        id_counts = []
+        for text in texts:
+            before = len(ids)
+            tokens = words(text)
+            for token in tokens:
+                hashes.append(zlib.crc32(token.encode('utf-8')))
+                ids.extend(self._buckets(token))
+            word_counts.append(len(tokens))
+            id_counts.append(len(ids) - before)
+        n = len(texts)
+        bigrams, bigram_docs = self._bigrams(hashes, word_counts)
+        ids = np.concatenate([np.array(ids, dtype=np.int64), bigrams])
+        docs = np.concatenate([np.repeat(np.arange(n), id_counts), bigram_docs])
+        return ids, docs, np.bincount(docs, minlength=n)
+
+    def score(self, texts):
+        """Probability that each text is on-topic, as a float array."""
+        n = len(texts)
+        if not n:
+            return np.zeros(0)
+        cache = self._words
+        rows = []
+        word_counts = []
+        for text in texts:
+            tokens = words(text)
+            rows.extend([cache.get(t) or self._word(t) for t in tokens])
+            word_counts.append(len(tokens))
+        rows = np.fromiter(itertools.chain.from_iterable(rows), float, 3 * len(rows)).reshape(-1, 3)
+        bigrams, bigram_docs = self._bigrams(rows[:, 0], word_counts)
+        word_docs = np.repeat(np.arange(n), word_counts)
+        sums = (np.bincount(word_docs, weights=rows[:, 1], minlength=n)
+                + np.bincount(bigram_docs, weights=self.weights[bigrams], minlength=n))
+        counts = np.bincount(word_docs, weights=rows[:, 2], minlength=n) + np.bincount(bigram_docs, minlength=n)
+        return _sigmoid(self.bias + sums / np.sqrt(np.maximum(counts, 1)))
+
+    def relevant(self, message, reply):
+        """Whether `reply` passes the guard: it, or the message it answers, is on-topic."""
+        reply_score, message_score = self.score([reply, message])
+        return bool(reply_score >= self.reply_threshold or message_score >= self.message_threshold)
+
+    def fit(self, texts, labels, epochs=300, rate=4.0, l2=1e-4):
+        """Train by full-batch gradient descent on the logistic loss."""
+        ids, docs, counts = self.features(texts)
+        # only buckets that occur in the data get weights, so train on those
+        used, ids = np.unique(ids, return_inverse=True)
+        scale = 1.0 / np.sqrt(np.maximum(counts, 1))
+        n = len(texts)
+        weights = np.zeros(len(used))
+        bias = 0.0
+        for _ in range(epochs):
+            sums = np.bincount(docs, weights=weights[ids], minlength=n)
+            error = _sigmoid(bias + sums * scale) - labels
+            grad = np.bincount(ids, weights=(error * scale)[docs], minlength=len(used)) / n
+            weights -= rate * (grad + l2 * weights)
+            bias -= rate * error.mean()
+        self.weights = np.zeros(self.dim)
+        self.weights[used] = weights
+        self.bias = bias
+        self._words.clear()
+        return self
+
+    def evaluate(self, texts, labels):
+        """Accuracy of `score(texts) >= reply_threshold` against labels."""
+        predicted = self.score(texts) >= self.reply_threshold
+        return float(np.mean(predicted == (labels > 0.5)))
+
+
+def load(path=TRAIN_PATH, **kwargs):
+    """Build a model and train it on the examples in `path`."""
+    texts, labels = load_examples(path)
+    return RelevanceModel(**kwargs).fit(texts, labels)
@@ -0,0 +1,208 @@
+"""
+Replay captured chat traffic and compare latency between builds.
+
+Reads a capture log (`CHAT_CAPTURE`, see capture.py) and re-issues its
+requests with their original bodies and headers, at the original pace,
+faster (`--speed 4`) or as fast as `--concurrency` allows (`--speed max`).
+Requests go through `server.app.test_client()` of the checked-out build, or
+to a running server with `--url`. Upstream calls are answered by a local
+stub with the recorded replies and latencies, so only the server's own time
+differs between runs. Start a `--url` server with
+`OPENAI_BASE_URL=http://127.0.0.1:<--stub-port>/v1` and `CHAT_RATE=0`.
+
+  python replay.py run capture.log --out before.json
+  git checkout other-branch
+  python replay.py run capture.log --out after.json
+  python replay.py compare before.json after.json    # exit 1 on regression
+
+Each run prints one JSON line: latency percentiles overall and per route,
+how many responses had a different status than when captured, and how far
+the replayer fell behind its schedule.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import admission
+import bench_load
+import capture
+import server
+from stub_upstream import StubUpstream
+
+ROUTE_NAMES = {'/api/chat': 'chat', '/api/chat/stream': 'stream', '/api/chat/batch': 'batch'}
+
+
+def recorded_responses(replies, latency=None):
+    """{message: [(reply, seconds), ...]} for the stub, in capture order.
+
+    latency: seconds for every reply instead of the recorded times.
+    """
+    responses = {}
+    for record in sorted(replies, key=lambda r: r['t']):
+        seconds = record['ms'] / 1000.0 if latency is None else latency
+        responses.setdefault(record['u'], []).append((record['reply'], seconds))
+    return responses
+
+
+def schedule(requests, speed):
+    """(start offset in seconds, record) pairs; speed None replays back to back."""
+    if not requests:
+        return []
+    t0 = requests[0]['t']
+    return [((r['t'] - t0) / speed if speed else 0.0, r) for r in requests]
+
+
+def replay(requests, transport, speed=1.0, concurrency=64):
+    """Re-issue captured requests; returns (samples, wall seconds).
+
+    Samples are (route, captured status, status, latency, lag) tuples; lag is
+    how late the request started against the schedule.
+    """
+    samples = []
+    lock = threading.Lock()
+
+    def send(offset, start, record):
+        begin = time.perf_counter()
+        try:
+            status = transport.post(record['b'], record['r'], record.get('h'))
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - begin
+        with lock:
+            samples.append((record['r'], record['s'], status, elapsed, max(0.0, begin - start - offset)))
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = []
+        for offset, record in schedule(requests, speed):
+            wait = start + offset - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            futures.append(pool.submit(send, offset, start, record))
+        for future in futures:
+            future.result()
+    return samples, time.perf_counter() - start
+
+
+def _latencies(samples):
+    latencies = sorted(s[3] for s in samples)
+    return {
+        'count': len(samples),
+        'errors': sum(1 for s in samples if s[2] is None or s[2] >= 500),
+        'mismatches': sum(1 for s in samples if s[1] != s[2]),
+        'p50_ms': bench_load._ms(bench_load.pct(latencies, 50)),
+        'p95_ms': bench_load._ms(bench_load.pct(latencies, 95)),
+        'p99_ms': bench_load._ms(bench_load.pct(latencies, 99)),
+    }
+
+
+def summarize(samples, wall):
+    result = dict(_latencies(samples), wall_s=round(wall, 3),
+                  max_lag_ms=bench_load._ms(max((s[4] for s in samples), default=0.0)), by_route={})
+    for route in sorted({s[0] for s in samples}):
+        result['by_route'][ROUTE_NAMES.get(route, route)] = _latencies([s for s in samples if s[0] == route])
+    return result
+
+
+def compare(before, after, tolerance=0.2):
+    """Per-route latency changes from run `before` to run `after`.
+
+    Returns (rows, regressions); a regression is a percentile more than
+    `tolerance` slower, or more status mismatches than before.
+    """
+    rows = []
+    problems = []
+    groups = [('all', before, after)] + [(route, before['by_route'][route], after['by_route'][route])
+                                         for route in before['by_route'] if route in after['by_route']]
+    for name, b, a in groups:
+        row = {'route': name}
+        for field in ('p50_ms', 'p95_ms', 'p99_ms'):
+            row[field] = [b[field], a[field]]
+            if b[field] and a[field] is not None:
+                row[field.replace('_ms', '_change')] = round(a[field] / b[field] - 1, 3)
+                if a[field] > b[field] * (1 + tolerance):
+                    problems.append('%s: %s %.3f > %.3f' % (name, field, a[field], b[field]))
+        if a['mismatches'] > b['mismatches']:
+            problems.append('%s: %d status mismatches (was %d)' % (name, a['mismatches'], b['mismatches']))
+        rows.append(row)
+    return rows, problems
+
+
+def _label():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    requests, replies = capture.read(args.capture)
+    if args.limit:
+        requests = requests[:args.limit]
+    latency = None if args.upstream_latency == 'recorded' else float(args.upstream_latency)
+    stub = StubUpstream(port=args.stub_port, responses=recorded_responses(replies, latency),
+                        latency=latency or 0.0).start()
+    try:
+        if args.url:
+            transport = bench_load.HttpTransport(args.url)
+        else:
+            os.environ['OPENAI_BASE_URL'] = stub.base_url
+            server.runtime_api_key = 'sk-replay'
+            server._upstream_clients = {}
+            # the captured clients all come from this process now
+            server.rate_limiter = admission.RateLimiter(rate=0)
+            transport = bench_load.InProcessTransport()
+        speed = None if args.speed == 'max' else float(args.speed)
+        samples, wall = replay(requests, transport, speed, args.concurrency)
+        transport.close()
+    finally:
+        stub.stop()
+    result = dict(summarize(samples, wall), capture=args.capture, label=args.label or _label(),
+                  target=args.url or 'inproc', speed=args.speed, upstream_calls=len(stub.requests))
+    print(json.dumps(result))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('run', help='replay a capture log')
+    p.add_argument('capture')
+    p.add_argument('--url', help='replay against a running server instead of in-process')
+    p.add_argument('--speed', default='1', help='pace multiplier, or "max" (default %(default)s)')
+    p.add_argument('--concurrency', type=int, default=64, help='requests in flight at most')
+    p.add_argument('--upstream-latency', default='recorded', help='"recorded" or seconds per upstream call')
+    p.add_argument('--stub-port', type=int, default=0, help='port of the recorded-upstream stub')
+    p.add_argument('--limit', type=int, help='replay only the first N requests')
+    p.add_argument('--label', help='name of the build under test (default: git describe)')
+    p.add_argument('--out', help='write the result to this JSON file')
+    p = commands.add_parser('compare', help='compare two replay results')
+    p.add_argument('before')
+    p.add_argument('after')
+    p.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        return run(args)
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    rows, problems = compare(before, after, args.tolerance)
+    for row in rows:
+        print(json.dumps(row))
+    print(json.dumps({'before': before.get('label'), 'after': after.get('label'), 'regressions': problems}))
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
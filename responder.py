@@ -0,0 +1,100 @@
+"""
+Bounded background responder for the Tkinter client.
+
+Replies are computed on a fixed-size thread pool instead of one thread per
+message, and handed back in the order the messages were sent: a reply that
+finishes early waits until every earlier one has been delivered (or
+dropped). When more than `max_pending` messages are outstanding, the oldest
+ones that have not started yet are superseded rather than answered late.
+
+The UI thread calls `drain()` from a single periodic pump to collect every
+reply that is ready, in one batch.
+"""
+import concurrent.futures
+import threading
+from collections import namedtuple
+
+OK = 'ok'
+ERROR = 'error'
+SUPERSEDED = 'superseded'
+CANCELLED = 'cancelled'
+
+Reply = namedtuple('Reply', 'seq text reply status')
+
+
+class Responder:
+    def __init__(self, respond, workers=2, max_pending=8):
+        # respond(text) -> reply text; runs on a worker thread
+        self._respond = respond
+        self.max_pending = max_pending
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='responder')
+        self._lock = threading.Lock()
+        self._next_seq = 0
+        self._deliver_seq = 0
+        self._jobs = {}  # seq -> (text, future), not finished yet
+        self._done = {}  # seq -> Reply, finished but not delivered
+        self.superseded = 0
+
+    def submit(self, text):
+        """Queue `text` for a reply; returns its sequence number."""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._jobs[seq] = (text, self._pool.submit(self._run, seq, text))
+            excess = len(self._jobs) - self.max_pending
+            if excess > 0:
+                for old in sorted(self._jobs)[:-1]:
+                    if excess <= 0:
+                        break
+                    if self._drop(old, SUPERSEDED):
+                        self.superseded += 1
+                        excess -= 1
+        return seq
+
+    def _drop(self, seq, status):
+        # lock held; a job that is already running finishes but is discarded
+        text, future = self._jobs[seq]
+        if status == SUPERSEDED and not future.cancel():
+            return False
+        future.cancel()
+        del self._jobs[seq]
+        self._done[seq] = Reply(seq, text, None, status)
+        return True
+
+    def _run(self, seq, text):
+        try:
+            reply, status = self._respond(text), OK
+        except Exception as e:
+            reply, status = str(e), ERROR
+        with self._lock:
+            if seq in self._jobs:
+                del self._jobs[seq]
+                self._done[seq] = Reply(seq, text, reply, status)
+
+    def cancel(self, seq):
+        with self._lock:
+            if seq in self._jobs:
+                self._drop(seq, CANCELLED)
+
+    def cancel_all(self):
+        with self._lock:
+            for seq in list(self._jobs):
+                self._drop(seq, CANCELLED)
+
+    def pending(self):
+        """Number of messages not yet handed out by drain()."""
+        with self._lock:
+            return len(self._jobs) + len(self._done)
+
+    def drain(self):
+        """Return every Reply that is ready to show, in submission order."""
+        out = []
+        with self._lock:
+            while self._deliver_seq in self._done:
+                out.append(self._done.pop(self._deliver_seq))
+                self._deliver_seq += 1
+        return out
+
+    def shutdown(self):
+        self.cancel_all()
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,154 @@
+"""
+Bounded LRU + TTL cache for upstream chat replies.
+
+Entries are keyed on the normalized user message plus the model and system
+prompt, so a change to either invalidates naturally. The in-memory tier is an
+OrderedDict guarded by a lock; an optional SQLite file tier keeps replies
+across restarts and is consulted on a memory miss.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_WS_RE = re.compile(r'\s+')
+
+
+def normalize_message(message):
+    # case, surrounding whitespace/punctuation and internal spacing do not
+    # change the answer to an FAQ-style question
+    return _WS_RE.sub(' ', (message or '').lower()).strip(' \t?!.')
+
+
+def make_key(message, model, system_prompt):
+    raw = '\x1f'.join((normalize_message(message), model or '', system_prompt or ''))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with per-entry TTL and an optional SQLite tier.
+
+    max_entries: in-memory capacity; least recently used entries are evicted.
+    ttl: seconds an entry stays valid (both tiers).
+    db_path: optional SQLite file for the persistent tier.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600.0, db_path=None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_hits = 0
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def persistent(self):
+        """Whether lookups can reach the SQLite tier (and so block on disk)."""
+        return self._db is not None
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss."""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+        row = self._db_get(key, now)
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            # keep the disk row's expiry rather than starting a new TTL
+            self._store(key, row[0], row[1])
+        return row[0]
+
+    def set(self, key, value):
+        now = self._clock()
+        with self._lock:
+            self._store(key, value, now + self.ttl)
+        self._db_set(key, value, now + self.ttl)
+
+    def clear(self, persistent=True):
+        """Drop every entry; with persistent=False only the in-memory tier."""
+        with self._lock:
+            self._entries.clear()
+        if persistent and self._db is not None:
+            with self._db_lock:
+                self._db.execute('DELETE FROM responses')
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'disk_hits': self.disk_hits,
+                'persistent': self._db is not None,
+            }
+
+    def _store(self, key, value, expires_at):
+        # caller holds self._lock
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _db_get(self, key, now):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT value, expires_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._db.commit()
+                return None
+        return json.loads(row[0]), row[1]
+
+    def _db_set(self, key, value, expires_at):
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), expires_at),
+            )
+            self._db.commit()
@@ -13,11 +13,39 @@ Run:
 
 Then open http://127.0.0.1:5000 in your browser.
 """
+import atexit
 import os
 import json
-from flask import Flask, request, jsonify, send_from_directory
+import math
+import concurrent.futures
+import threading
+import time
+from flask import Flask, Response, request, jsonify, stream_with_context
 
-app = Flask(__name__, static_folder="frontend", static_url_path="")
+import admission
+import capture
+import catalog
+import deadlines
+import faq
+import intents
+import keypool
+import metrics
+import profiling
+import relevance
+import response_cache
+import sessions
+import shared_state
+import singleflight
+import static_assets
+import upstream
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FRONTEND_DIR = os.path.join(BASE_DIR, 'frontend')
+
+# The frontend is served from memory by `assets` (see index/static_proxy)
+# rather than Flask's per-request static file route.
+app = Flask(__name__, static_folder=None)
+assets = static_assets.StaticAssets(FRONTEND_DIR, watch=os.environ.get('STATIC_WATCH', '0') == '1')
 
 # runtime-held API key (keeps key out of files). Initialized from env if present.
 runtime_api_key = os.environ.get('OPENAI_API_KEY')
@@ -29,209 +57,1194 @@ def _is_local_request():
     return addr in ('127.0.0.1', '::1', 'localhost')
 
 
-def rule_based_response(text: str) -> str:
-    t = (text or '').lower()
-
-    # quick per-model laptop info map (local responses)
-    info_map = {
-        'macbook air': 'MacBook Air — Apple M1/M2-based ultralight laptop. Great battery life, fanless designs on M1/M2, typically 8–16GB RAM depending on config. Good for everyday productivity and light creative work.',
-        'dell xps 13': 'Dell XPS 13 — compact 13-inch Windows laptop with premium build and narrow bezels. Popular with developers and professionals; options for high-res displays and Intel CPUs.',
-        'lenovo thinkpad x1 carbon': 'Lenovo ThinkPad X1 Carbon — business-class ultrabook with excellent keyboard, robust chassis, and strong battery life. Often praised for durability and enterprise features.',
-        'hp spectre x360': 'HP Spectre x360 — convertible 2-in-1 with touchscreen and stylus support on some models. Sleek design, good performance for productivity, and flexible hinge for tablet mode.'
-    }
+def _admin_denied():
+    """Return an error response unless this is an authorized localhost admin call."""
+    if not _is_local_request():
+        return jsonify({'error': 'admin endpoints only allowed from localhost'}), 403
+    admin_token = request.headers.get('X-Admin-Token') or (request.get_json(silent=True) or {}).get('admin_token')
+    if not admin_token or admin_token != os.environ.get('ADMIN_TOKEN'):
+        return jsonify({'error': 'unauthorized'}), 401
+    return None
+
+
+# Product names, categories and the texts shown for them live in the catalog
+# (data/catalog.json by default, CATALOG_PATH to override). The chat intent
+# engine is rebuilt from it whenever it is reloaded, see _on_catalog_load.
+CATALOG_PATH = os.environ.get('CATALOG_PATH') or os.path.join(BASE_DIR, 'data', 'catalog.json')
+product_catalog = catalog.Catalog(CATALOG_PATH, watch=os.environ.get('CATALOG_WATCH', '0') == '1')
+chat_engine = None
+
+
+def _on_catalog_load(cat):
+    global chat_engine
+    engine = intents.default_engine(models=[], categories=cat.categories())
+    engine.add_matcher(intents.MODEL, cat.mentions)
+    chat_engine = engine
+
+
+product_catalog.on_load(_on_catalog_load)
+
+# replies for the topic intents; greeting/model/category are handled explicitly
+INTENT_REPLIES = {
+    intents.GREETING: "Hi there! What kind of thrift item are you looking for?",
+    intents.IDENTIFY: "Tell me a bit about the item's markings, materials, and any labels — I can help identify it.",
+    intents.VALUE: "I can give a rough estimate if you tell me the brand, condition, and approximate age.",
+    intents.TIPS: "Look for solid construction, classic brands, and minimal staining — always inspect seams and zippers.",
+    intents.BYE: "You're welcome — happy thrifting!",
+}
+
+FALLBACK_REPLY = "I don't have an exact answer for that, but I can help if you give more details about the thrift item."
+
+OFF_TOPIC_REPLY = "I can only assist with thrift-related questions. Please ask about vintage items, values, or thrifting tips."
+
+# Upstream replies are checked by a local relevance model (hashed n-grams,
+# trained on RELEVANCE_DATA at startup). A reply is replaced with
+# OFF_TOPIC_REPLY unless it scores at least RELEVANCE_THRESHOLD, or the
+# message it answers scores at least RELEVANCE_MESSAGE_THRESHOLD.
+relevance_model = relevance.load(
+    os.environ.get('RELEVANCE_DATA') or relevance.TRAIN_PATH,
+    reply_threshold=float(os.environ.get('RELEVANCE_THRESHOLD', 0.5)),
+    message_threshold=float(os.environ.get('RELEVANCE_MESSAGE_THRESHOLD', 0.5)),
+)
+
+UPSTREAM_MODEL = 'gpt-3.5-turbo'
+
+# Messages no intent covers are looked up in a local FAQ index before the
+# generic fallback. FAQ_PATH (default data/faq.json) is built once into
+# FAQ_INDEX_DIR (default: a temp directory named after its contents); an
+# answer needs a similarity of at least FAQ_MIN_SCORE. FAQ_PATH= turns it off.
+FAQ_PATH = os.environ.get('FAQ_PATH', faq.DEFAULT_SOURCE)
+faq_index = faq.load(FAQ_PATH, os.environ.get('FAQ_INDEX_DIR') or None,
+                     min_score=float(os.environ.get('FAQ_MIN_SCORE', 0.3))) if FAQ_PATH else None
+
+# Enforce thrift-only behavior via system prompt
+SYSTEM_PROMPT = (
+    "You are QUPAL, a thrift-shopping assistant. ONLY answer questions about thrifting, "
+    "vintage item identification, estimating values, or thrifting tips. If the user asks anything "
+    "unrelated to thrifting, politely refuse and ask them to ask a thrift-related question. "
+    "Keep answers concise and focused on thrift topics."
+)
+
+# Concurrent identical upstream requests wait on a single call; at most
+# CHAT_COALESCE_MAX_WAITERS callers share one call before new ones go alone.
+inflight = singleflight.SingleFlight(max_waiters=int(os.environ.get('CHAT_COALESCE_MAX_WAITERS', 1000)))
+
+# /api/chat/batch fans upstream items out over this shared, bounded pool.
+# Each item gets the request's deadline budget from when it reaches a worker;
+# CHAT_BATCH_DEADLINE_MS caps the batch as a whole.
+BATCH_MAX_ITEMS = int(os.environ.get('CHAT_BATCH_MAX_ITEMS', 500))
+BATCH_WORKERS = int(os.environ.get('CHAT_BATCH_WORKERS', 8))
+BATCH_DEADLINE = float(os.environ.get('CHAT_BATCH_DEADLINE_MS', 60000)) / 1000.0
+batch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='chat-batch')
+
+# Per-phase timings and response counters, served at /metrics in the
+# Prometheus text format. METRICS=0 turns recording and the endpoint off.
+registry = metrics.Registry(prefix='qupal_', enabled=os.environ.get('METRICS', '1') == '1')
+CHAT_PHASES = registry.histogram(
+    'chat_phase_seconds', 'Time spent in each phase of a chat request.', ['phase'])
+UPSTREAM_SECONDS = registry.histogram(
+    'upstream_seconds', 'Upstream completion call time by API variant and outcome.', ['variant', 'outcome'])
+CHAT_REQUESTS = registry.histogram(
+    'chat_request_seconds', 'Total /api/chat handling time.', ['endpoint'])
+PHASE_PARSE = CHAT_PHASES.labels(phase='parse')
+PHASE_GREETING = CHAT_PHASES.labels(phase='greeting')
+PHASE_LOCAL = CHAT_PHASES.labels(phase='local')
+PHASE_GUARD = CHAT_PHASES.labels(phase='guard')
+PHASE_SERIALIZE = CHAT_PHASES.labels(phase='serialize')
+CHAT_TOTAL = CHAT_REQUESTS.labels(endpoint='chat')
+CHAT_RESPONSES = registry.counter(
+    'chat_responses_total',
+    'Chat answers by source (local, cached, upstream, coalesced, degraded, shed, error, invalid).',
+    ['source'])
+
+# Conversation history per client session id (`session_id` in the body or
+# an X-Session-Id header). Upstream requests carry a window of earlier turns
+# plus a rolling summary, within CHAT_CONTEXT_TOKENS estimated tokens.
+chat_sessions = sessions.SessionStore(
+    max_sessions=int(os.environ.get('CHAT_SESSIONS_MAX', 100000)),
+    idle_ttl=float(os.environ.get('CHAT_SESSION_TTL', 1800)),
+)
+CONTEXT_TOKENS = int(os.environ.get('CHAT_CONTEXT_TOKENS', 1024))
+
+# Admission control. Each client (IP address, or session id with
+# CHAT_RATE_KEY=session) gets a token bucket of CHAT_RATE_BURST requests
+# refilled at CHAT_RATE per second (0 disables it). Upstream calls pass a
+# gate of UPSTREAM_CONCURRENCY slots with a queue of UPSTREAM_QUEUE waiting
+# at most UPSTREAM_QUEUE_TIMEOUT seconds. Requests refused by either get a
+# 429 with Retry-After, or a local rule-based answer when one applies.
+rate_limiter = admission.RateLimiter(
+    rate=float(os.environ.get('CHAT_RATE', 5)),
+    burst=float(os.environ.get('CHAT_RATE_BURST', 20)),
+)
+RATE_KEY = os.environ.get('CHAT_RATE_KEY', 'ip')
+upstream_gate = admission.ConcurrencyGate(
+    limit=int(os.environ.get('UPSTREAM_CONCURRENCY', 32)),
+    max_queue=int(os.environ.get('UPSTREAM_QUEUE', 64)),
+    timeout=float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', 5)),
+)
+# every gate in this process (asgi.py adds its own), for the gauges below
+upstream_gates = [upstream_gate]
+CHAT_SHED = registry.counter(
+    'chat_shed_total', 'Chat requests refused or degraded by admission control, by reason '
+    '(rate_limited, queue_full, queue_timeout, upstream_429, key_cooldown).', ['reason'])
+
+# Deadlines. A chat request has CHAT_DEADLINE_MS to be answered (default
+# 8000); clients may ask for another budget with `deadline_ms` in the body or
+# an X-Deadline-Ms header, clamped to CHAT_DEADLINE_MIN_MS..CHAT_DEADLINE_MAX_MS.
+# CHAT_DEADLINE_MARGIN_MS before it expires a pending upstream call is given
+# up and the rule-based reply is sent instead, marked degraded. With
+# CHAT_HEDGE=1 a call still running after the recent p95 upstream latency
+# gets a second attempt when a gate slot is free; the first reply wins.
+DEADLINE = float(os.environ.get('CHAT_DEADLINE_MS', 8000)) / 1000.0
+DEADLINE_MIN = float(os.environ.get('CHAT_DEADLINE_MIN_MS', 250)) / 1000.0
+DEADLINE_MAX = float(os.environ.get('CHAT_DEADLINE_MAX_MS', 30000)) / 1000.0
+DEADLINE_MARGIN = float(os.environ.get('CHAT_DEADLINE_MARGIN_MS', 50)) / 1000.0
+upstream_latency = deadlines.LatencyTracker()
+hedger = deadlines.Hedger(
+    concurrent.futures.ThreadPoolExecutor(max_workers=2 * upstream_gate.limit, thread_name_prefix='upstream'),
+    upstream_latency, enabled=os.environ.get('CHAT_HEDGE', '0') == '1')
+DEADLINE_EXCEEDED = registry.counter(
+    'chat_deadline_exceeded_total', 'Chat requests answered locally because the upstream missed the deadline.')
+
+# Upstream API keys. OPENAI_API_KEYS (comma-separated) and OPENAI_API_KEY
+# seed the pool and /admin/keys adds, drains and removes keys at runtime.
+# Each request takes the key with the most rate-limit headroom left, read
+# from the upstream's x-ratelimit-* headers, and keeps it to the end; a key
+# answered with 429 rests for its Retry-After, or UPSTREAM_KEY_COOLDOWN
+# seconds when the upstream gives none.
+key_pool = keypool.KeyPool(cooldown=float(os.environ.get('UPSTREAM_KEY_COOLDOWN', 10)))
+for _key in os.environ.get('OPENAI_API_KEYS', '').split(',') + [os.environ.get('OPENAI_API_KEY') or '']:
+    if _key.strip():
+        key_pool.add(_key.strip())
+
+
+def _observe_key(api_key, status, headers):
+    # looked up per call, so clients keep reporting to a replaced pool
+    key_pool.observe(api_key, status, headers)
+
+
+# pooled upstream clients by API key, see get_upstream()
+_upstream_clients = {}
+_upstream_lock = threading.Lock()
 
-    # greetings
-    if any(x in t for x in ["hello", "hi", "hey", "good morning", "good afternoon", "good evening"]):
-        return "Hi there! What kind of thrift item are you looking for?"
+# Several worker processes on one host share state through SHARED_STATE_DB,
+# a SQLite file: the key pool, the runtime key, cache clears and catalog
+# reloads apply to every worker, and it is the default response cache tier.
+# See _attach_shared().
+SHARED_STATE_DB = os.environ.get('SHARED_STATE_DB') or None
+shared = None
+
+# Upstream replies for repeated (FAQ-style) questions are served from here.
+# CHAT_CACHE_SIZE=0 disables the in-memory tier; CHAT_CACHE_DB adds a SQLite
+# tier that survives restarts.
+chat_cache = response_cache.ResponseCache(
+    max_entries=int(os.environ.get('CHAT_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('CHAT_CACHE_TTL', 3600)),
+    db_path=os.environ.get('CHAT_CACHE_DB') or SHARED_STATE_DB,
+)
+
+# read at scrape time, so they follow whatever the globals point to then
+registry.gauge_callback('cache_entries', 'Entries in the in-memory response cache.',
+                        lambda: chat_cache.stats()['entries'])
+registry.gauge_callback('cache_hits_total', 'Response cache hits.',
+                        lambda: chat_cache.stats()['hits'], type='counter')
+registry.gauge_callback('cache_misses_total', 'Response cache misses.',
+                        lambda: chat_cache.stats()['misses'], type='counter')
+registry.gauge_callback('upstream_in_flight', 'Distinct upstream calls in flight.',
+                        lambda: inflight.stats()['in_flight'])
+registry.gauge_callback('upstream_active', 'Upstream calls holding a concurrency slot.',
+                        lambda: sum(g.active for g in upstream_gates))
+registry.gauge_callback('upstream_queue_depth', 'Upstream calls waiting for a concurrency slot.',
+                        lambda: sum(g.waiting for g in upstream_gates))
+registry.gauge_callback('upstream_p95_seconds', 'Recent p95 upstream latency (the hedging delay).',
+                        lambda: upstream_latency.value() or 0.0)
+registry.gauge_callback('upstream_hedges_total', 'Hedged second upstream attempts.',
+                        lambda: hedger.hedged, type='counter')
+registry.gauge_callback('upstream_hedge_wins_total', 'Hedged attempts that answered first.',
+                        lambda: hedger.hedge_wins, type='counter')
+registry.gauge_callback('chat_sessions', 'Conversation sessions held in memory.', lambda: len(chat_sessions))
+registry.gauge_callback('faq_entries', 'Entries in the local FAQ index.',
+                        lambda: len(faq_index) if faq_index is not None else 0)
+registry.gauge_callback('catalog_items', 'Items in the product catalog.', lambda: len(product_catalog))
+
+
+def category_choices(category):
+    return {'reply': 'Which kind of %s are you interested in? Choose one:' % category,
+            'choices': product_catalog.choices(category)}
+
+
+# (catalog version, body) of the last catalog_snapshot()
+_catalog_snapshot = (None, None)
+
+
+def catalog_snapshot():
+    """Every category's choices reply and the `select` details of each listed model.
+
+    Both depend only on the catalog, so the frontend prefetches them once
+    and caches them under the catalog version.
+    """
+    global _catalog_snapshot
+    version = product_catalog.version
+    if _catalog_snapshot[0] == version:
+        return _catalog_snapshot[1]
+    categories = {}
+    details = {}
+    for category in product_catalog.categories():
+        categories[category] = category_choices(category)
+        for name in categories[category]['choices']:
+            item = product_catalog.exact(name)
+            if item is not None:
+                details[name] = item.summary
+    body = {'version': version, 'categories': categories, 'details': details}
+    _catalog_snapshot = (version, body)
+    return body
+
+
+def rule_based_response(text: str) -> str:
+    match = chat_engine.classify(text)
+    if match is None:
+        # a curated answer when the FAQ has a close enough question, else a generic fallback
+        answer = faq_index.answer(text) if faq_index is not None else None
+        return answer or FALLBACK_REPLY
 
     # if user mentions a specific model, return the model info
-    for name, info in info_map.items():
-        if name in t:
-            return info
-
-    # laptop choices: return a dict with choices so caller can render buttons
-    if 'laptop' in t:
-        choices = [
-            'MacBook Air',
-            'Dell XPS 13',
-            'Lenovo ThinkPad X1 Carbon',
-            'HP Spectre x360'
-        ]
-        return {'reply': 'Which kind of laptop are you interested in? Choose one:', 'choices': choices}
-
-    if "vintage" in t or "identify" in t or "what is this" in t:
-        return "Tell me a bit about the item's markings, materials, and any labels — I can help identify it."
-    if "value" in t or "estimate" in t or "worth" in t:
-        return "I can give a rough estimate if you tell me the brand, condition, and approximate age."
-    if "tips" in t or "thrift" in t:
-        return "Look for solid construction, classic brands, and minimal staining — always inspect seams and zippers."
-    if "bye" in t or "thanks" in t:
-        return "You're welcome — happy thrifting!"
-
-    # laptop detection handled separately; provide a generic fallback
-    return "I don't have an exact answer for that, but I can help if you give more details about the thrift item."
+    if match.intent == intents.MODEL:
+        item = product_catalog.exact(match.value)
+        if item is not None:
+            return item.description
+
+    # category choices: return a dict with choices so caller can render buttons
+    if match.intent == intents.CATEGORY:
+        return category_choices(match.value)
+
+    return INTENT_REPLIES.get(match.intent, FALLBACK_REPLY)
+
+
+def get_upstream(api_key):
+    """Return the shared pooled upstream client for `api_key`.
+
+    Each key's client is created once, so connections and the remembered
+    API variant survive across requests. Clients report every response's
+    rate-limit headers to `key_pool`.
+    """
+    client = _upstream_clients.get(api_key)
+    if client is not None:
+        return client
+    with _upstream_lock:
+        client = _upstream_clients.get(api_key)
+        if client is None:
+            client = _upstream_clients[api_key] = upstream.UpstreamClient(
+                api_key,
+                base_url=os.environ.get('OPENAI_BASE_URL', upstream.DEFAULT_BASE_URL),
+                chat_model=UPSTREAM_MODEL,
+                observer=_observe_key,
+            )
+        return client
+
+
+def _forget_client(api_key):
+    """Close the idle connections of a key that left the pool.
+
+    Requests still holding the key keep their reference to the client and
+    finish normally.
+    """
+    with _upstream_lock:
+        client = _upstream_clients.pop(api_key, None)
+    if client is not None:
+        client.close()
+
+
+def _upstream_reply(message, api_key, history=None, deadline=None):
+    client = get_upstream(api_key)
+    if deadline is None:
+        deadline = time.monotonic() + DEADLINE
+
+    def attempt(deadline):
+        sent = time.perf_counter()
+        reply = client.complete(SYSTEM_PROMPT, message, max_tokens=250, history=history, deadline=deadline)
+        if capture_log is not None:
+            capture_log.upstream(message, reply, time.perf_counter() - sent)
+        return reply
+
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        cooldown = key_pool.cooldown_left(api_key)
+        if cooldown > 0:
+            raise admission.Overloaded(keypool.COOLDOWN, cooldown)
+        upstream_gate.acquire(deadline - time.monotonic())
+        # the hedger releases the slot once the first attempt itself ends
+        with key_pool.using(api_key):
+            reply = hedger.call(attempt, deadline, gate=upstream_gate, holding=True)
+        outcome = 'ok'
+    except admission.Overloaded:
+        outcome = 'shed'
+        raise
+    except TimeoutError:
+        outcome = 'timeout'
+        raise
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, variant=client.variant or 'unknown', outcome=outcome)
+    return _guard_reply(message, reply)
+
+
+def _upstream_stream(message, api_key, history=None, deadline=None):
+    """Yield reply text pieces from the upstream API as they arrive."""
+    sent = time.perf_counter()
+    parts = []
+    with key_pool.using(api_key):
+        for piece in get_upstream(api_key).stream(SYSTEM_PROMPT, message, max_tokens=250, history=history,
+                                                  deadline=deadline):
+            parts.append(piece)
+            yield piece
+    if capture_log is not None:
+        capture_log.upstream(message, ''.join(parts), time.perf_counter() - sent)
+
+
+def _guard_reply(message, reply):
+    # replies the relevance model scores as off-topic (for an off-topic message) become a refusal
+    with PHASE_GUARD.time():
+        if not relevance_model.relevant(message, reply):
+            return OFF_TOPIC_REPLY
+        return reply
 
 
 @app.route('/admin/set_key', methods=['POST'])
 def admin_set_key():
     """Set the OpenAI API key for the running server process at runtime.
 
+    The key replaces every pooled key: the others are drained, so requests
+    already using them finish first.
+
     Security: requires an admin token (set in env `ADMIN_TOKEN`) and only
     accepts requests from localhost.
     """
-    if not _is_local_request():
-        return jsonify({'error': 'admin endpoints only allowed from localhost'}), 403
-    admin_token = request.headers.get('X-Admin-Token') or (request.get_json() or {}).get('admin_token')
-    if not admin_token or admin_token != os.environ.get('ADMIN_TOKEN'):
-        return jsonify({'error': 'unauthorized'}), 401
+    denied = _admin_denied()
+    if denied:
+        return denied
     payload = request.get_json() or {}
     key = payload.get('key')
     if not key:
         return jsonify({'error': 'no key provided'}), 400
-    global runtime_api_key
-    runtime_api_key = key
+    set_single_key(key)
     return jsonify({'ok': True})
 
 
 @app.route('/admin/clear_key', methods=['POST'])
 def admin_clear_key():
-    if not _is_local_request():
-        return jsonify({'error': 'admin endpoints only allowed from localhost'}), 403
-    admin_token = request.headers.get('X-Admin-Token') or (request.get_json() or {}).get('admin_token')
-    if not admin_token or admin_token != os.environ.get('ADMIN_TOKEN'):
-        return jsonify({'error': 'unauthorized'}), 401
+    denied = _admin_denied()
+    if denied:
+        return denied
+    set_single_key(None)
+    return jsonify({'ok': True})
+
+
+def set_single_key(key):
+    """Route all new requests to `key` (None: to no key at all)."""
     global runtime_api_key
-    runtime_api_key = None
+    new_id = key_pool.add(key) if key else None
+    for entry in key_pool.stats():
+        if entry['id'] != new_id:
+            key_pool.drain(entry['id'])
+    runtime_api_key = key
+    _publish_keys()
+
+
+def add_key(key, name=None):
+    key_id = key_pool.add(key, name)
+    _publish_keys()
+    return key_id
+
+
+def drain_key(key_id):
+    drained = key_pool.drain(key_id)
+    _publish_keys()
+    return drained
+
+
+def remove_key(key_id):
+    """Remove a key from the pool; returns the key, or None for an unknown id."""
+    removed = key_pool.remove(key_id)
+    if removed is not None:
+        _forget_client(removed)
+        _publish_keys()
+    return removed
+
+
+@app.route('/admin/keys', methods=['GET'])
+def admin_keys():
+    """List pooled keys (by id, never the key) with their quota and load."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify({'keys': key_pool.stats()})
+
+
+@app.route('/admin/keys', methods=['POST'])
+def admin_add_key():
+    """Add a key to the pool: {"key", "id"?}. Returns its id."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    payload = request.get_json() or {}
+    key = payload.get('key')
+    if not key:
+        return jsonify({'error': 'no key provided'}), 400
+    return jsonify({'ok': True, 'id': add_key(key, payload.get('id'))})
+
+
+@app.route('/admin/keys/drain', methods=['POST'])
+def admin_drain_key():
+    """Stop sending new requests to a key ({"id"}); requests in flight finish on it."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if not drain_key((request.get_json() or {}).get('id')):
+        return jsonify({'error': 'unknown key id'}), 404
     return jsonify({'ok': True})
 
 
+@app.route('/admin/keys/remove', methods=['POST'])
+def admin_remove_key():
+    """Remove a key from the pool ({"id"})."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if remove_key((request.get_json() or {}).get('id')) is None:
+        return jsonify({'error': 'unknown key id'}), 404
+    return jsonify({'ok': True})
+
+
+@app.route('/admin/cache', methods=['GET'])
+def admin_cache_stats():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify(chat_cache.stats())
+
+
+@app.route('/admin/cache/clear', methods=['POST'])
+def admin_cache_clear():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    clear_chat_cache()
+    return jsonify({'ok': True})
+
+
+def clear_chat_cache():
+    chat_cache.clear()
+    if shared is not None:
+        shared.bump('cache_clears')
+
+
+@app.route('/admin/inflight', methods=['GET'])
+def admin_inflight_stats():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify(inflight.stats())
+
+
+@app.route('/admin/admission', methods=['GET'])
+def admin_admission_stats():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify({'rate_limiter': rate_limiter.stats(), 'upstream': upstream_gate.stats()})
+
+
+@app.route('/admin/catalog/reload', methods=['POST'])
+def admin_catalog_reload():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        product_catalog.load()
+    except (OSError, ValueError, KeyError) as e:
+        return jsonify({'error': 'catalog reload failed', 'details': str(e)}), 500
+    catalog_reloaded()
+    return jsonify({'ok': True, 'version': product_catalog.version, 'items': len(product_catalog)})
+
+
+def catalog_reloaded():
+    if shared is not None:
+        shared.bump('catalog_reloads')
+
+
+def _publish_keys():
+    """Share the key pool and the runtime key with the other workers."""
+    if shared is not None:
+        shared.set('keys', key_pool.export())
+        shared.set('runtime_api_key', runtime_api_key or '')
+
+
+def _adopt_keys(keys):
+    for api_key in key_pool.sync(keys):
+        _forget_client(api_key)
+
+
+def _adopt_runtime_key(value):
+    global runtime_api_key
+    runtime_api_key = value or None
+
+
+def _adopt_catalog(_):
+    try:
+        product_catalog.load()
+    except (OSError, ValueError, KeyError) as e:
+        print('Shared catalog reload failed:', e)
+
+
+def _attach_shared(state):
+    """Share admin changes with the other workers through `state`; returns it.
+
+    The first worker to start publishes its keys; later ones adopt the
+    shared pool, so keys changed through the admin endpoints survive worker
+    restarts. Delete the SHARED_STATE_DB file to seed it from the env again.
+    """
+    global shared
+    shared = state
+    keys = state.get('keys')
+    if keys is None:
+        _publish_keys()
+    else:
+        _adopt_keys(keys)
+        _adopt_runtime_key(state.get('runtime_api_key'))
+    state.on_change('keys', _adopt_keys)
+    state.on_change('runtime_api_key', _adopt_runtime_key)
+    state.on_change('cache_clears', lambda _: chat_cache.clear(persistent=False))
+    state.on_change('catalog_reloads', _adopt_catalog)
+    return state
+
+
+@app.before_request
+def _poll_shared():
+    # a dict lookup and a clock read on most requests, see SharedState.poll()
+    if shared is not None:
+        shared.poll()
+
+
+@app.after_request
+def _catalog_version(resp):
+    # replies cached by the frontend are dropped when this changes
+    if request.path.startswith('/api/') and product_catalog.version:
+        resp.headers['X-Catalog-Version'] = product_catalog.version
+    return resp
+
+
+if SHARED_STATE_DB:
+    _attach_shared(shared_state.SharedState(
+        SHARED_STATE_DB, interval=float(os.environ.get('SHARED_STATE_POLL_MS', 100)) / 1000.0))
+
+
+# Admin-started profiling sessions over the chat routes; the app is only
+# wrapped while a session runs. See profiling.py.
+profiler = profiling.Profiler(app)
+
+# Opt-in traffic capture for replay.py: CHAT_CAPTURE=<file> logs chat
+# requests and upstream replies, rotating every CHAT_CAPTURE_MAX_MB (default
+# 64) and keeping CHAT_CAPTURE_BACKUPS old files (default 5).
+# CHAT_CAPTURE_REDACT=hash keeps only intent keywords of messages verbatim,
+# hashed with CHAT_CAPTURE_SALT (random per process by default).
+capture_log = None
+if os.environ.get('CHAT_CAPTURE'):
+    capture_log = capture.CaptureLog(
+        os.environ['CHAT_CAPTURE'],
+        max_bytes=int(float(os.environ.get('CHAT_CAPTURE_MAX_MB', 64)) * (1 << 20)),
+        backups=int(os.environ.get('CHAT_CAPTURE_BACKUPS', 5)),
+        redact=os.environ.get('CHAT_CAPTURE_REDACT', 'none'),
+        salt=os.environ.get('CHAT_CAPTURE_SALT') or None,
+        engine=lambda: chat_engine,
+    )
+    app.wsgi_app = capture.Middleware(app.wsgi_app, capture_log)
+    # write out whatever is still buffered when the process exits
+    atexit.register(capture_log.close)
+
+
+@app.route('/admin/profile', methods=['GET'])
+def admin_profile_status():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify(profiler.status())
+
+
+@app.route('/admin/profile/start', methods=['POST'])
+def admin_profile_start():
+    """Profile the chat routes for a while.
+
+    Body: {"mode": "sample" | "cprofile", "seconds", "requests", "route":
+    "chat" | "stream" | "batch", "source": "local" | "upstream",
+    "interval_ms"}; all optional. The session ends after `seconds` (default
+    30) or once `requests` matching requests were captured.
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if profiler.active:
+        return jsonify({'error': 'a profiling session is already running'}), 409
+    try:
+        status = profiler.start(**_profile_options(request.get_json() or {}))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(status)
+
+
+def _profile_options(payload):
+    """Profiler.start() arguments from an /admin/profile/start body (shared with asgi.py)."""
+    return {
+        'mode': payload.get('mode', profiling.SAMPLE),
+        'seconds': float(payload['seconds']) if payload.get('seconds') is not None else None,
+        'requests': int(payload['requests']) if payload.get('requests') is not None else None,
+        'route': payload.get('route'),
+        'source': payload.get('source'),
+        'interval': float(payload.get('interval_ms', 5)) / 1000.0,
+    }
+
+
+@app.route('/admin/profile/stop', methods=['POST'])
+def admin_profile_stop():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify(profiler.stop())
+
+
+@app.route('/admin/profile/result', methods=['GET'])
+def admin_profile_result():
+    """Download the last session: ?format=collapsed (sample), pstats or text (cprofile)."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        data, content_type, filename = profiler.result(request.args.get('format'))
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(data, content_type=content_type,
+                    headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not registry.enabled:
+        return jsonify({'error': 'metrics disabled'}), 404
+    return Response(registry.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/')
 def index():
-    return send_from_directory(app.static_folder, 'index.html')
+    return _static_response('index.html')
 
 
 @app.route('/<path:path>')
 def static_proxy(path):
     # serve static files
-    return send_from_directory(app.static_folder, path)
+    return _static_response(path)
 
 
-@app.route('/api/chat', methods=['POST'])
-def api_chat():
-    data = request.get_json() or {}
+def _static_response(path):
+    status, headers, body = assets.respond(
+        path, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    return Response(body, status=status, headers=headers)
+
+
+def _api_key():
+    """The key one request will use, chosen once and kept to its end.
+
+    The pooled key with the most quota left; without an active pooled key,
+    runtime_api_key or OPENAI_API_KEY.
+    """
+    return key_pool.choose() or runtime_api_key or os.environ.get('OPENAI_API_KEY')
+
+
+# /api/chat body fields that must be strings when present
+_TEXT_FIELDS = ('message', 'action', 'selection')
+INVALID_BODY = {'error': 'message, action and selection must be strings'}
+INVALID_ITEM = {'error': 'invalid item: message, action and selection must be strings'}
+
+
+def _text_fields_valid(data):
+    return not any(data.get(field) is not None and not isinstance(data[field], str) for field in _TEXT_FIELDS)
+
+
+def _local_answer(data, api_key):
+    """Answer a chat request without the upstream API when possible.
+
+    Returns (body, status), or None when the request needs an upstream completion.
+    """
+    if not _text_fields_valid(data):
+        CHAT_RESPONSES.inc(source='invalid')
+        return INVALID_BODY, 400
     message = data.get('message', '')
     action = data.get('action')
     selection = data.get('selection')
     local_flag = data.get('local', False) or os.environ.get('FORCE_LOCAL', '0') == '1'
-    if not message:
-        return jsonify({'error': 'no message'}), 400
+    if not message and not (action == 'select' and selection):
+        CHAT_RESPONSES.inc(source='invalid')
+        return {'error': 'no message'}, 400
+
+    # a model picked from a choices list is answered from the catalog
+    if action == 'select' and selection:
+        with PHASE_LOCAL.time():
+            item = product_catalog.exact(selection)
+        if item is not None:
+            return _local_reply({'reply': item.summary})
+        if local_flag or not api_key or not message:
+            with PHASE_LOCAL.time():
+                suggestion = product_catalog.suggest(selection)
+            if suggestion is None:
+                return _local_reply({'reply': 'Sorry, I do not have details for that model.'})
+            return _local_reply({'reply': 'Sorry, I do not have details for that model. Did you mean %s?' % suggestion,
+                                 'choices': [suggestion]})
+
+    # one pass over the message tells us every intent it mentions
+    with PHASE_GREETING.time():
+        found = chat_engine.scan(message)
+        greeting = intents.GREETING in found and action != 'select'
 
     # quick greeting handler: reply to simple salutations without requiring OpenAI
-    greetings = ["hello", "hi", "hey", "greetings", "good morning", "good afternoon", "good evening"]
-    low = message.lower()
-    if any(g in low for g in greetings) and action != 'select':
-        return jsonify({'reply': "Hello! I'm QUPAL, your thrift shopping AI assistant. What are you looking for today?"})
+    if greeting:
+        return _local_reply({'reply': "Hello! I'm QUPAL, your thrift shopping AI assistant. What are you looking for today?"})
 
-    # prefer runtime_api_key (set via admin endpoint), otherwise read env on start
-    api_key = runtime_api_key or os.environ.get('OPENAI_API_KEY')
     # If client requested local responses or server is configured to force local, use local responder
     if local_flag or not api_key:
-        # Handle selection action (laptop info) locally
-        if action == 'select' and selection:
-            info_map = {
-                'MacBook Air': 'MacBook Air — Apple M1/M2, lightweight, great battery life, starts around 8GB RAM. Good for everyday use and light creative work.',
-                'Dell XPS 13': 'Dell XPS 13 — compact 13-inch Windows laptop, premium build, excellent screen options. Good for developers and professionals.',
-                'Lenovo ThinkPad X1 Carbon': 'ThinkPad X1 Carbon — business laptop, excellent keyboard, durable chassis, available with Intel CPUs and long battery life.',
-                'HP Spectre x360': 'HP Spectre x360 — convertible 2-in-1, sleek design, touch screen, good performance for productivity tasks.'
-            }
-            reply = info_map.get(selection, 'Sorry, I do not have details for that model.')
-            return jsonify({'reply': reply})
-
-        # If message mentions laptop, return choices
-        if 'laptop' in (message or '').lower():
-            choices = [
-                'MacBook Air',
-                'Dell XPS 13',
-                'Lenovo ThinkPad X1 Carbon',
-                'HP Spectre x360'
-            ]
-            return jsonify({'reply': 'Which kind of laptop are you interested in? Choose one:', 'choices': choices})
-
-        # Otherwise return local rule-based reply (function may return dict)
+        with PHASE_LOCAL.time():
+            # If message mentions a product category, return choices
+            if intents.CATEGORY in found:
+                body = category_choices(found[intents.CATEGORY].value)
+            else:
+                # Otherwise return local rule-based reply (function may return dict)
+                local_resp = rule_based_response(message)
+                body = local_resp if isinstance(local_resp, dict) else {'reply': local_resp}
+        return _local_reply(body)
+
+    # Special handling: if the user asked about a category, provide a choice list instead of AI reply
+    if intents.CATEGORY in found and action != 'select':
+        with PHASE_LOCAL.time():
+            body = category_choices(found[intents.CATEGORY].value)
+        return _local_reply(body)
+    profiler.note(profiling.UPSTREAM)
+    return None
+
+
+def _local_reply(body):
+    CHAT_RESPONSES.inc(source='local')
+    # marked so clients may cache it: local answers never depend on the session
+    return dict(body, local=True), 200
+
+
+def _cache_bypassed(data):
+    return data.get('cache') is False or 'no-cache' in request.headers.get('Cache-Control', '')
+
+
+def _session_id(data, header=None):
+    """The client's session id from the body or header, or None if absent/invalid."""
+    session_id = data.get('session_id') or header
+    return session_id if sessions.valid_session_id(session_id) else None
+
+
+def _history(session_id, message):
+    """Earlier turns of the session to send upstream with `message`."""
+    if session_id is None:
+        return []
+    reserve = sessions.prompt_tokens(SYSTEM_PROMPT, [], message)
+    return chat_sessions.history(session_id, CONTEXT_TOKENS, reserve)
+
+
+def _chat_key(message, history):
+    # with history the reply depends on the conversation, not just the message;
+    # sessions that got the same answers so far (mostly local ones) share a key
+    context = SYSTEM_PROMPT
+    if history:
+        context += '\x1f' + json.dumps(history, separators=(',', ':'))
+    return response_cache.make_key(message, UPSTREAM_MODEL, context)
+
+
+def _record_turn(session_id, data, body, status):
+    reply = body.get('reply')
+    if session_id is not None and status == 200 and isinstance(reply, str):
+        chat_sessions.record(session_id, data.get('message') or data.get('selection') or '', reply)
+
+
+def _client_key(remote_addr, session_id):
+    if RATE_KEY == 'session' and session_id is not None:
+        return 'session:' + session_id
+    return 'ip:' + (remote_addr or '')
+
+
+def _rate_limited(remote_addr, session_id):
+    """Return a 429 (body, status) if the client is over its rate, else None."""
+    allowed, retry_after = rate_limiter.allow(_client_key(remote_addr, session_id))
+    if allowed:
+        return None
+    CHAT_SHED.inc(reason='rate_limited')
+    return {'error': 'rate limited', 'retry_after': retry_after}, 429
+
+
+def _overloaded_answer(message, reason, retry_after):
+    """Answer a request the upstream could not take right now. Returns (body, status).
+
+    Questions the local rules recognize get the rule-based reply, marked
+    `degraded`; anything else is shed with a 429.
+    """
+    CHAT_SHED.inc(reason=reason)
+    with PHASE_LOCAL.time():
+        local_resp = rule_based_response(message)
+    if local_resp != FALLBACK_REPLY:
+        CHAT_RESPONSES.inc(source='degraded')
+        body = local_resp if isinstance(local_resp, dict) else {'reply': local_resp}
+        return dict(body, degraded=True), 200
+    CHAT_RESPONSES.inc(source='shed')
+    return {'error': 'server busy', 'retry_after': retry_after}, 429
+
+
+def _upstream_retry_after(err):
+    # upstream rate limits say how long to wait; fall back to the gate's hint
+    try:
+        return float(err.headers.get('retry-after') or err.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return upstream_gate.retry_after
+
+
+def _with_retry_after(resp, body, status):
+    if status == 429:
+        resp.headers['Retry-After'] = str(max(1, math.ceil(body.get('retry_after', 1))))
+    return resp
+
+
+def request_deadline(data, header=None, now=None):
+    """Absolute (time.monotonic()) deadline for a chat request.
+
+    `deadline_ms` in the body, or the X-Deadline-Ms header, replaces the
+    default budget within CHAT_DEADLINE_MIN_MS..CHAT_DEADLINE_MAX_MS.
+    """
+    budget = DEADLINE
+    requested = data.get('deadline_ms', header)
+    if requested is not None:
+        try:
+            budget = deadlines.clamp(float(requested) / 1000.0, DEADLINE_MIN, DEADLINE_MAX)
+        except (TypeError, ValueError):
+            pass
+    return (time.monotonic() if now is None else now) + budget
+
+
+def _deadline_answer(message):
+    """Answer locally when the upstream did not reply in time. Returns (body, status)."""
+    DEADLINE_EXCEEDED.inc()
+    CHAT_RESPONSES.inc(source='degraded')
+    with PHASE_LOCAL.time():
         local_resp = rule_based_response(message)
-        if isinstance(local_resp, dict):
-            return jsonify(local_resp)
-        return jsonify({'reply': local_resp})
+    body = local_resp if isinstance(local_resp, dict) else {'reply': local_resp}
+    return dict(body, degraded=True), 200
+
+
+def _upstream_answer(data, api_key, bypass_cache=False, session_id=None, deadline=None):
+    """Answer a chat request that needs the upstream API. Returns (body, status)."""
+    message = data['message']
+    # leave time to answer locally if the upstream is late
+    cutoff = (deadline or request_deadline(data)) - DEADLINE_MARGIN
+    history = _history(session_id, message)
+    key = _chat_key(message, history)
+    # replies in the context of a conversation are not reusable, so not cached
+    if not bypass_cache:
+        cached = chat_cache.get(key)
+        if cached is not None:
+            CHAT_RESPONSES.inc(source='cached')
+            return {'reply': cached, 'cached': True}, 200
+    try:
+        # identical questions already in flight share one upstream call
+        reply, shared = inflight.do(key, lambda: _upstream_reply(message, api_key, history, cutoff),
+                                    timeout=max(0.0, cutoff - time.monotonic()))
+    except TimeoutError:
+        return _deadline_answer(message)
+    except admission.Overloaded as e:
+        return _overloaded_answer(message, e.reason, e.retry_after)
+    except upstream.UpstreamError as e:
+        if e.status != 429:
+            return _upstream_failed(e)
+        return _overloaded_answer(message, 'upstream_429', _upstream_retry_after(e))
+    except Exception as e:
+        return _upstream_failed(e)
+    if not shared:
+        chat_cache.set(key, reply)
+    CHAT_RESPONSES.inc(source='coalesced' if shared else 'upstream')
+    return {'reply': reply}, 200
+
+
+def _upstream_failed(e):
+    # log error server-side and return an error to the client
+    print('OpenAI request error:', str(e))
+    CHAT_RESPONSES.inc(source='error')
+    return {'error': 'OpenAI request failed', 'details': str(e)}, 500
+
+
+def handle_chat(data, bypass_cache=False, session_id=None, deadline=None):
+    """Answer one /api/chat request body. Returns (body, status).
+
+    Does not touch the Flask request, so it can run on worker threads.
+    With a session id the exchange is added to that conversation.
+    """
+    api_key = _api_key()
+    answered = _local_answer(data, api_key)
+    if answered is None:
+        answered = _upstream_answer(data, api_key, bypass_cache, session_id, deadline)
+    _record_turn(session_id, data, *answered)
+    return answered
+
+
+@app.route('/api/chat', methods=['POST'])
+def api_chat():
+    with CHAT_TOTAL.time():
+        with PHASE_PARSE.time():
+            data = request.get_json() or {}
+        deadline = request_deadline(data, request.headers.get('X-Deadline-Ms'))
+        session_id = _session_id(data, request.headers.get('X-Session-Id'))
+        answered = _rate_limited(request.remote_addr, session_id)
+        if answered is None:
+            answered = handle_chat(data, _cache_bypassed(data), session_id, deadline)
+        body, status = answered
+        with PHASE_SERIALIZE.time():
+            resp = _with_retry_after(jsonify(body), body, status)
+    return resp, status
+
+
+@app.route('/api/catalog', methods=['GET'])
+def api_catalog():
+    """Choice lists and model details for the frontend to prefetch (see catalog_snapshot)."""
+    etag = '"%s"' % product_catalog.version
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    resp = jsonify(catalog_snapshot())
+    resp.headers.update(headers)
+    return resp
+
+
+
+def _batch_item(item):
+    """The /api/chat body of one batch item, or None if it is malformed."""
+    # items may be plain strings or full /api/chat bodies
+    if isinstance(item, str):
+        return {'message': item}
+    if not isinstance(item, dict):
+        return None
+    if not _text_fields_valid(item):
+        return None
+    return item
+
+
+def _batch_plan(items, api_key, remote_addr, session_id):
+    """Answer what a batch can without the upstream API.
+
+    Returns (results, upstream, limited): results[i] is item i's (body,
+    status) or None, upstream lists the (index, body) pairs that still need
+    an upstream completion, and limited is the rate-limited (body, status)
+    with the longest retry_after, or None. Each upstream-bound item costs a
+    rate-limit token like a /api/chat request; the first is paid by the
+    batch request's own token, and items past the client's rate get a 429.
+    """
+    results = [None] * len(items)
+    upstream = []
+    limited = None
+    paid = True
+    for i, raw in enumerate(items):
+        item = _batch_item(raw)
+        answered = (INVALID_ITEM, 400) if item is None else _local_answer(item, api_key)
+        if answered is None:
+            if paid:
+                paid = False
+            else:
+                answered = _rate_limited(remote_addr, session_id)
+                if answered is not None and (limited is None or answered[0]['retry_after'] > limited[0]['retry_after']):
+                    limited = answered
+        if answered is None:
+            upstream.append((i, item))
+        else:
+            results[i] = answered
+    return results, upstream, limited
 
-    if api_key:
+
+def _batch_item_deadline(budget, batch_deadline):
+    """Deadline of a batch item that just got a worker, or None once the batch is out of time."""
+    now = time.monotonic()
+    deadline = min(now + budget, batch_deadline)
+    return deadline if deadline - DEADLINE_MARGIN > now else None
+
+
+def _batch_upstream_answer(item, api_key, bypass_cache, budget, batch_deadline):
+    deadline = _batch_item_deadline(budget, batch_deadline)
+    if deadline is None:
+        return _deadline_answer(item['message'])
+    return _upstream_answer(item, api_key, bypass_cache, None, deadline)
+
+
+@app.route('/api/chat/batch', methods=['POST'])
+def api_chat_batch():
+    """Answer many chat messages in one request.
+
+    Body: {"items": [<string or /api/chat body>, ...], "stream": false}.
+    Local and rule-based answers are computed inline; upstream ones fan out
+    over a bounded worker pool. The response lists one result per item, in
+    order, each with its `index` and `status`. With "stream": true (or an
+    `Accept: application/x-ndjson` header) results are written as NDJSON
+    lines in completion order instead. Items are answered independently,
+    without session history. Items over the client's rate limit are
+    answered 429 and the response carries a Retry-After header.
+
+    Each upstream item has the request's deadline budget from when a worker
+    picks it up, so items queued behind others are not cut short; items
+    still unanswered after BATCH_DEADLINE get the degraded local reply.
+    """
+    data = request.get_json() or {}
+    session_id = _session_id(data, request.headers.get('X-Session-Id'))
+    limited = _rate_limited(request.remote_addr, session_id)
+    if limited is not None:
+        return _with_retry_after(jsonify(limited[0]), *limited), 429
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'no items'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': 'too many items', 'max_items': BATCH_MAX_ITEMS}), 413
+    bypass = _cache_bypassed(data)
+    api_key = _api_key()
+    budget = request_deadline(data, request.headers.get('X-Deadline-Ms'), now=0.0)
+    batch_deadline = time.monotonic() + BATCH_DEADLINE
+
+    results, upstream, limited = _batch_plan(items, api_key, request.remote_addr, session_id)
+    pending = {batch_pool.submit(_batch_upstream_answer, item, api_key, bypass, budget, batch_deadline): i
+               for i, item in upstream}
+
+    def result(i, answered):
+        body, status = answered
+        return dict(body, index=i, status=status)
+
+    if data.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        def generate():
+            for i, answered in enumerate(results):
+                if answered is not None:
+                    yield json.dumps(result(i, answered)) + '\n'
+            for future in concurrent.futures.as_completed(pending):
+                yield json.dumps(result(pending[future], future.result())) + '\n'
+        resp = Response(generate(), mimetype='application/x-ndjson')
+    else:
+        for future, i in pending.items():
+            results[i] = future.result()
+        resp = jsonify({'results': [result(i, answered) for i, answered in enumerate(results)]})
+    return _with_retry_after(resp, *limited) if limited is not None else resp
+
+
+def _sse(event, payload):
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(payload))
+
+
+def _sse_response(events):
+    # X-Accel-Buffering stops reverse proxies from holding tokens back
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def api_chat_stream():
+    """Server-Sent Events variant of /api/chat.
+
+    Events: `token` ({"text"}) as upstream text arrives, `replace` ({"text"})
+    when the relevance model (see _guard_reply) scores the finished reply as
+    off-topic and swaps it for a refusal,
+    `done` (the same body /api/chat would return) and `error`. Local,
+    rule-based and cached answers arrive as a single token followed by done.
+    The request deadline bounds the wait for the first upstream token; past
+    it the rule-based reply is sent, marked degraded.
+    """
+    data = request.get_json() or {}
+    cutoff = request_deadline(data, request.headers.get('X-Deadline-Ms')) - DEADLINE_MARGIN
+    session_id = _session_id(data, request.headers.get('X-Session-Id'))
+    answered = _rate_limited(request.remote_addr, session_id)
+    api_key = _api_key()
+    if answered is None:
+        answered = _local_answer(data, api_key)
+    if answered is not None:
+        return _sse_answer(session_id, data, *answered)
+
+    message = data['message']
+    history = _history(session_id, message)
+    key = _chat_key(message, history)
+    if not _cache_bypassed(data):
+        cached = chat_cache.get(key)
+        if cached is not None:
+            _record_turn(session_id, data, {'reply': cached}, 200)
+            return _sse_response([_sse('token', {'text': cached}), _sse('done', {'reply': cached, 'cached': True})])
+
+    cooldown = key_pool.cooldown_left(api_key)
+    if cooldown > 0:
+        return _sse_answer(session_id, data, *_overloaded_answer(message, keypool.COOLDOWN, cooldown))
+    # the slot is taken before responding, so a full queue can still be a 429
+    try:
+        upstream_gate.acquire(cutoff - time.monotonic())
+    except TimeoutError:
+        return _sse_answer(session_id, data, *_deadline_answer(message))
+    except admission.Overloaded as e:
+        return _sse_answer(session_id, data, *_overloaded_answer(message, e.reason, e.retry_after))
+    slot = [upstream_gate]
+
+    def release():
+        # from the generator or on close, whichever comes first
+        if slot:
+            slot.pop().release()
+
+    def generate():
+        parts = []
         try:
-            import openai
-            openai.api_key = api_key
-            # Enforce thrift-only behavior via system prompt
-            system_prompt = (
-                "You are QUPAL, a thrift-shopping assistant. ONLY answer questions about thrifting, "
-                "vintage item identification, estimating values, or thrifting tips. If the user asks anything "
-                "unrelated to thrifting, politely refuse and ask them to ask a thrift-related question. "
-                "Keep answers concise and focused on thrift topics."
-            )
-            # prefer ChatCompletion if available
-            try:
-                resp = openai.ChatCompletion.create(
-                    model='gpt-3.5-turbo',
-                    messages=[
-                        {'role': 'system', 'content': system_prompt},
-                        {'role': 'user', 'content': message},
-                    ],
-                    max_tokens=250,
-                )
-                reply = resp.choices[0].message.content.strip()
-            except Exception:
-                # fallback to text completion with an explicit prompt
-                prompt = (
-                    system_prompt + "\n\nUser: " + message + "\nAssistant:" 
-                )
-                resp = openai.Completion.create(
-                    engine='text-davinci-003',
-                    prompt=prompt,
-                    max_tokens=250,
-                )
-                reply = resp.choices[0].text.strip()
-            # Basic safeguard: if the model responds with unrelated content, replace with refusal
-            thrift_keywords = [
-                'thrift', 'vintage', 'antique', 'value', 'estimate', 'brand', 'condition', 'zippers', 'stains', 'identify', 'label', 'seams'
-            ]
-            if not any(k in reply.lower() for k in thrift_keywords) and not any(k in message.lower() for k in thrift_keywords):
-                reply = "I can only assist with thrift-related questions. Please ask about vintage items, values, or thrifting tips."
-            # Special handling: if the user asked about laptops, provide a choice list instead of AI reply
-            if 'laptop' in message.lower() and action != 'select':
-                choices = [
-                    'MacBook Air',
-                    'Dell XPS 13',
-                    'Lenovo ThinkPad X1 Carbon',
-                    'HP Spectre x360'
-                ]
-                return jsonify({'reply': 'Which kind of laptop are you interested in? Choose one:', 'choices': choices})
-            # If this is a selection action, fall through to return the reply
-            return jsonify({'reply': reply})
+            for piece in _upstream_stream(message, api_key, history, cutoff):
+                parts.append(piece)
+                yield _sse('token', {'text': piece})
+        except (upstream.UpstreamError, TimeoutError) as e:
+            release()
+            if parts or not (isinstance(e, TimeoutError) or e.status == 429):
+                yield _sse_error(e)
+                return
+            if isinstance(e, TimeoutError):
+                body, status = _deadline_answer(message)
+            else:
+                body, status = _overloaded_answer(message, 'upstream_429', _upstream_retry_after(e))
+            if status != 200:
+                yield _sse('error', body)
+                return
+            _record_turn(session_id, data, body, status)
+            yield _sse('token', {'text': body.get('reply', '')})
+            yield _sse('done', body)
+            return
         except Exception as e:
-            # log error server-side and return an error to the client
-            print('OpenAI request error:', str(e))
-            return jsonify({'error': 'OpenAI request failed', 'details': str(e)}), 500
+            release()
+            yield _sse_error(e)
+            return
+        release()
+        streamed = ''.join(parts).strip()
+        reply = _guard_reply(message, streamed)
+        if reply != streamed:
+            yield _sse('replace', {'text': reply})
+        chat_cache.set(key, reply)
+        _record_turn(session_id, data, {'reply': reply}, 200)
+        yield _sse('done', {'reply': reply})
 
-    # If API key is not configured, we can still handle selection actions locally for basic laptop info
-    # but otherwise inform the client to set the key.
-    if action == 'select' and selection:
-        # Provide basic laptop info mapping without OpenAI
-        info_map = {
-            'MacBook Air': 'MacBook Air — Apple M1/M2, lightweight, great battery life, starts around 8GB RAM. Good for everyday use and light creative work.',
-            'Dell XPS 13': 'Dell XPS 13 — compact 13-inch Windows laptop, premium build, excellent screen options. Good for developers and professionals.',
-            'Lenovo ThinkPad X1 Carbon': 'ThinkPad X1 Carbon — business laptop, excellent keyboard, durable chassis, available with Intel CPUs and long battery life.',
-            'HP Spectre x360': 'HP Spectre x360 — convertible 2-in-1, sleek design, touch screen, good performance for productivity tasks.'
-        }
-        reply = info_map.get(selection, 'Sorry, I do not have details for that model.')
-        return jsonify({'reply': reply})
-
-    return jsonify({'error': 'OPENAI_API_KEY not set on server. Set the environment variable and restart the server.'}), 403
+    resp = _sse_response(stream_with_context(generate()))
+    resp.call_on_close(release)
+    return resp
+
+
+def _sse_answer(session_id, data, body, status):
+    """Respond to a stream request that was answered without streaming upstream."""
+    if status != 200:
+        return _with_retry_after(jsonify(body), body, status), status
+    _record_turn(session_id, data, body, status)
+    return _sse_response([_sse('token', {'text': body.get('reply', '')}), _sse('done', body)])
+
+
+def _sse_error(e):
+    print('OpenAI request error:', str(e))
+    return _sse('error', {'error': 'OpenAI request failed', 'details': str(e)})
 
 
 if __name__ == '__main__':
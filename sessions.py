@@ -0,0 +1,215 @@
+"""
+Server-side conversation sessions with a token-budgeted context window.
+
+Each session (keyed by a client-chosen id) keeps only a short sliding window
+of recent turns plus a rolling plain-text summary of the turns that fell out
+of it. Turns are stored as single strings with a one-character role tag, are
+truncated to `max_turn_chars`, and the window is capped both in turns and in
+characters, so a session's memory is bounded no matter how long the
+conversation runs. Sessions live in an OrderedDict in least-recently-used
+order; idle ones are dropped from the front on every write and the store
+never holds more than `max_sessions`.
+
+`history()` turns a session into upstream chat messages that fit a token
+budget: the summary (if any) followed by as many of the newest turns as fit,
+oldest first. Tokens are estimated at ~4 characters each, which is close
+enough for budgeting without a tokenizer.
+
+  store = SessionStore()
+  messages = store.history(session_id, budget=1024, reserve=estimate_tokens(prompt))
+  ...
+  store.record(session_id, message, reply)
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+USER = 'user'
+ASSISTANT = 'assistant'
+
+_TAGS = {USER: 'u', ASSISTANT: 'a'}
+_ROLES = {'u': USER, 'a': ASSISTANT}
+_LABELS = {'u': 'User', 'a': 'Assistant'}
+
+# chat-format overhead per message (role, separators)
+MESSAGE_OVERHEAD = 4
+
+MAX_SESSION_ID = 128
+_SESSION_ID_RE = re.compile(r'^[A-Za-z0-9._:-]+$')
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s')
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def valid_session_id(session_id):
+    return (isinstance(session_id, str) and 0 < len(session_id) <= MAX_SESSION_ID
+            and _SESSION_ID_RE.match(session_id) is not None)
+
+
+def _gist(text, limit):
+    # first sentence, clipped; good enough to keep the thread of a conversation
+    head = ' '.join(text[:limit + 1].split())
+    end = _SENTENCE_RE.search(head)
+    if end is not None:
+        return head[:end.start()]
+    if len(text) <= limit:
+        return head
+    return head[:limit].rsplit(' ', 1)[0] + '...'
+
+
+class Session:
+    __slots__ = ('turns', 'chars', 'summary', 'touched')
+
+    def __init__(self, now):
+        self.turns = deque()  # role tag + text, oldest first
+        self.chars = 0
+        self.summary = ''
+        self.touched = now
+
+
+class SessionStore:
+    """Thread-safe LRU of conversation sessions with idle expiry.
+
+    max_sessions: sessions kept; the least recently used is evicted beyond it.
+    idle_ttl: seconds without activity after which a session is dropped.
+    max_turns / window_chars: bounds on the verbatim turn window.
+    max_turn_chars: longer turns are truncated when stored.
+    summary_chars: bound on the rolling summary of older turns.
+    """
+
+    def __init__(self, max_sessions=100000, idle_ttl=1800.0, max_turns=8, window_chars=4000,
+                 max_turn_chars=1000, summary_chars=600, gist_chars=120, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.window_chars = window_chars
+        self.max_turn_chars = max_turn_chars
+        self.summary_chars = summary_chars
+        self.gist_chars = gist_chars
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _get(self, session_id, now):
+        # lock held; returns a live session or None
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if now - session.touched > self.idle_ttl:
+            del self._sessions[session_id]
+            self.expirations += 1
+            return None
+        return session
+
+    def _expire(self, now):
+        # lock held; the front of the OrderedDict is the least recently used
+        sessions = self._sessions
+        while sessions:
+            session_id, session = next(iter(sessions.items()))
+            if now - session.touched <= self.idle_ttl:
+                break
+            del sessions[session_id]
+            self.expirations += 1
+
+    def record(self, session_id, message, reply):
+        """Append one user message and its reply to the session, creating it if needed."""
+        now = self._clock()
+        with self._lock:
+            self._expire(now)
+            session = self._get(session_id, now)
+            if session is None:
+                session = self._sessions[session_id] = Session(now)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._sessions.move_to_end(session_id)
+                session.touched = now
+            self._append(session, 'u', message)
+            self._append(session, 'a', reply)
+
+    def _append(self, session, tag, text):
+        text = text[:self.max_turn_chars]
+        session.turns.append(tag + text)
+        session.chars += len(text)
+        while session.turns and (len(session.turns) > self.max_turns or session.chars > self.window_chars):
+            old = session.turns.popleft()
+            session.chars -= len(old) - 1
+            self._fold(session, old)
+
+    def _fold(self, session, turn):
+        # move a turn that left the window into the rolling summary, dropping
+        # the oldest summary text once it is over summary_chars
+        piece = '%s: %s' % (_LABELS[turn[0]], _gist(turn[1:], self.gist_chars))
+        summary = session.summary + ' | ' + piece if session.summary else piece
+        if len(summary) > self.summary_chars:
+            cut = summary.find(' | ', len(summary) - self.summary_chars)
+            summary = summary[cut + 3:] if cut >= 0 else summary[-self.summary_chars:]
+        session.summary = summary
+
+    def history(self, session_id, budget=1024, reserve=0):
+        """Prior turns of `session_id` as chat messages, oldest first.
+
+        The result fits in `budget - reserve` estimated tokens (reserve covers
+        the system prompt and the new message). The summary goes first when
+        it fits; then the newest turns, as many as fit. Unknown or expired
+        sessions have no history.
+        """
+        now = self._clock()
+        with self._lock:
+            session = self._get(session_id, now)
+            if session is None:
+                return []
+            self._sessions.move_to_end(session_id)
+            session.touched = now
+            turns = list(session.turns)
+            summary = session.summary
+        left = budget - reserve
+        head = []
+        if summary:
+            note = 'Summary of the earlier conversation: ' + summary
+            cost = estimate_tokens(note) + MESSAGE_OVERHEAD
+            if cost <= left:
+                head.append({'role': 'system', 'content': note})
+                left -= cost
+        tail = []
+        for turn in reversed(turns):
+            cost = estimate_tokens(turn) + MESSAGE_OVERHEAD
+            if cost > left:
+                break
+            tail.append({'role': _ROLES[turn[0]], 'content': turn[1:]})
+            left -= cost
+        tail.reverse()
+        return head + tail
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+def prompt_tokens(system_prompt, history, message):
+    """Estimated prompt size of one upstream chat request."""
+    messages = [system_prompt, message] + [m['content'] for m in history]
+    return sum(estimate_tokens(text) + MESSAGE_OVERHEAD for text in messages)
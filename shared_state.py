@@ -0,0 +1,132 @@
+"""
+Small key-value store shared by every worker process on one host.
+
+Values are JSON in a SQLite table in WAL mode, so writers never block
+readers and no network service is needed. Each process keeps a local copy
+of all values: `get()` is a dict lookup, and at most every `interval`
+seconds it first asks SQLite whether another connection has committed
+(`PRAGMA data_version`, a few microseconds). Only then is the table read
+again, and callbacks registered with `on_change()` run for the names whose
+version moved. Changes made by this process apply locally at once and do
+not call its own callbacks; the writer has already acted on them.
+
+  state = SharedState('/run/qupal/state.db')
+  state.on_change('runtime_api_key', lambda value: ...)
+  state.set('runtime_api_key', 'sk-...')  # seen by other workers within `interval`
+  state.get('runtime_api_key')
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SharedState:
+    """Process-shared JSON values with change notification.
+
+    interval: seconds between checks for other processes' writes; 0 checks
+    on every read.
+    """
+
+    def __init__(self, path, interval=0.1, clock=time.monotonic):
+        self.path = path
+        self.interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._values = {}
+        self._versions = {}
+        self._callbacks = {}
+        self._data_version = None
+        self._next_check = 0.0
+        self.refreshes = 0
+        if not os.path.exists(path):
+            # values can include API keys: keep the file private to the owner
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        # autocommit mode, so transactions are only the ones begun below
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS shared_state '
+            '(name TEXT PRIMARY KEY, value TEXT NOT NULL, version INTEGER NOT NULL)'
+        )
+        self.refresh()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, name, default=None):
+        self.poll()
+        value = self._values.get(name)
+        return default if value is None else value
+
+    def set(self, name, value):
+        """Store `value` (JSON-serializable; None deletes) for every process."""
+        self._write(name, lambda current: value)
+
+    def delete(self, name):
+        self.set(name, None)
+
+    def bump(self, name):
+        """Atomically increment an integer value; returns the new value."""
+        return self._write(name, lambda current: (current or 0) + 1)
+
+    def on_change(self, name, callback):
+        """Call `callback(value)` whenever another process changes `name`."""
+        with self._lock:
+            self._callbacks.setdefault(name, []).append(callback)
+
+    def due(self):
+        """Whether the next poll() would query the database."""
+        return self._clock() >= self._next_check
+
+    def poll(self):
+        """refresh() when `interval` has passed since the last check."""
+        now = self._clock()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.interval
+        return self.refresh()
+
+    def refresh(self):
+        """Load other processes' changes; returns whether anything changed."""
+        with self._lock:
+            data_version = self._db.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self._data_version:
+                return False
+            self._data_version = data_version
+            self.refreshes += 1
+            changed = []
+            for name, raw, version in self._db.execute('SELECT name, value, version FROM shared_state'):
+                if self._versions.get(name) != version:
+                    self._versions[name] = version
+                    self._values[name] = json.loads(raw)
+                    changed.append(name)
+        self._notify(changed)
+        return bool(changed)
+
+    def _write(self, name, update):
+        with self._lock:
+            # an immediate transaction takes the write lock before reading, so
+            # concurrent bump()s from several processes cannot lose updates
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT value FROM shared_state WHERE name = ?', (name,)).fetchone()
+                value = update(json.loads(row[0]) if row is not None else None)
+                version = self._db.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM shared_state').fetchone()[0]
+                self._db.execute('INSERT OR REPLACE INTO shared_state (name, value, version) VALUES (?, ?, ?)',
+                                 (name, json.dumps(value), version))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._values[name] = value
+            self._versions[name] = version
+        return value
+
+    def _notify(self, names):
+        for name in names:
+            for callback in self._callbacks.get(name, ()):
+                callback(self._values.get(name))
@@ -0,0 +1,133 @@
+"""
+Single-flight coalescing of identical concurrent calls.
+
+While a call for a key is in flight, later callers with the same key wait
+for it and receive its result (or its exception) instead of issuing their
+own. `max_waiters` caps how many callers can pile onto one call; callers
+beyond the cap run `fn` themselves, so one slow or failing call cannot hold
+an unbounded crowd.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, max_waiters=1000):
+        self.max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.collapsed = 0
+        self.overflow = 0
+        self.shared_errors = 0
+
+    def do(self, key, fn, timeout=None):
+        """Run `fn()` once per concurrent `key`.
+
+        Returns (result, shared) where `shared` is True when the result came
+        from another caller's in-flight call. Exceptions raised by the
+        leader's call are re-raised in every waiter. A waiter gives up with
+        TimeoutError after `timeout` seconds; the leader is bounded only by
+        `fn` itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            elif call.waiters >= self.max_waiters:
+                self.overflow += 1
+                call = None
+                leader = False
+            else:
+                call.waiters += 1
+                self.collapsed += 1
+                leader = False
+
+        if call is None:
+            return fn(), False
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError('timed out waiting for a shared call')
+            if call.error is not None:
+                with self._lock:
+                    self.shared_errors += 1
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'max_waiters': self.max_waiters,
+                'leaders': self.leaders,
+                'collapsed': self.collapsed,
+                'overflow': self.overflow,
+                'shared_errors': self.shared_errors,
+            }
+
+
+class AsyncSingleFlight(SingleFlight):
+    """asyncio version of SingleFlight for the ASGI server mode.
+
+    `fn` is a zero-argument callable returning an awaitable. All bookkeeping
+    happens on the event loop thread, so no lock is needed around it.
+    """
+
+    async def do(self, key, fn, timeout=None):
+        call = self._calls.get(key)
+        if call is not None and call.waiters < self.max_waiters:
+            call.waiters += 1
+            self.collapsed += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(call.result), timeout), True
+            except asyncio.TimeoutError:
+                raise TimeoutError('timed out waiting for a shared call') from None
+            except Exception:
+                self.shared_errors += 1
+                raise
+        if call is not None:
+            self.overflow += 1
+            return await fn(), False
+
+        call = self._calls[key] = _Call()
+        call.result = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            call.result.cancel()
+            raise
+        except BaseException as e:
+            call.result.set_exception(e)
+            # mark the exception retrieved when nobody was waiting for it
+            call.result.exception()
+            raise
+        else:
+            call.result.set_result(result)
+        finally:
+            del self._calls[key]
+        return result, False
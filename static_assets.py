@@ -0,0 +1,203 @@
+"""
+In-memory static asset layer for the frontend.
+
+Every file under the frontend directory is read once at startup, along with
+its gzip (and, when the `brotli` package is installed, brotli) variants and
+a strong ETag, so serving a page never touches the filesystem or compresses
+anything. Non-HTML assets are also published under a content-hashed URL
+(`styles.<hash>.css`) that is safe to cache forever, and references to them
+in HTML files are rewritten to that URL. HTML itself is served with
+`Cache-Control: no-cache` so browsers revalidate it cheaply with
+`If-None-Match`.
+
+Set `watch=True` (STATIC_WATCH=1 in the server) to poll the directory and
+reload changed files during development.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# don't bother compressing tiny or already-compressed bodies
+_MIN_COMPRESS = 256
+_COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+_REF_RE = re.compile(r'''(href|src)=(["'])(?:\./)?([^"':?#]+)\2''')
+
+
+def _accepted_encodings(header):
+    """{coding: q} from an Accept-Encoding header; an unparsable q counts as 0."""
+    accepted = {}
+    for part in (header or '').lower().split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class Asset:
+    __slots__ = ('path', 'content_type', 'body', 'encodings', 'etag', 'cache_control')
+
+    def __init__(self, path, content_type, body, cache_control):
+        self.path = path
+        self.content_type = content_type
+        self.body = body
+        self.cache_control = cache_control
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.encodings = {}
+        if len(body) >= _MIN_COMPRESS and content_type.startswith(_COMPRESSIBLE):
+            if brotli is not None:
+                self.encodings['br'] = brotli.compress(body, quality=11)
+            self.encodings['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+
+    def with_cache_control(self, cache_control):
+        # share the body and compressed variants instead of recompressing
+        other = Asset.__new__(Asset)
+        other.path, other.content_type, other.body = self.path, self.content_type, self.body
+        other.encodings, other.etag, other.cache_control = self.encodings, self.etag, cache_control
+        return other
+
+    def select(self, accept_encoding):
+        """Return (body, content_encoding or None, etag) for an Accept-Encoding header.
+
+        The variant the client weights highest wins, br before gzip on a tie;
+        q=0 rules an encoding out.
+        """
+        accepted = _accepted_encodings(accept_encoding)
+        best, best_q = None, 0.0
+        for encoding in ('br', 'gzip'):
+            q = accepted.get(encoding, accepted.get('*', 0.0))
+            if encoding in self.encodings and q > best_q:
+                best, best_q = encoding, q
+        if best is None:
+            return self.body, None, '"%s"' % self.etag
+        return self.encodings[best], best, '"%s-%s"' % (self.etag, best)
+
+    def not_modified(self, if_none_match, etag):
+        if not if_none_match:
+            return False
+        tags = {t.strip() for t in if_none_match.split(',')}
+        return '*' in tags or etag in tags or ('W/' + etag) in tags
+
+
+class StaticAssets:
+    def __init__(self, root, watch=False, watch_interval=1.0):
+        self.root = os.path.realpath(root)
+        self.watch_interval = watch_interval
+        self._assets = {}
+        self._hashed = {}
+        self._mtimes = {}
+        self.reloads = 0
+        self.load()
+        if watch:
+            threading.Thread(target=self._watch, name='static-watch', daemon=True).start()
+
+    def get(self, path):
+        """Return the Asset for a URL path ('' is index.html), or None."""
+        return self._assets.get(path.lstrip('/') or 'index.html')
+
+    def respond(self, path, accept_encoding=None, if_none_match=None):
+        """Return (status, headers, body) for a GET of URL `path`."""
+        asset = self.get(path)
+        if asset is None:
+            return 404, [('Content-Type', 'text/plain; charset=utf-8')], b'Not Found'
+        body, encoding, etag = asset.select(accept_encoding)
+        headers = [('ETag', etag), ('Cache-Control', asset.cache_control), ('Vary', 'Accept-Encoding')]
+        if asset.not_modified(if_none_match, etag):
+            return 304, headers, b''
+        headers.append(('Content-Type', asset.content_type))
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        return 200, headers, body
+
+    def url_for(self, name):
+        """Content-hashed URL for an asset, or its plain URL for HTML."""
+        return '/' + self._hashed.get(name, name)
+
+    def load(self):
+        files = {}
+        mtimes = {}
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                full = os.path.join(dirpath, filename)
+                rel = os.path.relpath(full, self.root).replace(os.sep, '/')
+                with open(full, 'rb') as f:
+                    files[rel] = f.read()
+                mtimes[rel] = os.stat(full).st_mtime_ns
+
+        assets = {}
+        hashed = {}
+        for rel, body in files.items():
+            if rel.endswith('.html'):
+                continue
+            content_type = _content_type(rel)
+            digest = hashlib.sha256(body).hexdigest()[:12]
+            stem, ext = os.path.splitext(rel)
+            hashed[rel] = '%s.%s%s' % (stem, digest, ext)
+            assets[hashed[rel]] = Asset(rel, content_type, body, IMMUTABLE)
+            # the plain URL still works, but has to be revalidated
+            assets[rel] = assets[hashed[rel]].with_cache_control(REVALIDATE)
+
+        def rewrite(m):
+            target = hashed.get(m.group(3))
+            if target is None:
+                return m.group(0)
+            return '%s=%s/%s%s' % (m.group(1), m.group(2), target, m.group(2))
+
+        for rel, body in files.items():
+            if rel.endswith('.html'):
+                html = _REF_RE.sub(rewrite, body.decode('utf-8')).encode('utf-8')
+                assets[rel] = Asset(rel, _content_type(rel), html, REVALIDATE)
+
+        # readers only go through self._assets, so swapping it in one
+        # assignment means they see the old or the new set, never half
+        self._assets, self._hashed, self._mtimes = assets, hashed, mtimes
+        self.reloads += 1
+
+    def changed(self):
+        current = {}
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                full = os.path.join(dirpath, filename)
+                try:
+                    current[os.path.relpath(full, self.root).replace(os.sep, '/')] = os.stat(full).st_mtime_ns
+                except OSError:
+                    pass
+        return current != self._mtimes
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                if self.changed():
+                    self.load()
+            except OSError as e:
+                print('static asset reload failed:', str(e))
+
+
+def _content_type(path):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'image/svg+xml'):
+        content_type += '; charset=utf-8'
+    return content_type
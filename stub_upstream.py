@@ -0,0 +1,245 @@
+"""
+Local stand-in for the OpenAI completion API, for tests and benchmarks.
+
+Serves `/v1/chat/completions` and `/v1/completions` (plain and `stream`)
+over HTTP/1.1 keep-alive and records what it saw. With `key_limits` it
+enforces a request quota per API key the way the real API does: every reply
+carries `x-ratelimit-*` headers and calls over the quota get a 429 with
+`Retry-After`. Replies echo the user
+message in a thrift tip, so the server's relevance model lets them through.
+
+  stub = StubUpstream(chat_available=False).start()
+  client = upstream.UpstreamClient('sk-test', base_url=stub.base_url)
+  ...
+  stub.stop()
+
+Run it standalone with `python stub_upstream.py [port]` and point the server
+at it via `OPENAI_BASE_URL=http://127.0.0.1:<port>/v1`.
+"""
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_USER_RE = re.compile(r'User: (.*)\nAssistant:$', re.S)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes; with Nagle on, the body
+    # waits for the client's delayed ACK and every reply gains ~40 ms
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up waiting, e.g. at its request deadline
+            pass
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        path = self.path
+        auth = self.headers.get('Authorization')
+        with stub.lock:
+            stub.requests.append((path, auth, payload))
+        self._extra_headers = stub.admit(auth)
+        if self._extra_headers and 'retry-after' in self._extra_headers:
+            return self._json(429, {'error': {'message': 'rate limit exceeded'}})
+
+        if stub.fail_status and stub.should_fail():
+            return self._json(stub.fail_status, {'error': {'message': 'injected failure'}})
+        if path.endswith('/chat/completions'):
+            if not stub.chat_available:
+                return self._json(404, {'error': {'message': 'chat completions not available'}})
+            message = payload['messages'][-1]['content']
+            variant = 'chat'
+        elif path.endswith('/completions'):
+            m = _USER_RE.search(payload.get('prompt', ''))
+            message = m.group(1) if m else payload.get('prompt', '')
+            variant = 'completion'
+        else:
+            return self._json(404, {'error': {'message': 'not found'}})
+
+        recorded = stub.recorded(message)
+        if recorded is not None:
+            reply, delay = recorded
+        else:
+            reply, delay = stub.reply_for(message), stub.delay()
+        if delay:
+            time.sleep(delay)
+        if payload.get('stream'):
+            return self._stream(variant, reply)
+        if variant == 'chat':
+            body = {'choices': [{'message': {'role': 'assistant', 'content': reply}}]}
+        else:
+            body = {'choices': [{'text': ' ' + reply}]}
+        self._json(200, body)
+
+    def _json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self._send_extra_headers()
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, variant, reply):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self._send_extra_headers()
+        self.end_headers()
+        words = reply.split(' ')
+        for i, word in enumerate(words):
+            piece = word if i == 0 else ' ' + word
+            if variant == 'chat':
+                chunk = {'choices': [{'delta': {'content': piece}}]}
+            else:
+                chunk = {'choices': [{'text': piece}]}
+            self._chunk(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n')
+        self._chunk(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _send_extra_headers(self):
+        for name, value in (self._extra_headers or {}).items():
+            self.send_header(name, value)
+
+    def _chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+class StubUpstream:
+    """In-process stub upstream server.
+
+    chat_available: when False, the chat endpoint answers 404 so clients have
+        to fall back to the completion API.
+    latency: seconds to sleep before answering each request, plus a uniformly
+        random extra of up to `jitter` seconds.
+    fail_status: when set, requests are answered with this HTTP status; with
+        `error_rate` below 1 only that fraction of them, chosen at random.
+    key_limits: {api_key: requests} allowed per key in each `window` seconds;
+        keys not listed are unlimited.
+    responses: {user message: [(reply, seconds), ...]} recorded answers,
+        served in order (the last one repeats) in place of the echo reply
+        and `latency`.
+    """
+
+    def __init__(self, chat_available=True, latency=0.0, fail_status=None, host='127.0.0.1', port=0,
+                 jitter=0.0, error_rate=1.0, seed=None, key_limits=None, window=60.0, responses=None):
+        self.chat_available = chat_available
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_status = fail_status
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.key_limits = dict(key_limits or {})
+        self.window = window
+        self._windows = {}  # api_key -> (window start, requests in it)
+        self.throttled = 0
+        self.responses = {message: list(answers) for message, answers in (responses or {}).items()}
+        self._served = {}
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = 0
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d/v1' % (host, port)
+
+    def delay(self):
+        if not self.jitter:
+            return self.latency
+        with self.lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def should_fail(self):
+        if self.error_rate >= 1:
+            return True
+        with self.lock:
+            return self._random.random() < self.error_rate
+
+    def admit(self, authorization):
+        """Count a request against its key's quota; returns headers to send, or None.
+
+        Headers including `retry-after` mean the request is over the quota.
+        """
+        key = (authorization or '').replace('Bearer ', '', 1)
+        limit = self.key_limits.get(key)
+        if limit is None:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            start, used = self._windows.get(key, (now, 0))
+            if now - start >= self.window:
+                start, used = now, 0
+            reset = max(0.0, start + self.window - now)
+            headers = {'x-ratelimit-limit-requests': str(limit), 'x-ratelimit-reset-requests': '%.3fs' % reset}
+            if used >= limit:
+                self.throttled += 1
+                headers['x-ratelimit-remaining-requests'] = '0'
+                headers['retry-after'] = '%.3f' % reset
+                return headers
+            self._windows[key] = (start, used + 1)
+            headers['x-ratelimit-remaining-requests'] = str(limit - used - 1)
+            return headers
+
+    def served(self, api_key):
+        """Requests with `api_key` let through in its current window."""
+        with self.lock:
+            return self._windows.get(api_key, (0, 0))[1]
+
+    def recorded(self, message):
+        """The next recorded (reply, seconds) for `message`, or None."""
+        answers = self.responses.get(message)
+        if not answers:
+            return None
+        with self.lock:
+            i = self._served.get(message, 0)
+            self._served[message] = i + 1
+        return answers[min(i, len(answers) - 1)]
+
+    def reply_for(self, message):
+        return 'Thrift tip for "%s": check the label and seams.' % message
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8099
+    stub = StubUpstream(port=port)
+    print('stub upstream listening on', stub.base_url)
+    stub._server.serve_forever()
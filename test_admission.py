@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import admission
+import asgi
+import response_cache
+import server
+from stub_upstream import StubUpstream
+from test_asgi import _call
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_and_reports_retry_after():
+    clock = FakeClock()
+    limiter = admission.RateLimiter(rate=2, burst=3, clock=clock)
+    assert [limiter.allow('a')[0] for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow('a') == (False, 0.5)
+    assert limiter.allow('b')[0]  # other clients have their own bucket
+    clock.now = 0.5
+    assert limiter.allow('a') == (True, 0.0)
+    assert limiter.stats()['limited'] == 2
+
+
+def test_rate_limiter_bounds_clients_and_can_be_disabled():
+    limiter = admission.RateLimiter(rate=1, burst=1, max_clients=10)
+    for i in range(100):
+        limiter.allow('client-%d' % i)
+    assert len(limiter) == 10
+    off = admission.RateLimiter(rate=0)
+    assert all(off.allow('a')[0] for _ in range(1000)) and len(off) == 0
+
+
+def test_gate_queues_then_sheds():
+    gate = admission.ConcurrencyGate(limit=1, max_queue=1, timeout=5)
+    gate.acquire()
+    waiter = threading.Thread(target=lambda: (gate.acquire(), gate.release()))
+    waiter.start()
+    while gate.waiting != 1:
+        time.sleep(0.001)
+    with pytest.raises(admission.Overloaded) as e:
+        gate.acquire()
+    assert e.value.reason == admission.QUEUE_FULL
+    gate.release()
+    waiter.join(2)
+    assert gate.stats() == {'limit': 1, 'active': 0, 'queued': 0, 'max_queue': 1,
+                            'admitted': 2, 'shed': 1, 'timeouts': 0}
+
+
+def test_gate_wait_times_out():
+    gate = admission.ConcurrencyGate(limit=1, max_queue=5, timeout=0.05)
+    with gate:
+        with pytest.raises(admission.Overloaded) as e:
+            gate.acquire()
+    assert e.value.reason == admission.QUEUE_TIMEOUT and gate.timeouts == 1
+    with gate:
+        assert gate.active == 1
+
+
+def test_async_gate():
+    async def run():
+        gate = admission.AsyncConcurrencyGate(limit=2, max_queue=1, timeout=0.05)
+        active = []
+
+        async def work():
+            async with gate:
+                active.append(gate.active)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[work() for _ in range(3)])
+        assert max(active) == 2 and gate.admitted == 3
+        await gate.acquire()
+        await gate.acquire()
+        with pytest.raises(admission.Overloaded) as e:
+            await gate.acquire()
+        assert e.value.reason == admission.QUEUE_TIMEOUT
+    asyncio.run(run())
+
+
+def test_api_chat_rate_limit_returns_429(monkeypatch):
+    monkeypatch.setattr(server, 'rate_limiter', admission.RateLimiter(rate=0.5, burst=2))
+    client = server.app.test_client()
+    statuses = [client.post('/api/chat', json={'message': 'hello'}).status_code for _ in range(2)]
+    resp = client.post('/api/chat', json={'message': 'hello'})
+    assert statuses == [200, 200] and resp.status_code == 429
+    assert resp.headers['Retry-After'] == '2'
+    assert resp.get_json()['error'] == 'rate limited'
+    # other clients are not affected
+    assert client.post('/api/chat', json={'message': 'hello'},
+                       environ_base={'REMOTE_ADDR': '10.0.0.7'}).status_code == 200
+
+
+def _overloaded_upstream(message, api_key, history=None, deadline=None):
+    raise admission.Overloaded(admission.QUEUE_FULL, 3)
+
+
+def test_overload_degrades_recognized_questions_and_sheds_the_rest(monkeypatch):
+    monkeypatch.setattr(server, '_upstream_reply', _overloaded_upstream)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    client = server.app.test_client()
+    before = server.CHAT_SHED.value(reason='queue_full')
+
+    resp = client.post('/api/chat', json={'message': 'how much is this worth?'})
+    assert resp.status_code == 200
+    assert resp.get_json() == {'reply': server.INTENT_REPLIES[server.intents.VALUE], 'degraded': True}
+
+    resp = client.post('/api/chat', json={'message': 'tell me about the moon'})
+    assert resp.status_code == 429 and resp.headers['Retry-After'] == '3'
+    assert resp.get_json() == {'error': 'server busy', 'retry_after': 3}
+    assert server.CHAT_SHED.value(reason='queue_full') == before + 2
+    # degraded replies are not cached
+    assert len(server.chat_cache) == 0
+
+
+def test_upstream_429_is_not_a_500(monkeypatch):
+    with StubUpstream(fail_status=429) as stub:
+        monkeypatch.setenv('OPENAI_BASE_URL', stub.base_url)
+        monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+        monkeypatch.setattr(server, '_upstream_clients', {})
+        monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+        client = server.app.test_client()
+        resp = client.post('/api/chat', json={'message': 'any vintage tips?'})
+        assert resp.status_code == 200 and resp.get_json()['degraded'] is True
+        resp = client.post('/api/chat', json={'message': 'what is the weather'})
+        assert resp.status_code == 429 and 'Retry-After' in resp.headers
+        resp = client.post('/api/chat/stream', json={'message': 'what is the weather'})
+        assert b'event: error' in resp.data and b'server busy' in resp.data
+    server.get_upstream('sk-test').close()
+
+
+def test_stream_sheds_with_429_when_queue_full(monkeypatch):
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    gate = admission.ConcurrencyGate(limit=0, max_queue=0)
+    monkeypatch.setattr(server, 'upstream_gate', gate)
+    client = server.app.test_client()
+    resp = client.post('/api/chat/stream', json={'message': 'what is the weather'})
+    assert resp.status_code == 429 and resp.headers['Retry-After'] == '1'
+    resp = client.post('/api/chat/stream', json={'message': 'how do I identify this brand?'})
+    assert resp.status_code == 200 and b'"degraded": true' in resp.data
+
+
+def test_stream_releases_its_slot(monkeypatch):
+    monkeypatch.setattr(server, '_upstream_stream', lambda m, k, h=None, d=None: iter(['Check ', 'the label.']))
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    gate = admission.ConcurrencyGate(limit=1, max_queue=0)
+    monkeypatch.setattr(server, 'upstream_gate', gate)
+    client = server.app.test_client()
+    for i in range(3):
+        resp = client.post('/api/chat/stream', json={'message': 'is this jacket vintage %d' % i})
+        assert b'event: done' in resp.data
+    assert gate.active == 0 and gate.admitted == 3
+
+
+def test_asgi_admission(monkeypatch):
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+    monkeypatch.setattr(server, 'rate_limiter', admission.RateLimiter(rate=1, burst=3))
+    monkeypatch.setattr(asgi, 'upstream_gate', admission.AsyncConcurrencyGate(limit=0, max_queue=0))
+
+    async def run():
+        status, data = await _call('POST', '/api/chat', {'message': 'tell me about the moon'})
+        assert status == 429 and b'server busy' in data
+        status, data = await _call('POST', '/api/chat', {'message': 'any thrift tips?'})
+        assert status == 200 and b'"degraded": true' in data
+        status, _ = await _call('POST', '/api/chat/stream', {'message': 'tell me about the moon'})
+        assert status == 429
+        status, data = await _call('POST', '/api/chat', {'message': 'hi'})
+        assert status == 429 and b'rate limited' in data
+    asyncio.run(run())
@@ -16,7 +16,19 @@ def post(message, extra=None):
     except Exception as e:
         print('Request failed:', payload, 'Error:', e)
 
+def post_batch(messages):
+    # one round-trip for many messages; results come back in order
+    data = json.dumps({'items': messages}).encode('utf-8')
+    req = urllib.request.Request(URL + '/batch', data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            for result in json.loads(resp.read().decode('utf-8'))['results']:
+                print('Batch item:', messages[result['index']], '->', result)
+    except Exception as e:
+        print('Batch request failed:', messages, 'Error:', e)
+
 if __name__ == '__main__':
     post('hi')
     post('laptop')
     post('Tell me about MacBook Air')
+    post_batch(['hi', 'laptop', 'Tell me about MacBook Air'])
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import admission
+import asgi
+import response_cache
+import server
+from stub_upstream import StubUpstream
+
+
+async def _call(method, path, payload=None, headers=(), client=('127.0.0.1', 1234), with_headers=False):
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('latin-1'),
+             'client': client, 'headers': [(b'content-type', b'application/json')] + list(headers)}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.app(scope, receive, send)
+    status = sent[0]['status']
+    data = b''.join(m.get('body', b'') for m in sent[1:])
+    if with_headers:
+        return status, data, dict(sent[0]['headers'])
+    return status, data
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    with StubUpstream() as s:
+        monkeypatch.setenv('OPENAI_BASE_URL', s.base_url)
+        monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+        monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+        monkeypatch.setattr(asgi, '_upstream_clients', {})
+        yield s
+
+
+def test_chat_local_and_upstream(stub):
+    async def run():
+        status, data = await _call('POST', '/api/chat', {'message': 'laptop'})
+        assert status == 200 and json.loads(data)['choices'] == server.product_catalog.choices('laptop')
+        status, data = await _call('POST', '/api/chat', {'message': 'vintage lamp'})
+        assert json.loads(data) == {'reply': stub.reply_for('vintage lamp')}
+        status, _ = await _call('POST', '/api/chat', {'message': ''})
+        assert status == 400
+    asyncio.run(run())
+
+
+def test_concurrent_requests_share_connections(stub):
+    stub.latency = 0.2
+
+    async def run():
+        return await asyncio.gather(*[_call('POST', '/api/chat', {'message': 'vintage %d' % i}) for i in range(20)])
+
+    results = asyncio.run(run())
+    assert [json.loads(d)['reply'] for _, d in results] == [stub.reply_for('vintage %d' % i) for i in range(20)]
+
+
+def test_stream_and_batch(stub):
+    async def run():
+        status, data = await _call('POST', '/api/chat/stream', {'message': 'old coat'})
+        assert status == 200
+        assert 'event: done' in data.decode()
+        status, _ = await _call('POST', '/api/chat', {'message': 'x', 'action': 'select', 'selection': 5})
+        assert status == 400
+        status, data = await _call('POST', '/api/chat/batch', {'items': ['hi', 'old coat', {'message': ['x']}]})
+        results = json.loads(data)['results']
+        assert [r['index'] for r in results] == [0, 1, 2]
+        assert results[1]['reply'] == stub.reply_for('old coat')
+        assert results[2]['status'] == 400
+    asyncio.run(run())
+
+
+def test_batch_items_are_rate_limited(stub, monkeypatch):
+    monkeypatch.setattr(server, 'rate_limiter', admission.RateLimiter(rate=0.5, burst=2))
+
+    async def run():
+        status, data, headers = await _call('POST', '/api/chat/batch', {'items': ['vase 0', 'hi', 'vase 1', 'vase 2']},
+                                            with_headers=True)
+        assert status == 200 and int(headers[b'retry-after']) >= 1
+        assert [r['status'] for r in json.loads(data)['results']] == [200, 200, 200, 429]
+        assert len(stub.requests) == 2
+    asyncio.run(run())
+
+
+def test_blocking_local_work_leaves_the_loop_free(monkeypatch):
+    def slow_local_answer(data, api_key):
+        time.sleep(0.2)
+        return {'reply': data['message']}, 200
+
+    monkeypatch.setattr(server, '_local_answer', slow_local_answer)
+
+    async def run():
+        start = time.monotonic()
+        answers = await asyncio.gather(*[_call('POST', '/api/chat', {'message': 'm%d' % i}) for i in range(4)])
+        assert time.monotonic() - start < 0.6
+        assert [json.loads(data)['reply'] for _, data in answers] == ['m0', 'm1', 'm2', 'm3']
+    asyncio.run(run())
+
+
+def test_admin_and_static(monkeypatch):
+    monkeypatch.setenv('ADMIN_TOKEN', 'tok')
+    monkeypatch.setattr(server, 'runtime_api_key', None)
+
+    async def run():
+        status, _ = await _call('POST', '/admin/set_key', {'key': 'sk-new'}, client=('10.0.0.1', 1))
+        assert status == 403
+        status, _ = await _call('POST', '/admin/set_key', {'key': 'sk-new', 'admin_token': 'bad'})
+        assert status == 401
+        status, _ = await _call('POST', '/admin/set_key', {'key': 'sk-new', 'admin_token': 'tok'})
+        assert status == 200 and server.runtime_api_key == 'sk-new'
+        status, data = await _call('GET', '/')
+        assert status == 200 and b'QUPAL' in data
+        status, _ = await _call('GET', '/../server.py')
+        assert status == 404
+    asyncio.run(run())
+
+
+def test_catalog_prefetch_and_version_header():
+    version = server.product_catalog.version
+    sent = []
+
+    async def run():
+        status, data = await _call('GET', '/api/catalog')
+        assert status == 200 and json.loads(data) == server.catalog_snapshot()
+        status, _ = await _call('GET', '/api/catalog', headers=[(b'if-none-match', ('"%s"' % version).encode())])
+        assert status == 304
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/chat', 'client': ('127.0.0.1', 1),
+                 'headers': [(b'content-type', b'application/json')]}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'{"message": "hi"}', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+        await asgi.app(scope, receive, send)
+    asyncio.run(run())
+    assert (b'x-catalog-version', version.encode()) in sent[0]['headers']
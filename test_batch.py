@@ -0,0 +1,84 @@
+import json
+import time
+
+import admission
+import response_cache
+import server
+
+
+def _setup(monkeypatch, upstream):
+    monkeypatch.setattr(server, '_upstream_reply', upstream)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+
+
+def _post(payload, **kwargs):
+    client = server.app.test_client()
+    return client.post('/api/chat/batch', data=json.dumps(payload), content_type='application/json', **kwargs)
+
+
+def test_batch_results_in_order_with_per_item_status(monkeypatch):
+    def fake_upstream(message, api_key, history=None, deadline=None):
+        if 'fail' in message:
+            raise RuntimeError('upstream down')
+        time.sleep(0.05 if 'slow' in message else 0)
+        return 'answer: ' + message
+
+    _setup(monkeypatch, fake_upstream)
+    items = ['slow vintage lamp', 'hi', {'message': 'laptop'}, 'fail please', {'message': ''}, 'quick vase']
+    results = _post({'items': items}).get_json()['results']
+    assert [r['index'] for r in results] == list(range(len(items)))
+    assert results[0]['reply'] == 'answer: slow vintage lamp'
+    assert results[1]['reply'].startswith('Hello!')
+    assert results[2]['choices'] == server.product_catalog.choices('laptop')
+    assert results[3]['status'] == 500 and results[3]['error'] == 'OpenAI request failed'
+    assert results[4]['status'] == 400
+    assert results[5] == {'index': 5, 'status': 200, 'reply': 'answer: quick vase'}
+
+
+def test_malformed_items_fail_alone(monkeypatch):
+    _setup(monkeypatch, lambda message, *a, **k: 'answer: ' + message)
+    resp = _post({'items': [{'message': ['x']}, 'vintage vase', {'message': 'x', 'selection': 3}, 7]})
+    results = resp.get_json()['results']
+    assert resp.status_code == 200 and [r['status'] for r in results] == [400, 200, 400, 400]
+    assert results[0] == dict(server.INVALID_ITEM, index=0, status=400)
+    assert results[1]['reply'] == 'answer: vintage vase'
+
+
+def test_batch_fans_out_concurrently(monkeypatch):
+    def fake_upstream(message, api_key, history=None, deadline=None):
+        time.sleep(0.2)
+        return message
+
+    _setup(monkeypatch, fake_upstream)
+    start = time.perf_counter()
+    results = _post({'items': ['question %d' % i for i in range(8)]}).get_json()['results']
+    assert time.perf_counter() - start < 0.2 * 4
+    assert [r['reply'] for r in results] == ['question %d' % i for i in range(8)]
+
+
+def test_batch_ndjson_stream(monkeypatch):
+    _setup(monkeypatch, lambda m, k, h=None, d=None: m.upper())
+    resp = _post({'items': ['hello', 'old coat'], 'stream': True})
+    assert resp.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert sorted(r['index'] for r in lines) == [0, 1]
+    assert {r['index']: r['reply'] for r in lines}[1] == 'OLD COAT'
+
+
+def test_batch_limits(monkeypatch):
+    assert _post({'items': []}).status_code == 400
+    monkeypatch.setattr(server, 'BATCH_MAX_ITEMS', 2)
+    assert _post({'items': ['a', 'b', 'c']}).status_code == 413
+
+
+def test_each_upstream_item_takes_a_rate_limit_token(monkeypatch):
+    _setup(monkeypatch, lambda message, *a, **k: 'answer: ' + message)
+    monkeypatch.setattr(server, 'rate_limiter', admission.RateLimiter(rate=0.5, burst=3))
+    # the batch's own token pays for the first upstream item, then one token each
+    resp = _post({'items': ['vase 0', 'hi', 'vase 1', 'vase 2', 'vase 3', 'laptop', 'vase 4']})
+    results = resp.get_json()['results']
+    assert [r['status'] for r in results] == [200, 200, 200, 200, 429, 200, 429]
+    assert results[4]['error'] == 'rate limited' and results[6]['retry_after'] > 0
+    assert resp.status_code == 200 and int(resp.headers['Retry-After']) >= 1
+    assert _post({'items': ['hi']}).status_code == 429
@@ -0,0 +1,42 @@
+import json
+
+import bench_load
+
+
+def test_workload_mix():
+    work = bench_load.workload(bench_load.parse_mix('greeting=1,upstream=3'), 400)
+    kinds = [k for k, _ in work]
+    assert set(kinds) == {'greeting', 'upstream'}
+    assert 200 < kinds.count('upstream') < 400
+
+
+def test_compare_flags_regressions():
+    base = [{'mode': 'inproc', 'concurrency': 8, 'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0,
+             'throughput_rps': 100.0, 'error_rate': 0.0}]
+    same = [dict(base[0], p99_ms=33.0)]
+    assert bench_load.compare(same, base) == []
+    worse = [dict(base[0], p95_ms=30.0, throughput_rps=50.0, error_rate=0.05)]
+    problems = bench_load.compare(worse, base)
+    assert len(problems) == 3 and all(p.startswith('inproc c=8') for p in problems)
+    # runs without a matching baseline entry are not compared
+    assert bench_load.compare([dict(worse[0], concurrency=2)], base) == []
+
+
+def test_run_with_injected_errors(tmp_path, capsys, monkeypatch):
+    # main() points the server at its stub; restore everything afterwards
+    monkeypatch.setattr(bench_load.server, 'runtime_api_key', None)
+    monkeypatch.setattr(bench_load.server, '_upstream_clients', {})
+    monkeypatch.setattr(bench_load.server, 'rate_limiter', bench_load.server.rate_limiter)
+    monkeypatch.setenv('OPENAI_BASE_URL', 'http://127.0.0.1:9/v1')
+    out = tmp_path / 'run.json'
+    code = bench_load.main(['--concurrency', '4', '--requests', '60', '--upstream-latency', '0',
+                            '--upstream-error-rate', '1', '--mix', 'greeting=1,upstream=1', '--out', str(out)])
+    assert code == 0
+    run = json.loads(out.read_text())['runs'][0]
+    assert run['requests'] == 60 and run['concurrency'] == 4
+    assert run['by_kind']['greeting']['errors'] == 0
+    assert run['by_kind']['upstream']['errors'] == run['by_kind']['upstream']['count']
+    assert run['p50_ms'] is not None
+    capsys.readouterr()
+    assert bench_load.main(['--concurrency', '4', '--requests', '60', '--upstream-latency', '0',
+                            '--mix', 'greeting=1,upstream=1', '--baseline', str(out), '--tolerance', '100']) == 0
@@ -0,0 +1,90 @@
+import json
+import time
+
+import pytest
+
+import capture
+import intents
+import response_cache
+import server
+from stub_upstream import StubUpstream
+
+
+def test_log_rotates_and_reads_back_in_order(tmp_path):
+    path = str(tmp_path / 'capture.log')
+    clock = iter(range(1000))
+    log = capture.CaptureLog(path, max_bytes=400, backups=2, clock=lambda: float(next(clock)))
+    for i in range(12):
+        log.request('/api/chat', json.dumps({'message': 'm%d' % i}).encode(), {}, 200, 0.001, float(i))
+    log.close()
+    with open(path) as f:
+        header = json.loads(f.readline())
+    assert header['capture'] == capture.FORMAT_VERSION and header['redact'] == 'none'
+    assert not (tmp_path / 'capture.log.3').exists()
+    requests, replies = capture.read(path)
+    # the oldest rotated-out file is gone; the rest come back oldest first
+    messages = [r['b']['message'] for r in requests]
+    assert messages == ['m%d' % i for i in range(12 - len(messages), 12)] and replies == []
+
+
+def test_hash_redaction_keeps_intents():
+    redactor = capture.Redactor('hash', salt='s', engine=lambda: intents.ENGINE)
+    engine = intents.ENGINE
+    for text in ('hi there, Bob!', 'which laptop for my niece?', 'Is this Dell XPS 13 worth 200 dollars?',
+                 'qwerty uiop'):
+        hashed = redactor.message(text)
+        assert set(engine.scan(hashed)) == set(engine.scan(text))
+        assert 'niece' not in hashed and 'Bob' not in hashed and 'qwerty' not in hashed
+    assert redactor.message('secret word') == redactor.message('Secret word')
+    assert capture.Redactor('hash', salt='t').message('secret') != redactor.message('secret')
+    assert len(redactor.reply('x' * 150)) == 150
+    body = redactor.body({'items': ['secret', {'message': 'secret', 'session_id': 'abc'}], 'stream': True})
+    assert body['items'][0] == body['items'][1]['message'] != 'secret'
+    assert body['items'][1]['session_id'] != 'abc' and body['stream'] is True
+    body = redactor.body({'action': 'select', 'selection': 'my secret coat'})
+    assert 'secret' not in body['selection'] and body['action'] == 'select'
+    assert redactor.body({'action': 'select', 'selection': 'Dell XPS 13'})['selection'] == 'Dell XPS 13'
+    with pytest.raises(ValueError):
+        capture.Redactor('scramble')
+
+
+def test_idle_log_is_flushed_by_the_timer(tmp_path):
+    path = tmp_path / 'capture.log'
+    log = capture.CaptureLog(str(path), flush_interval=0.05)
+    log.request('/api/chat', b'{"message": "only one"}', {}, 200, 0.001, 1.0)
+    deadline = time.monotonic() + 2
+    while b'only one' not in path.read_bytes() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert b'only one' in path.read_bytes()
+    log.close()
+    log.close()
+
+
+def test_middleware_captures_requests_and_upstream_replies(tmp_path, monkeypatch):
+    path = str(tmp_path / 'capture.log')
+    log = capture.CaptureLog(path, redact='hash', salt='s', engine=lambda: server.chat_engine)
+    monkeypatch.setattr(server.app, 'wsgi_app', capture.Middleware(server.app.wsgi_app, log))
+    monkeypatch.setattr(server, 'capture_log', log)
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+    with StubUpstream() as stub:
+        monkeypatch.setenv('OPENAI_BASE_URL', stub.base_url)
+        monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+        monkeypatch.setattr(server, '_upstream_clients', {})
+        client = server.app.test_client()
+        client.post('/api/chat', json={'message': 'hi'}).close()
+        client.post('/api/chat', json={'message': 'my secret vintage coat'},
+                    headers={'X-Session-Id': 'tab-1'}).close()
+        resp = client.post('/api/chat/stream', json={'message': 'another secret vintage coat'})
+        resp.get_data()
+        resp.close()
+        client.get('/').close()
+    log.close()
+    requests, replies = capture.read(path)
+    assert [r['r'] for r in requests] == ['/api/chat', '/api/chat', '/api/chat/stream']
+    assert [r['s'] for r in requests] == [200, 200, 200] and all(r['ms'] > 0 for r in requests)
+    assert requests[0]['b'] == {'message': 'hi'}
+    assert 'secret' not in json.dumps(requests) and 'vintage' in requests[1]['b']['message']
+    assert requests[1]['h']['x-session-id'] != 'tab-1'
+    # the logged upstream message is the redacted request message, so replay can match it
+    assert [r['u'] for r in replies] == [requests[1]['b']['message'], requests[2]['b']['message']]
+    assert 'Thrift tip' in replies[0]['reply']
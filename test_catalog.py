@@ -0,0 +1,119 @@
+import json
+import os
+
+import catalog
+import intents
+import server
+
+
+def _write(path, items):
+    path.write_text(json.dumps({'version': 1, 'items': items}))
+    return str(path)
+
+
+ITEMS = [
+    {'sku': 'A', 'name': 'MacBook Air', 'category': 'laptop', 'rank': 1, 'summary': 'air short', 'description': 'air long'},
+    {'sku': 'B', 'name': 'MacBook Pro', 'category': 'laptop', 'rank': 2, 'summary': 'pro short', 'description': 'pro long'},
+    {'sku': 'C', 'name': 'Levi 501', 'category': 'jeans', 'rank': 1, 'summary': '501', 'description': '501'},
+]
+
+
+def test_exact_prefix_and_choices(tmp_path):
+    cat = catalog.Catalog(_write(tmp_path / 'c.json', ITEMS))
+    assert len(cat) == 3
+    assert cat.exact('  macbook   AIR ').summary == 'air short'
+    assert cat.exact('macbook') is None
+    assert [i.name for i in cat.prefix('MacB')] == ['MacBook Air', 'MacBook Pro']
+    assert cat.choices('laptop') == ['MacBook Air', 'MacBook Pro']
+    assert cat.choices('laptop', limit=1) == ['MacBook Air']
+    assert cat.categories() == ['jeans', 'laptop']
+
+
+def test_fuzzy_tolerates_typos(tmp_path):
+    cat = catalog.Catalog(_write(tmp_path / 'c.json', ITEMS))
+    score, item = cat.fuzzy('macbok air')[0]
+    assert item.name == 'MacBook Air' and score > 0.9
+    assert cat.suggest('Macbook Pr') == 'MacBook Pro'
+    assert cat.suggest('kettle') is None
+    assert cat.fuzzy('') == []
+
+
+def test_mentions_are_whole_words(tmp_path):
+    cat = catalog.Catalog(_write(tmp_path / 'c.json', ITEMS))
+    text = 'Is the macbook air better than two MacBook Pros or a levi 5012?'
+    assert cat.mentions(text) == [(7, 18, 'macbook air'), (35, 47, 'macbook pro')]
+    assert cat.mentions('my macbook') == [] and cat.mentions('') == []
+
+
+def test_csv_and_reload(tmp_path):
+    path = tmp_path / 'c.csv'
+    path.write_text('sku,name,category,rank,summary,description\nA,Old Coat,coat,1,warm,very warm\n')
+    cat = catalog.Catalog(str(path))
+    seen = []
+    cat.on_load(lambda c: seen.append(c.version))
+    assert cat.exact('old coat').description == 'very warm'
+    version = cat.version
+    path.write_text('sku,name,category,rank,summary,description\nB,Wool Hat,hat,1,cosy,cosy\n')
+    os.utime(str(path), ns=(1, 1))
+    assert cat.changed()
+    cat.load()
+    assert cat.exact('old coat') is None and cat.exact('wool hat') is not None
+    assert seen == [version, cat.version] and cat.version != version
+
+
+def test_server_answers_from_catalog(monkeypatch):
+    monkeypatch.setattr(server, 'runtime_api_key', None)
+    client = server.app.test_client()
+    data = client.post('/api/chat', json={'message': 'any laptops?'}).get_json()
+    assert data['choices'] == server.product_catalog.choices('laptop')
+    # the frontend sends picks from a choices list with an empty message
+    data = client.post('/api/chat', json={'message': '', 'action': 'select', 'selection': 'Dell XPS 13'}).get_json()
+    assert data['reply'].startswith('Dell XPS 13')
+    data = client.post('/api/chat', json={'message': '', 'action': 'select', 'selection': 'Nope 9'}).get_json()
+    assert data['reply'].startswith('Sorry') and 'choices' not in data
+    # a selection must be a string
+    for route in ('/api/chat', '/api/chat/stream'):
+        resp = client.post(route, json={'message': 'x', 'action': 'select', 'selection': 5})
+        assert resp.status_code == 400 and resp.get_json() == server.INVALID_BODY
+    # a near miss is only suggested, never answered as if it were that model
+    data = client.post('/api/chat', json={'message': '', 'action': 'select', 'selection': 'Dell XPS 15'}).get_json()
+    assert data == {'reply': 'Sorry, I do not have details for that model. Did you mean Dell XPS 13?',
+                    'choices': ['Dell XPS 13'], 'local': True}
+
+
+def test_server_engine_follows_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'runtime_api_key', None)
+    monkeypatch.setattr(server, 'product_catalog', catalog.Catalog(_write(tmp_path / 'c.json', ITEMS)))
+    server.product_catalog.on_load(server._on_catalog_load)
+    try:
+        assert server.rule_based_response('is the levi 501 good?') == '501'
+        assert server.rule_based_response('are macbook airs any good?') == 'air long'
+        # model names are found by the catalog, not compiled into the automaton
+        assert len(server.chat_engine) < len(intents.DEFAULT_KEYWORDS) + 10
+        assert server.rule_based_response('show me jeans')['choices'] == ['Levi 501']
+    finally:
+        server._on_catalog_load(catalog.Catalog(server.CATALOG_PATH))
+
+
+def test_frontend_prefetch_and_version_header(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'runtime_api_key', None)
+    path = tmp_path / 'c.json'
+    monkeypatch.setattr(server, 'product_catalog', catalog.Catalog(_write(path, ITEMS)))
+    client = server.app.test_client()
+    resp = client.get('/api/catalog')
+    version = server.product_catalog.version
+    assert resp.headers['ETag'] == '"%s"' % version and resp.headers['X-Catalog-Version'] == version
+    assert resp.get_json() == {
+        'version': version,
+        'categories': {'jeans': server.category_choices('jeans'), 'laptop': server.category_choices('laptop')},
+        'details': {'MacBook Air': 'air short', 'MacBook Pro': 'pro short', 'Levi 501': '501'},
+    }
+    assert client.get('/api/catalog', headers={'If-None-Match': '"%s"' % version}).status_code == 304
+
+    # a reload changes the version the chat responses carry
+    _write(path, ITEMS[:2])
+    server.product_catalog.load()
+    resp = client.post('/api/chat', json={'message': 'show me laptops'})
+    assert resp.headers['X-Catalog-Version'] == server.product_catalog.version != version
+    assert client.get('/api/catalog', headers={'If-None-Match': '"%s"' % version}).get_json()['details'] == {
+        'MacBook Air': 'air short', 'MacBook Pro': 'pro short'}
@@ -0,0 +1,133 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from werkzeug.serving import make_server
+
+import chat_client
+import response_cache
+import server
+from test_admission import FakeClock
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    # the Flask development server closes every connection; this front end
+    # keeps them open (and reads pipelined requests in order) like a
+    # production server would
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        headers = {name: value for name, value in self.headers.items() if name.lower().startswith('x-')}
+        resp = server.app.test_client().post(self.path, data=body, content_type='application/json', headers=headers)
+        data = resp.get_data()
+        self.send_response(resp.status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def live_server(monkeypatch):
+    monkeypatch.setenv('FORCE_LOCAL', '1')
+    started = []
+
+    def start(keep_alive=True):
+        if keep_alive:
+            httpd = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+            httpd.daemon_threads = True
+        else:
+            httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        started.append(httpd)
+        return 'http://127.0.0.1:%d' % httpd.server_port
+
+    yield start
+    for httpd in started:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_queued_requests_share_one_connection_and_round_trip(live_server):
+    client = chat_client.ChatClient(live_server(), session_id='kiosk-1')
+    model = server.product_catalog.choices('laptop')[0]
+    futures = client.submit_many([{'message': 'hi'}, {'message': 'which laptop should I get?'},
+                                  {'message': '', 'action': 'select', 'selection': model}])
+    greeting, laptops, details = [f.result(5) for f in futures]
+    assert greeting['reply'].startswith('Hello!') and model in laptops['choices']
+    assert details['reply'] == server.product_catalog.exact(model).summary
+    assert (client.requests, client.round_trips, client.connections) == (3, 1, 1)
+
+    with pytest.raises(chat_client.ServerError) as err:
+        client.ask({'message': ''})
+    assert err.value.status == 400
+    # the connection is kept alive across round trips
+    assert (client.round_trips, client.connections) == (2, 1)
+    # the server kept the conversation in order
+    history = server.chat_sessions.history('kiosk-1', 10000, 0)
+    assert [turn['content'] for turn in history[::2]] == ['hi', 'which laptop should I get?', model]
+    client.close()
+
+
+def test_replies_that_do_not_depend_on_the_conversation_are_cached(live_server, monkeypatch):
+    client = chat_client.ChatClient(live_server(), session_id='kiosk-2')
+    model = server.product_catalog.choices('laptop')[0]
+    select = {'message': '', 'action': 'select', 'selection': model}
+    for body in (select, dict(select, selection=model.upper()), {'message': 'Which laptop?'},
+                 {'message': 'which laptop'}, {'message': 'how do I clean suede'},
+                 {'message': 'how do I clean suede'}):
+        client.ask(body)
+    # the server answered all of these with its local rules, so each went out once
+    assert client.requests == 3 and client.cache.hits == 3
+
+    # an upstream reply depends on the session, so it is only kept without one
+    monkeypatch.delenv('FORCE_LOCAL')
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    monkeypatch.setattr(server, '_upstream_reply', lambda message, api_key, history=None, deadline=None:
+                        'Check the label.')
+    question = {'message': 'is this coat vintage?'}
+    client.ask(question)
+    assert client.ask(question) == {'reply': 'Check the label.'} and client.requests == 5
+    client.close()
+
+    client = chat_client.ChatClient(live_server())
+    client.ask(question)
+    assert client.ask({'message': 'Is this coat vintage?'})['reply'] and client.requests == 1
+    client.close()
+
+
+def test_connection_close_resends_the_rest_of_the_pipeline(live_server):
+    # the Flask development server closes the connection after every response
+    client = chat_client.ChatClient(live_server(keep_alive=False))
+    replies = [f.result(5)['reply'] for f in client.submit_many([{'message': 'hi'}, {'message': 'thanks'},
+                                                                 {'message': 'bye'}])]
+    assert len(replies) == 3 and replies[0].startswith('Hello!')
+    # the first pipeline is cut short; after that it sends one request per connection
+    assert client.closes_connections and client.requests == 3 + 1 + 1 and client.connections == 3
+    client.close()
+
+
+def test_unreachable_server_fails_fast_until_retry_interval():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    clock = FakeClock()
+    client = chat_client.ChatClient('http://127.0.0.1:%d' % port, retry_interval=10, clock=clock)
+    with pytest.raises(chat_client.ServerUnavailable):
+        client.ask({'message': 'hi'})
+    with pytest.raises(chat_client.ServerUnavailable):
+        client.ask({'message': 'hi'})
+    # the second request did not try to connect again
+    assert client.unavailable == 2 and client.round_trips == 0
+    clock.now = 11
+    with pytest.raises(chat_client.ServerUnavailable):
+        client.ask({'message': 'hi'})
+    assert client.unavailable == 3
+    client.close()
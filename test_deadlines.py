@@ -0,0 +1,231 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import admission
+import asgi
+import deadlines
+import response_cache
+import server
+import singleflight
+from stub_upstream import StubUpstream
+from test_asgi import _call
+
+
+def _warm(tracker, seconds, n=20):
+    for _ in range(n):
+        tracker.observe(seconds)
+    return tracker
+
+
+def test_latency_tracker_quantile():
+    tracker = deadlines.LatencyTracker(min_samples=10)
+    for i in range(9):
+        tracker.observe(i)
+    assert tracker.value() is None
+    for i in range(9, 100):
+        tracker.observe(i / 100.0 if i < 95 else 10.0)
+    assert tracker.value() == 10.0
+    # old samples leave the window
+    small = deadlines.LatencyTracker(window=20, min_samples=1)
+    for seconds in [5.0] * 20 + [0.1] * 20:
+        small.observe(seconds)
+    assert small.value() == 0.1
+
+
+def test_hedge_wins_when_first_attempt_stalls():
+    calls = []
+    lock = threading.Lock()
+
+    def fn(deadline):
+        with lock:
+            calls.append(deadline)
+            first = len(calls) == 1
+        time.sleep(1.0 if first else 0.01)
+        return 'slow' if first else 'fast'
+
+    hedger = deadlines.Hedger(ThreadPoolExecutor(4), _warm(deadlines.LatencyTracker(), 0.02), min_delay=0.02)
+    start = time.monotonic()
+    assert hedger.call(fn, time.monotonic() + 2) == 'fast'
+    assert time.monotonic() - start < 0.5
+    assert hedger.stats()['hedged'] == 1 and hedger.stats()['hedge_wins'] == 1
+
+
+def test_hedge_is_skipped_without_a_free_gate_slot():
+    gate = admission.ConcurrencyGate(limit=1)
+    gate.acquire()
+    hedger = deadlines.Hedger(ThreadPoolExecutor(4), _warm(deadlines.LatencyTracker(), 0.01), min_delay=0.01)
+    assert hedger.call(lambda d: time.sleep(0.05) or 'ok', time.monotonic() + 1, gate=gate) == 'ok'
+    assert hedger.hedged == 0 and hedger.hedges_skipped == 1
+    gate.release()
+    assert gate.active == 0
+
+
+def test_held_slot_stays_taken_until_the_first_attempt_ends():
+    gate = admission.ConcurrencyGate(limit=1)
+    gate.acquire()
+    release = threading.Event()
+    hedger = deadlines.Hedger(ThreadPoolExecutor(2), deadlines.LatencyTracker(), enabled=False)
+    with pytest.raises(deadlines.DeadlineExceeded):
+        hedger.call(lambda d: release.wait(2), time.monotonic() + 0.05, gate=gate, holding=True)
+    # the attempt is still running, so it still counts against the gate
+    assert gate.active == 1
+    release.set()
+    for _ in range(100):
+        if gate.active == 0:
+            break
+        time.sleep(0.01)
+    assert gate.active == 0
+
+
+def test_hedger_raises_deadline_exceeded_and_attempt_errors():
+    hedger = deadlines.Hedger(ThreadPoolExecutor(2), deadlines.LatencyTracker(), enabled=False)
+    with pytest.raises(deadlines.DeadlineExceeded):
+        hedger.call(lambda d: time.sleep(0.5), time.monotonic() + 0.05)
+    assert hedger.deadlines == 1
+
+    def fail(deadline):
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        hedger.call(fail, time.monotonic() + 1)
+
+
+def test_async_hedger_cancels_the_loser_and_releases_the_gate():
+    async def run():
+        gate = admission.AsyncConcurrencyGate(limit=2)
+        await gate.acquire()
+        calls = []
+
+        async def fn(deadline):
+            calls.append(deadline)
+            await asyncio.sleep(1.0 if len(calls) == 1 else 0.01)
+            return len(calls)
+
+        hedger = deadlines.AsyncHedger(_warm(deadlines.LatencyTracker(), 0.02), min_delay=0.02)
+        assert await hedger.call(fn, time.monotonic() + 2, gate=gate) == 2
+        await asyncio.sleep(0.01)
+        assert hedger.hedge_wins == 1 and gate.active == 1
+
+        with pytest.raises(deadlines.DeadlineExceeded):
+            await deadlines.AsyncHedger(deadlines.LatencyTracker()).call(
+                lambda d: asyncio.sleep(1.0), time.monotonic() + 0.05)
+    asyncio.run(run())
+
+
+def test_gate_acquire_times_out_at_the_callers_deadline():
+    gate = admission.ConcurrencyGate(limit=1, timeout=5)
+    with gate:
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            gate.acquire(0.05)
+        assert time.monotonic() - start < 1
+    assert gate.try_acquire() and not gate.try_acquire()
+
+
+def test_singleflight_waiter_gives_up_at_its_timeout():
+    group = singleflight.SingleFlight()
+    started = threading.Event()
+
+    def leader():
+        group.do('k', lambda: started.set() or time.sleep(0.3) or 'late')
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait(1)
+    with pytest.raises(TimeoutError):
+        group.do('k', lambda: 'unused', timeout=0.05)
+    thread.join(2)
+
+
+def test_request_deadline_is_clamped():
+    assert server.request_deadline({}, now=0) == server.DEADLINE
+    assert server.request_deadline({'deadline_ms': 1}, now=0) == server.DEADLINE_MIN
+    assert server.request_deadline({}, header='999999999', now=0) == server.DEADLINE_MAX
+    assert server.request_deadline({'deadline_ms': 1500}, header='9000', now=10) == 11.5
+    assert server.request_deadline({'deadline_ms': 'soon'}, now=0) == server.DEADLINE
+
+
+def test_slow_upstream_degrades_within_the_deadline(monkeypatch):
+    with StubUpstream(latency=1.0) as stub:
+        monkeypatch.setenv('OPENAI_BASE_URL', stub.base_url)
+        monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+        monkeypatch.setattr(server, '_upstream_clients', {})
+        monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+        client = server.app.test_client()
+        before = server.DEADLINE_EXCEEDED.value()
+
+        start = time.monotonic()
+        resp = client.post('/api/chat', json={'message': 'how much is this worth?'}, headers={'X-Deadline-Ms': '300'})
+        assert time.monotonic() - start < 0.8
+        assert resp.status_code == 200
+        assert resp.get_json() == {'reply': server.INTENT_REPLIES[server.intents.VALUE], 'degraded': True}
+
+        resp = client.post('/api/chat/stream', json={'message': 'any vintage tips?', 'deadline_ms': 300})
+        assert b'"degraded": true' in resp.data and b'event: done' in resp.data
+        assert server.DEADLINE_EXCEEDED.value() == before + 2
+        assert len(server.chat_cache) == 0
+    server.get_upstream('sk-test').close()
+
+
+def test_asgi_slow_upstream_degrades_within_the_deadline(monkeypatch):
+    with StubUpstream(latency=1.0) as stub:
+        monkeypatch.setenv('OPENAI_BASE_URL', stub.base_url)
+        monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+        monkeypatch.setattr(asgi, '_upstream_clients', {})
+        monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+
+        async def run():
+            start = time.monotonic()
+            status, data = await _call('POST', '/api/chat', {'message': 'any thrift tips?', 'deadline_ms': 300})
+            assert time.monotonic() - start < 0.8
+            assert status == 200 and b'"degraded": true' in data
+            status, data = await _call('POST', '/api/chat/stream', {'message': 'any thrift tips?', 'deadline_ms': 300})
+            assert status == 200 and b'"degraded": true' in data
+        asyncio.run(run())
+
+
+def test_batch_items_get_their_own_deadline(monkeypatch):
+    # 6 items on 2 workers run in three waves of 0.3 s. Each item has 500 ms
+    # from when it gets a worker, so the second wave is answered in time; the
+    # third would finish past the 0.9 s batch cap and is degraded.
+    with StubUpstream(latency=0.3) as stub:
+        monkeypatch.setenv('OPENAI_BASE_URL', stub.base_url)
+        monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+        monkeypatch.setattr(server, '_upstream_clients', {})
+        monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+        monkeypatch.setattr(server, 'batch_pool', ThreadPoolExecutor(2))
+        monkeypatch.setattr(server, 'BATCH_DEADLINE', 0.9)
+        client = server.app.test_client()
+
+        start = time.monotonic()
+        resp = client.post('/api/chat/batch', json={'items': ['old coat %d' % i for i in range(6)], 'deadline_ms': 500})
+        assert time.monotonic() - start < 1.2
+        results = resp.get_json()['results']
+        assert [r['reply'] for r in results[:4]] == [stub.reply_for('old coat %d' % i) for i in range(4)]
+        assert all(r.get('degraded') for r in results[4:])
+    server.get_upstream('sk-test').close()
+
+
+def test_asgi_batch_items_get_their_own_deadline(monkeypatch):
+    with StubUpstream(latency=0.3) as stub:
+        monkeypatch.setenv('OPENAI_BASE_URL', stub.base_url)
+        monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+        monkeypatch.setattr(asgi, '_upstream_clients', {})
+        monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+        monkeypatch.setattr(server, 'BATCH_WORKERS', 2)
+        monkeypatch.setattr(server, 'BATCH_DEADLINE', 0.9)
+
+        async def run():
+            start = time.monotonic()
+            status, data = await _call('POST', '/api/chat/batch',
+                                       {'items': ['old coat %d' % i for i in range(6)], 'deadline_ms': 500})
+            assert time.monotonic() - start < 1.2
+            results = json.loads(data)['results']
+            assert [r['reply'] for r in results[:4]] == [stub.reply_for('old coat %d' % i) for i in range(4)]
+            assert all(r.get('degraded') for r in results[4:])
+        asyncio.run(run())
@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+
+import faq
+import server
+
+
+def _corpus(tmp_path, entries):
+    path = tmp_path / 'faq.json'
+    path.write_text(json.dumps({'version': 1, 'entries': [{'question': q, 'answer': a} for q, a in entries]}))
+    return str(path)
+
+
+def test_search_ranks_by_similarity_and_applies_threshold(tmp_path):
+    index = faq.load(faq.DEFAULT_SOURCE, str(tmp_path / 'index'))
+    hits = index.search('is my ring real gold?', k=3, min_score=0)
+    assert hits[0].question == 'How do I know if jewelry is real gold?'
+    assert [h.score for h in hits] == sorted((h.score for h in hits), reverse=True)
+    assert index.answer('best day to go thrifting').startswith('Go on weekday mornings')
+    assert index.answer('what is the weather in paris') is None
+    assert index.search('the and of', k=3) == []
+
+
+def test_index_is_memory_mapped_and_rebuilt_when_the_corpus_changes(tmp_path):
+    source = _corpus(tmp_path, [('How do I clean brass?', 'Use vinegar, salt and flour.')])
+    index = faq.load(source, str(tmp_path / 'index'))
+    assert isinstance(index._postings, np.memmap) and len(index) == 1
+    assert faq.load(source, str(tmp_path / 'index')).meta == index.meta  # reused as is
+    source = _corpus(tmp_path, [('How do I clean brass?', 'Use vinegar, salt and flour.'),
+                                ('How do I date a quilt?', 'Look at the fabrics and the stitching.')])
+    index = faq.load(source, str(tmp_path / 'index'))
+    assert len(index) == 2
+    assert index.search('date my quilt', k=1)[0].answer == 'Look at the fabrics and the stitching.'
+
+
+def test_sparse_and_dense_scoring_agree(tmp_path):
+    entries = [('How do I clean a %s lamp?' % m, 'Clean %s gently.' % m) for m in ('brass', 'copper', 'chrome')]
+    entries += [('Question %d about old radios' % i, 'Radios from the %d0s.' % (i % 9)) for i in range(200)]
+    faq.build(entries, str(tmp_path / 'i'))
+    index = faq.FaqIndex(str(tmp_path / 'i'))
+    sparse = index.search('clean a copper lamp', k=3, min_score=0)  # few postings
+    dense = index.search('old radios', k=3, min_score=0)  # postings cover most entries
+    assert sparse[0].question == 'How do I clean a copper lamp?'
+    assert len(dense) == 3 and all(h.question.startswith('Question') for h in dense)
+
+
+def test_local_responder_answers_from_the_faq(monkeypatch):
+    monkeypatch.setattr(server, 'runtime_api_key', None)
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    client = server.app.test_client()
+    reply = client.post('/api/chat', json={'message': 'how do I check if pearls are real?'}).get_json()['reply']
+    assert reply.startswith('Rub the pearls gently')
+    reply = client.post('/api/chat', json={'message': 'tell me about the moon'}).get_json()['reply']
+    assert reply == server.FALLBACK_REPLY
@@ -0,0 +1,44 @@
+import intents
+import server
+
+
+def test_priorities_not_check_order():
+    # a model name outranks topic keywords wherever it appears in the message
+    m = intents.ENGINE.classify('what is the value of a macbook air')
+    assert m.intent == intents.MODEL
+    assert m.value == 'macbook air'
+
+
+def test_greetings_are_whole_words():
+    assert intents.ENGINE.classify('hi').intent == intents.GREETING
+    assert intents.ENGINE.classify('thrift tips please').intent == intents.TIPS
+    assert intents.GREETING not in intents.ENGINE.scan('which one is this')
+
+
+def test_categories_and_models_are_whole_words():
+    engine = intents.default_engine(models=['Pro 9'], categories=['hat', 'other'])
+    assert intents.CATEGORY not in engine.scan('what is this worth?')
+    assert intents.CATEGORY not in engine.scan('I want that lamp')
+    assert intents.CATEGORY not in engine.scan('another one for my mother')
+    assert engine.scan('any hats?')[intents.CATEGORY].value == 'hat'
+    assert engine.scan('something other')[intents.CATEGORY].value == 'other'
+    assert intents.MODEL not in engine.scan('the pro 99')
+    assert engine.scan('two Pro 9s please')[intents.MODEL].value == 'pro 9'
+    assert intents.ENGINE.scan('cheap laptops')[intents.CATEGORY].value == 'laptop'
+
+
+def test_overlapping_keywords():
+    engine = intents.IntentEngine({'a': 0, 'b': 1})
+    engine.add('she', 'b')
+    engine.add('he', 'a')
+    engine.add('hers', 'b')
+    found = engine.scan('ushers')
+    assert set(found) == {'a', 'b'}
+    assert engine.classify('ushers').intent == 'a'
+
+
+def test_rule_based_response():
+    assert server.rule_based_response('Tell me about MacBook Air').startswith('MacBook Air')
+    assert server.rule_based_response('laptop')['choices'] == server.product_catalog.choices('laptop')
+    assert 'estimate' in server.rule_based_response('what is it worth?')
+    assert server.rule_based_response('qwerty').startswith("I don't have an exact answer")
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+import keypool
+import response_cache
+import server
+from stub_upstream import StubUpstream
+from test_admission import FakeClock
+from test_asgi import _call
+
+
+def test_parse_duration():
+    assert keypool.parse_duration('1s') == 1.0
+    assert keypool.parse_duration('6m0s') == 360.0
+    assert keypool.parse_duration('20ms') == pytest.approx(0.02)
+    assert keypool.parse_duration('1h2m3.5s') == 3723.5
+    assert keypool.parse_duration('2.5') == 2.5
+    assert keypool.parse_duration('soon') is None and keypool.parse_duration(None) is None
+
+
+def test_choose_prefers_most_headroom():
+    clock = FakeClock()
+    pool = keypool.KeyPool(clock=clock)
+    assert pool.choose() is None
+    pool.add('sk-a')
+    pool.add('sk-b')
+    pool.observe('sk-a', 200, {'x-ratelimit-remaining-requests': '5', 'x-ratelimit-reset-requests': '10s'})
+    # a key that has not answered yet is tried first
+    assert pool.choose() == 'sk-b'
+    pool.observe('sk-b', 200, {'x-ratelimit-remaining-requests': '3', 'x-ratelimit-reset-requests': '10s'})
+    assert pool.choose() == 'sk-a'
+    # calls in flight count against the headroom
+    with pool.using('sk-a'), pool.using('sk-a'), pool.using('sk-a'):
+        assert pool.choose() == 'sk-b'
+    # once the window resets the old count no longer applies
+    pool.observe('sk-a', 200, {'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '1s'})
+    assert pool.choose() == 'sk-b'
+    clock.now = 2
+    assert pool.choose() == 'sk-a'
+
+
+def test_429_cools_the_key_down():
+    clock = FakeClock()
+    pool = keypool.KeyPool(cooldown=10, clock=clock)
+    pool.add('sk-a')
+    pool.add('sk-b')
+    pool.observe('sk-a', 429, {'retry-after': '4'})
+    assert pool.choose() == 'sk-b' and pool.cooldown_left('sk-a') == 4
+    pool.observe('sk-b', 429, {})
+    # all keys resting: the one back first, and the caller sheds
+    assert pool.choose() == 'sk-a' and pool.cooldown_left('sk-b') == 10
+    clock.now = 4
+    assert pool.cooldown_left('sk-a') == 0 and pool.choose() == 'sk-a'
+    assert [k['throttled'] for k in pool.stats()] == [1, 1]
+
+
+def test_drain_and_remove_keep_calls_in_flight():
+    pool = keypool.KeyPool()
+    a = pool.add('sk-a')
+    b = pool.add('sk-b', name='backup')
+    assert b == 'backup' and a == keypool.key_id('sk-a')
+    key = pool.choose()
+    assert key == 'sk-a'
+    with pool.using(key):
+        assert pool.drain(a) and pool.choose() == 'sk-b'
+        assert pool.stats()[0] == dict(pool.stats()[0], state=keypool.DRAINING, in_flight=1)
+        assert pool.remove(a) == 'sk-a' and len(pool) == 1
+        # the removed key's call is unaffected and stops being tracked
+        pool.observe(key, 200, {'x-ratelimit-remaining-requests': '1'})
+    assert pool.remove(a) is None and not pool.drain(a)
+    assert pool.add('sk-b') == 'backup'
+
+
+def test_requests_spread_over_keys_and_shed_when_all_are_spent(monkeypatch):
+    with StubUpstream(key_limits={'sk-a': 3, 'sk-b': 3}, window=60) as stub:
+        monkeypatch.setenv('OPENAI_BASE_URL', stub.base_url)
+        monkeypatch.setattr(server, 'runtime_api_key', None)
+        monkeypatch.setattr(server, '_upstream_clients', {})
+        monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+        server.key_pool.add('sk-a')
+        server.key_pool.add('sk-b')
+        client = server.app.test_client()
+        for i in range(6):
+            resp = client.post('/api/chat', json={'message': 'vintage lamp %d' % i})
+            assert resp.status_code == 200 and 'degraded' not in resp.get_json()
+        assert stub.served('sk-a') == 3 and stub.served('sk-b') == 3 and stub.throttled == 0
+        assert [k['remaining_requests'] for k in server.key_pool.stats()] == [0, 0]
+
+        before = server.CHAT_SHED.value(reason='key_cooldown')
+        statuses = [client.post('/api/chat', json={'message': 'the moon %d' % i}).status_code for i in range(3)]
+        # each spent key takes one 429 and then rests until its window resets
+        assert statuses == [429, 429, 429] and stub.throttled == 2
+        assert len(stub.requests) == 8
+        assert server.CHAT_SHED.value(reason='key_cooldown') == before + 1
+        assert all(k['cooldown'] > 50 for k in server.key_pool.stats())
+    for key in ('sk-a', 'sk-b'):
+        server.get_upstream(key).close()
+
+
+def test_admin_key_endpoints(monkeypatch):
+    monkeypatch.setenv('ADMIN_TOKEN', 'tok')
+    client = server.app.test_client()
+    assert client.get('/admin/keys').status_code == 401
+    resp = client.post('/admin/keys', json={'key': 'sk-a', 'admin_token': 'tok'})
+    a = resp.get_json()['id']
+    client.post('/admin/keys', json={'key': 'sk-b', 'id': 'second', 'admin_token': 'tok'})
+    keys = client.get('/admin/keys', headers={'X-Admin-Token': 'tok'}).get_json()['keys']
+    assert [k['id'] for k in keys] == [a, 'second'] and 'sk-a' not in str(keys)
+    assert client.post('/admin/keys/drain', json={'id': a, 'admin_token': 'tok'}).status_code == 200
+    assert server._api_key() == 'sk-b'
+    assert client.post('/admin/keys/remove', json={'id': 'second', 'admin_token': 'tok'}).status_code == 200
+    assert client.post('/admin/keys/remove', json={'id': 'second', 'admin_token': 'tok'}).status_code == 404
+    # set_key replaces the pool's active keys with one
+    client.post('/admin/set_key', json={'key': 'sk-c', 'admin_token': 'tok'})
+    assert [k['state'] for k in server.key_pool.stats()] == ['draining', 'active']
+    assert server._api_key() == 'sk-c'
+
+    async def run():
+        status, _ = await _call('POST', '/admin/keys/drain', {'id': keypool.key_id('sk-c'), 'admin_token': 'tok'})
+        assert status == 200
+        status, _ = await _call('POST', '/admin/keys', {'key': 'sk-d', 'admin_token': 'tok'})
+        assert status == 200
+        status, _ = await _call('POST', '/admin/keys/remove', {'id': 'nope', 'admin_token': 'tok'})
+        assert status == 404
+    asyncio.run(run())
+    assert server._api_key() == 'sk-d'
@@ -0,0 +1,48 @@
+import random
+
+import message_view
+
+
+def _model(heights):
+    model = message_view.MessageModel(lambda text, sender: int(text))
+    for h in heights:
+        model.append(str(h))
+    return model
+
+
+def test_offsets_match_prefix_sums():
+    rnd = random.Random(1)
+    heights = [rnd.randint(20, 200) for _ in range(1000)]
+    model = _model(heights)
+    assert model.total_height() == sum(heights)
+    for i in (0, 1, 7, 500, 999):
+        assert model.offset(i) == sum(heights[:i])
+        assert model.index_at(model.offset(i)) == i
+        assert model.index_at(model.offset(i) + heights[i] - 1) == i
+    assert model.index_at(-5) == 0 and model.index_at(10 ** 9) == 999
+
+
+def test_set_height_shifts_later_messages():
+    model = _model([10, 20, 30, 40])
+    assert not model.measured(1)
+    assert model.set_height(1, 25)
+    assert model.measured(1) and not model.set_height(1, 25)
+    assert [model.offset(i) for i in range(4)] == [0, 10, 35, 65]
+    assert model.total_height() == 105
+
+
+def test_visible_range_is_bounded():
+    model = _model([50] * 50000)
+    rng = model.visible(top=1_000_000, height=600, overscan=2)
+    assert rng == range(20000 - 2, 20011 + 2 + 1)
+    assert model.visible(0, 600, overscan=2)[0] == 0
+    assert model.visible(model.total_height() - 600, 600, overscan=2)[-1] == 49999
+    assert message_view.MessageModel(lambda text, sender: len(text)).visible(0, 600) == range(0)
+
+
+def test_estimate_height():
+    assert message_view.estimate_height('x' * 250, 100, 17, 28) == 3 * 17 + 28
+    assert message_view.estimate_height('a\n\nb', 100, 17, 28) == 3 * 17 + 28
+    model = message_view.MessageModel(lambda text, sender: len(text))
+    model.append('hi', 'user')
+    assert model.sender(0) == message_view.USER and model.text(0) == 'hi'
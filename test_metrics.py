@@ -0,0 +1,69 @@
+import metrics
+import server
+from stub_upstream import StubUpstream
+
+
+def test_histogram_render():
+    registry = metrics.Registry(prefix='t_')
+    hist = registry.histogram('latency_seconds', 'Latency.', ['phase'], buckets=(0.1, 1.0))
+    hist.observe(0.05, phase='a')
+    hist.labels(phase='a').observe(0.5)
+    hist.observe(5, phase='b"x')
+    registry.counter('hits_total', 'Hits.', ['source']).inc(source='local')
+    registry.gauge_callback('size', 'Size.', lambda: 7)
+    text = registry.render()
+    assert '# TYPE t_latency_seconds histogram' in text
+    assert 't_latency_seconds_bucket{phase="a",le="0.1"} 1' in text
+    assert 't_latency_seconds_bucket{phase="a",le="1.0"} 2' in text
+    assert 't_latency_seconds_bucket{phase="a",le="+Inf"} 2' in text
+    assert 't_latency_seconds_count{phase="b\\"x",le' not in text
+    assert 't_latency_seconds_count{phase="b\\"x"} 1' in text
+    assert 't_hits_total{source="local"} 1' in text
+    assert 't_size 7' in text
+
+
+def test_disabled_registry_records_nothing():
+    registry = metrics.Registry(enabled=False)
+    hist = registry.histogram('h', 'h', ['phase'])
+    with hist.time(phase='x'):
+        pass
+    hist.labels(phase='y').observe(1)
+    registry.counter('c_total', 'c').inc()
+    assert hist.count(phase='x') == 0 and hist.count(phase='y') == 0
+    assert '\nc_total ' not in registry.render()
+
+
+def test_chat_phases_and_sources(monkeypatch):
+    monkeypatch.setattr(server, 'runtime_api_key', None)
+    server.registry.clear()
+    client = server.app.test_client()
+    client.post('/api/chat', json={'message': 'hi'})
+    client.post('/api/chat', json={'message': 'laptop'})
+    client.post('/api/chat', json={'message': ''})
+    assert server.CHAT_PHASES.count(phase='parse') == 3
+    assert server.CHAT_PHASES.count(phase='serialize') == 3
+    assert server.CHAT_PHASES.count(phase='greeting') == 2
+    assert server.CHAT_RESPONSES.value(source='local') == 2
+    assert server.CHAT_RESPONSES.value(source='invalid') == 1
+    resp = client.get('/metrics')
+    assert resp.status_code == 200 and resp.content_type.startswith('text/plain; version=0.0.4')
+    assert 'qupal_chat_request_seconds_count{endpoint="chat"} 3' in resp.get_data(as_text=True)
+
+
+def test_upstream_variant_and_switch_off(monkeypatch):
+    with StubUpstream() as stub:
+        monkeypatch.setenv('OPENAI_BASE_URL', stub.base_url)
+        monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+        monkeypatch.setattr(server, '_upstream_clients', {})
+        server.registry.clear()
+        client = server.app.test_client()
+        client.post('/api/chat', json={'message': 'vintage lamp', 'cache': False})
+        assert server.UPSTREAM_SECONDS.count(variant='chat', outcome='ok') == 1
+        assert server.CHAT_PHASES.count(phase='guard') == 1
+        assert server.CHAT_RESPONSES.value(source='upstream') == 1
+
+    monkeypatch.setattr(server.registry, 'enabled', False)
+    server.registry.clear()
+    client.post('/api/chat', json={'message': 'hi'})
+    assert server.CHAT_PHASES.count(phase='parse') == 0
+    assert client.get('/metrics').status_code == 404
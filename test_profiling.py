@@ -0,0 +1,153 @@
+import asyncio
+import json
+import marshal
+import time
+
+import pytest
+
+import asgi
+import profiling
+import response_cache
+import server
+from test_asgi import _call
+
+ADMIN = {'X-Admin-Token': 'tok'}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('ADMIN_TOKEN', 'tok')
+    monkeypatch.setattr(server, 'profiler', profiling.Profiler(server.app))
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+    original = server.app.wsgi_app
+    yield server.app.test_client()
+    server.profiler.stop()
+    assert server.app.wsgi_app == original
+
+
+def _chat(client, body):
+    # the test client only closes a response body when asked; servers always do
+    client.post('/api/chat', json=body).close()
+
+
+def _wait_done(client):
+    for _ in range(200):
+        status = client.get('/admin/profile', headers=ADMIN).get_json()
+        if status['state'] == 'done':
+            return status
+        time.sleep(0.01)
+    raise AssertionError('profiling session did not end')
+
+
+def test_cprofile_next_requests(client):
+    original = server.app.wsgi_app
+    resp = client.post('/admin/profile/start', json={'mode': 'cprofile', 'requests': 2, 'route': 'chat'},
+                       headers=ADMIN)
+    assert resp.status_code == 200 and resp.get_json()['state'] == 'running'
+    assert server.app.wsgi_app != original
+    for i in range(3):
+        _chat(client, {'message': 'vintage tips %d' % i, 'local': True})
+    status = client.get('/admin/profile', headers=ADMIN).get_json()
+    assert status['state'] == 'done' and status['requests'] == 2
+    # the original app is back, so nothing runs per request any more
+    assert server.app.wsgi_app == original
+
+    resp = client.get('/admin/profile/result', headers=ADMIN)
+    assert 'qupal-profile.pstats' in resp.headers['Content-Disposition']
+    stats = marshal.loads(resp.data)
+    assert any(name == '_local_answer' for _, _, name in stats)
+    text = client.get('/admin/profile/result?format=text', headers=ADMIN).data.decode()
+    assert 'handle_chat' in text
+    assert client.get('/admin/profile/result?format=collapsed', headers=ADMIN).status_code == 400
+
+
+def test_sampling_filters_by_response_path(client, monkeypatch):
+    def slow_upstream(message, api_key, history=None, deadline=None):
+        time.sleep(0.05)
+        return 'Check the vintage label.'
+
+    monkeypatch.setattr(server, '_upstream_reply', slow_upstream)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    client.post('/admin/profile/start', json={'requests': 1, 'source': 'upstream', 'interval_ms': 1},
+                headers=ADMIN)
+    _chat(client, {'message': 'is this coat vintage?', 'local': True})
+    assert client.get('/admin/profile', headers=ADMIN).get_json()['requests'] == 0
+    _chat(client, {'message': 'is this coat vintage?'})
+    status = _wait_done(client)
+    assert status['requests'] == 1 and status['samples'] > 5
+
+    resp = client.get('/admin/profile/result', headers=ADMIN)
+    assert resp.headers['Content-Type'].startswith('text/plain')
+    lines = resp.data.decode().splitlines()
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any(line.rsplit(' ', 1)[0].endswith('test_profiling.py:slow_upstream') for line in lines)
+
+
+def test_window_and_admin_errors(client):
+    assert client.get('/admin/profile').status_code == 401
+    assert client.get('/admin/profile/result', headers=ADMIN).status_code == 404
+    assert client.post('/admin/profile/start', json={'mode': 'perf'}, headers=ADMIN).status_code == 400
+    assert client.post('/admin/profile/start', json={'seconds': 0.05}, headers=ADMIN).status_code == 200
+    assert client.post('/admin/profile/start', json={}, headers=ADMIN).status_code == 409
+    status = _wait_done(client)
+    assert status['requests'] == 0 and status['mode'] == 'sample'
+    assert client.get('/admin/profile/result', headers=ADMIN).data == b''
+
+
+@pytest.fixture
+def asgi_profiler(monkeypatch):
+    monkeypatch.setenv('ADMIN_TOKEN', 'tok')
+    monkeypatch.setattr(asgi, 'profiler', profiling.AsgiProfiler(asgi.app))
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+    original = asgi.app.asgi_app
+    yield asgi.profiler
+    asgi.profiler.stop()
+    assert asgi.app.asgi_app == original
+
+
+ASGI_ADMIN = [(b'x-admin-token', b'tok')]
+
+
+def test_asgi_cprofile_next_request(asgi_profiler):
+    async def run():
+        status, body = await _call('POST', '/admin/profile/start', {'mode': 'cprofile', 'requests': 1},
+                                   headers=ASGI_ADMIN)
+        assert status == 200 and json.loads(body)['state'] == 'running'
+        await _call('POST', '/api/chat', {'message': 'vintage tips', 'local': True})
+        status, body = await _call('GET', '/admin/profile', headers=ASGI_ADMIN)
+        assert json.loads(body)['state'] == 'done' and json.loads(body)['requests'] == 1
+        status, data, headers = await _call('GET', '/admin/profile/result', headers=ASGI_ADMIN, with_headers=True)
+        assert b'qupal-profile.pstats' in headers[b'content-disposition']
+        assert any(name == 'handle_chat' for _, _, name in marshal.loads(data))
+        status, data = await _call('GET', '/admin/profile/result?format=text', headers=ASGI_ADMIN)
+        assert status == 200 and b'handle_chat' in data
+        status, _ = await _call('GET', '/admin/profile/result?format=collapsed', headers=ASGI_ADMIN)
+        assert status == 400
+        status, _ = await _call('POST', '/admin/profile/stop', headers=ASGI_ADMIN)
+        assert status == 200
+        status, _ = await _call('GET', '/admin/profile')
+        assert status == 401
+
+    asyncio.run(run())
+
+
+def test_asgi_sampling_follows_the_await_chain(asgi_profiler, monkeypatch):
+    async def slow_upstream(message, api_key, history=None, deadline=None):
+        await asyncio.sleep(0.05)
+        return 'Check the vintage label.'
+
+    monkeypatch.setattr(asgi, '_upstream_reply', slow_upstream)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+
+    async def run():
+        await _call('POST', '/admin/profile/start', {'requests': 1, 'source': 'upstream', 'interval_ms': 1},
+                    headers=ASGI_ADMIN)
+        await _call('POST', '/api/chat', {'message': 'is this coat vintage?', 'local': True})
+        assert asgi_profiler.status()['requests'] == 0
+        await _call('POST', '/api/chat', {'message': 'is this coat vintage?'})
+
+    asyncio.run(run())
+    status = asgi_profiler.status()
+    assert status['state'] == 'done' and status['requests'] == 1 and status['samples'] > 5
+    lines = asgi_profiler.result()[0].decode().splitlines()
+    assert any('asgi.py:_upstream_answer;' in line and 'test_profiling.py:slow_upstream' in line for line in lines)
@@ -0,0 +1,44 @@
+import numpy as np
+
+import relevance
+import server
+
+
+def test_model_beats_keywords_on_held_out_set():
+    model = relevance.load()
+    texts, labels = relevance.load_examples(relevance.EVAL_PATH)
+    assert model.evaluate(texts, labels) >= 0.85
+
+
+def test_batch_scores_match_single_and_explicit_features():
+    model = relevance.load()
+    texts = ['Check the seams and zippers.', '', 'Paris is in France.', 'hi', "Don't buy a rusty pan."]
+    batch = model.score(texts)
+    assert np.allclose(batch, [model.score([t])[0] for t in texts])
+    ids, docs, counts = model.features(texts)
+    logits = model.bias + np.bincount(docs, weights=model.weights[ids], minlength=len(texts)) / np.sqrt(
+        np.maximum(counts, 1))
+    assert np.allclose(batch, 1 / (1 + np.exp(-logits)))
+    assert model.score([]).shape == (0,)
+
+
+def test_off_topic_uses_of_old_keywords():
+    model = relevance.load()
+    assert model.relevant('where should I look for a vintage denim jacket?',
+                          'Try charity shops on weekday mornings, right after they restock.')
+    assert not model.relevant('what is the value of pi?', 'Pi is approximately 3.14159.')
+    assert not model.relevant('how do I label a chart axis?', 'Call plt.xlabel with the axis title.')
+
+
+def test_thresholds_are_configurable():
+    model = relevance.load(reply_threshold=0.0, message_threshold=1.01)
+    assert model.relevant('where is paris', 'Paris is in France.')
+    strict = relevance.load(reply_threshold=1.01, message_threshold=1.01)
+    assert not strict.relevant('how old is this lamp?', 'Check the maker mark on the base.')
+    assert not strict.relevant('a', 'c')
+
+
+def test_server_guard_uses_the_model():
+    assert server._guard_reply('where is paris', 'Paris is in France.') == server.OFF_TOPIC_REPLY
+    reply = 'Look for a maker mark on the base and compare sold listings.'
+    assert server._guard_reply('how much is my lamp worth?', reply) == reply
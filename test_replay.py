@@ -0,0 +1,58 @@
+import json
+
+import capture
+import replay
+import server
+
+
+def _capture(path):
+    log = capture.CaptureLog(path, clock=lambda: 100.0)
+    for i, (route, body, status) in enumerate([
+        ('/api/chat', {'message': 'hi'}, 200),
+        ('/api/chat', {'message': 'which laptop should I get?'}, 200),
+        ('/api/chat', {'message': '', 'action': 'select', 'selection': 'Dell XPS 13'}, 200),
+        ('/api/chat', {'message': 'is this coat vintage?'}, 200),
+        ('/api/chat/stream', {'message': 'is this lamp vintage?'}, 200),
+        ('/api/chat', {}, 400),
+    ]):
+        log.request(route, json.dumps(body).encode(), {}, status, 0.01, 100.0 + i * 0.01)
+    log.upstream('is this coat vintage?', 'Check the coat label for the vintage era.', 0.02)
+    log.upstream('is this lamp vintage?', 'Old lamps have cloth vintage cords.', 0.02)
+    log.close()
+
+
+def test_schedule_and_recorded_responses():
+    requests = [{'t': 10.0}, {'t': 10.5}, {'t': 12.0}]
+    assert [o for o, _ in replay.schedule(requests, 1.0)] == [0.0, 0.5, 2.0]
+    assert [o for o, _ in replay.schedule(requests, 4.0)] == [0.0, 0.125, 0.5]
+    assert [o for o, _ in replay.schedule(requests, None)] == [0.0, 0.0, 0.0]
+    replies = [{'t': 2, 'u': 'a', 'reply': 'second', 'ms': 5}, {'t': 1, 'u': 'a', 'reply': 'first', 'ms': 10}]
+    assert replay.recorded_responses(replies) == {'a': [('first', 0.01), ('second', 0.005)]}
+    assert replay.recorded_responses(replies, latency=0) == {'a': [('first', 0), ('second', 0)]}
+
+
+def test_replay_in_process_and_compare(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(server, 'runtime_api_key', None)
+    monkeypatch.setattr(server, '_upstream_clients', {})
+    monkeypatch.setattr(server, 'rate_limiter', server.rate_limiter)
+    monkeypatch.setenv('OPENAI_BASE_URL', 'http://127.0.0.1:9/v1')
+    path = str(tmp_path / 'capture.log')
+    _capture(path)
+    out = tmp_path / 'before.json'
+    assert replay.main(['run', path, '--speed', '2', '--out', str(out), '--label', 'before']) == 0
+    before = json.loads(out.read_text())
+    assert before['count'] == 6 and before['mismatches'] == 0 and before['errors'] == 0
+    assert before['upstream_calls'] == 2 and set(before['by_route']) == {'chat', 'stream'}
+    # the stub served the recorded replies with their recorded latency
+    assert before['by_route']['stream']['p50_ms'] >= 20
+
+    slower = dict(before, p99_ms=before['p99_ms'] * 2, label='after',
+                  by_route=dict(before['by_route'], chat=dict(before['by_route']['chat'], mismatches=1)))
+    rows, problems = replay.compare(before, slower)
+    assert rows[0]['route'] == 'all' and rows[0]['p99_change'] == 1.0
+    assert problems == ['all: p99_ms %.3f > %.3f' % (slower['p99_ms'], before['p99_ms']),
+                        'chat: 1 status mismatches (was 0)']
+    assert replay.compare(before, before)[1] == []
+    (tmp_path / 'after.json').write_text(json.dumps(slower))
+    assert replay.main(['compare', str(out), str(tmp_path / 'after.json')]) == 1
+    capsys.readouterr()
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import responder
+
+
+def _wait(r, n, timeout=5):
+    out = []
+    deadline = time.time() + timeout
+    while len(out) < n and time.time() < deadline:
+        out += r.drain()
+        time.sleep(0.005)
+    return out
+
+
+def test_replies_in_submission_order():
+    delays = {'slow': 0.2, 'fast': 0.0}
+    r = responder.Responder(lambda t: (time.sleep(delays[t.split()[0]]), t.upper())[1], workers=4)
+    r.submit('slow 0')
+    r.submit('fast 1')
+    r.submit('fast 2')
+    time.sleep(0.05)
+    # the fast replies are done but wait behind the slow one
+    assert r.drain() == []
+    out = _wait(r, 3)
+    assert [x.reply for x in out] == ['SLOW 0', 'FAST 1', 'FAST 2']
+    assert r.pending() == 0
+    r.shutdown()
+
+
+def test_stale_requests_are_superseded():
+    gate = threading.Event()
+    r = responder.Responder(lambda t: (gate.wait(5), t)[1], workers=1, max_pending=2)
+    seqs = [r.submit('m%d' % i) for i in range(5)]
+    assert r.superseded == 3
+    gate.set()
+    out = _wait(r, 5)
+    assert [x.seq for x in out] == seqs
+    # the running one and the newest are answered, the queued middle ones dropped
+    assert [x.status for x in out] == [responder.OK] + [responder.SUPERSEDED] * 3 + [responder.OK]
+    r.shutdown()
+
+
+def test_errors_and_cancel():
+    gate = threading.Event()
+
+    def respond(text):
+        gate.wait(5)
+        if text == 'boom':
+            raise ValueError('bad')
+        return text
+
+    r = responder.Responder(respond, workers=1)
+    r.submit('boom')
+    queued = r.submit('x')
+    r.cancel(queued)
+    gate.set()
+    out = _wait(r, 2)
+    assert [(x.status, x.reply) for x in out] == [(responder.ERROR, 'bad'), (responder.CANCELLED, None)]
+    r.shutdown()
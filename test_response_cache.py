@@ -0,0 +1,75 @@
+import json
+
+import response_cache
+import server
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_and_ttl_eviction():
+    clock = FakeClock()
+    cache = response_cache.ResponseCache(max_entries=2, ttl=10, clock=clock)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A'  # 'a' becomes most recent
+    cache.set('c', 'C')           # evicts 'b'
+    assert cache.get('b') is None
+    clock.now += 11
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['expirations'] == 1
+    assert stats['hits'] == 1 and stats['misses'] == 2
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    db = str(tmp_path / 'cache.db')
+    response_cache.ResponseCache(db_path=db).set('k', 'reply')
+    cache = response_cache.ResponseCache(db_path=db)
+    assert cache.get('k') == 'reply'
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_disk_hit_keeps_its_expiry(tmp_path):
+    db = str(tmp_path / 'cache.db')
+    clock = FakeClock()
+    response_cache.ResponseCache(ttl=10, db_path=db, clock=clock).set('k', 'reply')
+    clock.now += 8
+    cache = response_cache.ResponseCache(ttl=10, db_path=db, clock=clock)
+    assert cache.get('k') == 'reply'
+    # the memory copy expires with the disk row, not a full TTL later
+    clock.now += 3
+    assert cache.get('k') is None
+
+
+def test_key_normalization():
+    k = response_cache.make_key('How do I estimate value?', 'm', 's')
+    assert k == response_cache.make_key('  how do I   estimate VALUE ', 'm', 's')
+    assert k != response_cache.make_key('How do I estimate value?', 'm', 'other prompt')
+
+
+def test_api_chat_serves_repeats_from_cache(monkeypatch):
+    calls = []
+
+    def fake_upstream(message, api_key, history=None, deadline=None):
+        calls.append(message)
+        return 'Check the label and seams.'
+
+    monkeypatch.setattr(server, '_upstream_reply', fake_upstream)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    client = server.app.test_client()
+
+    def post(payload):
+        return client.post('/api/chat', data=json.dumps(payload), content_type='application/json').get_json()
+
+    assert 'cached' not in post({'message': 'thrift tips for jackets'})
+    assert post({'message': 'Thrift tips for jackets?'})['cached'] is True
+    assert 'cached' not in post({'message': 'thrift tips for jackets', 'cache': False})
+    assert len(calls) == 2
@@ -0,0 +1,140 @@
+import response_cache
+import server
+import sessions
+import upstream
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_history_returns_recent_turns_in_order():
+    store = sessions.SessionStore()
+    store.record('s1', 'is this coat vintage?', 'Check the label.')
+    store.record('s1', 'it says made in 1970', 'Then it is likely vintage.')
+    assert store.history('s1') == [
+        {'role': 'user', 'content': 'is this coat vintage?'},
+        {'role': 'assistant', 'content': 'Check the label.'},
+        {'role': 'user', 'content': 'it says made in 1970'},
+        {'role': 'assistant', 'content': 'Then it is likely vintage.'},
+    ]
+    assert store.history('unknown') == []
+
+
+def test_old_turns_fold_into_bounded_summary():
+    store = sessions.SessionStore(max_turns=4, summary_chars=200)
+    for i in range(50):
+        store.record('s1', 'question %d. more detail here' % i, 'answer %d.' % i)
+    history = store.history('s1', budget=10000)
+    assert history[0]['role'] == 'system'
+    summary = history[0]['content']
+    assert 'question 47' in summary and 'question 0' not in summary
+    assert 'more detail' not in summary  # only the first sentence is kept
+    assert len(summary) < 260
+    assert [m['content'] for m in history[1:]] == ['question 48. more detail here', 'answer 48.',
+                                                   'question 49. more detail here', 'answer 49.']
+
+
+def test_history_fits_token_budget():
+    store = sessions.SessionStore(max_turns=100, window_chars=100000)
+    for i in range(40):
+        store.record('s1', 'x' * 400, 'y' * 400)
+    for budget in (50, 300, 1000):
+        history = store.history('s1', budget=budget, reserve=20)
+        used = sum(sessions.estimate_tokens(m['content']) + sessions.MESSAGE_OVERHEAD for m in history)
+        assert used <= budget - 20
+    # the newest turn is always the last one kept
+    assert store.history('s1', budget=300)[-1]['role'] == 'assistant'
+
+
+def test_long_turns_are_truncated():
+    store = sessions.SessionStore(max_turn_chars=10)
+    store.record('s1', 'a' * 50, 'b' * 50)
+    assert [m['content'] for m in store.history('s1')] == ['a' * 10, 'b' * 10]
+
+
+def test_lru_eviction_and_idle_expiry():
+    clock = FakeClock()
+    store = sessions.SessionStore(max_sessions=2, idle_ttl=60, clock=clock)
+    store.record('a', 'hi', 'hello')
+    store.record('b', 'hi', 'hello')
+    store.history('a')  # touch a, so b is least recently used
+    store.record('c', 'hi', 'hello')
+    assert len(store) == 2 and store.history('b') == [] and store.history('a')
+    clock.now = 61
+    store.record('d', 'hi', 'hello')
+    assert len(store) == 1
+    assert store.stats()['evictions'] == 1 and store.stats()['expirations'] == 2
+
+
+def test_valid_session_id():
+    assert sessions.valid_session_id('3f2a-9c.x:1')
+    assert not sessions.valid_session_id('')
+    assert not sessions.valid_session_id('has space')
+    assert not sessions.valid_session_id('x' * 200)
+    assert not sessions.valid_session_id(42)
+
+
+def test_payload_includes_history():
+    client = upstream.UpstreamClient('sk-test', base_url='http://127.0.0.1:1')
+    history = [{'role': 'user', 'content': 'is it wool?'}, {'role': 'assistant', 'content': 'Check the tag.'}]
+    chat = client._payload(upstream.CHAT, 'SYS', 'it says 80% wool', 50, history)
+    assert [m['role'] for m in chat['messages']] == ['system', 'user', 'assistant', 'user']
+    prompt = client._payload(upstream.COMPLETION, 'SYS', 'it says 80% wool', 50, history)['prompt']
+    assert prompt == 'SYS\n\nUser: is it wool?\nAssistant: Check the tag.\nUser: it says 80% wool\nAssistant:'
+
+
+def test_api_chat_sends_session_history_upstream(monkeypatch):
+    seen = []
+
+    def fake_upstream(message, api_key, history=None, deadline=None):
+        seen.append(history)
+        return 'Vintage reply %d.' % len(seen)
+
+    monkeypatch.setattr(server, '_upstream_reply', fake_upstream)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    monkeypatch.setattr(server, 'chat_sessions', sessions.SessionStore())
+    client = server.app.test_client()
+
+    client.post('/api/chat', json={'message': 'is this coat vintage?', 'session_id': 's1'})
+    resp = client.post('/api/chat', json={'message': 'is this coat vintage?'}, headers={'X-Session-Id': 's1'})
+    assert resp.get_json() == {'reply': 'Vintage reply 2.'}  # not served from the cache
+    assert seen[0] == []
+    assert seen[1] == [{'role': 'user', 'content': 'is this coat vintage?'},
+                       {'role': 'assistant', 'content': 'Vintage reply 1.'}]
+
+    # without a session the exchange is stateless and cacheable as before
+    client.post('/api/chat', json={'message': 'how old is my lamp?'})
+    assert client.post('/api/chat', json={'message': 'how old is my lamp?'}).get_json()['cached'] is True
+    assert len(server.chat_sessions) == 1
+
+
+def test_replies_are_cached_per_conversation(monkeypatch):
+    seen = []
+
+    def fake_upstream(message, api_key, history=None, deadline=None):
+        seen.append(history)
+        return 'Vintage reply %d.' % len(seen)
+
+    monkeypatch.setattr(server, '_upstream_reply', fake_upstream)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    monkeypatch.setattr(server, 'chat_sessions', sessions.SessionStore())
+    client = server.app.test_client()
+
+    def ask(session_id, message):
+        return client.post('/api/chat', json={'message': message}, headers={'X-Session-Id': session_id}).get_json()
+
+    # the greeting is answered locally, so both sessions have the same history
+    for session_id in ('a', 'b'):
+        ask(session_id, 'hello')
+    assert ask('a', 'is this coat vintage?') == {'reply': 'Vintage reply 1.'}
+    assert ask('b', 'is this coat vintage?') == {'reply': 'Vintage reply 1.', 'cached': True}
+    ask('c', 'hi there')
+    assert ask('c', 'is this coat vintage?') == {'reply': 'Vintage reply 2.'}
+    assert len(seen) == 2 and seen[0] and seen[0] != seen[1]
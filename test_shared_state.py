@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+import keypool
+import response_cache
+import server
+import shared_state
+from test_admission import FakeClock
+
+
+def test_changes_reach_other_connections(tmp_path):
+    path = str(tmp_path / 'state.db')
+    clock = FakeClock()
+    a = shared_state.SharedState(path, interval=1.0, clock=clock)
+    b = shared_state.SharedState(path, interval=1.0, clock=clock)
+    seen_a, seen_b = [], []
+    a.on_change('mode', seen_a.append)
+    b.on_change('mode', seen_b.append)
+    assert b.get('mode', 'off') == 'off'
+
+    a.set('mode', {'level': 2})
+    assert a.get('mode') == {'level': 2} and seen_a == []
+    # b checks again only once its interval has passed
+    assert b.get('mode') is None
+    clock.now = 1.0
+    assert b.get('mode') == {'level': 2} and seen_b == [{'level': 2}]
+    refreshes = b.refreshes
+    clock.now = 2.0
+    assert b.get('mode') == {'level': 2} and b.refreshes == refreshes
+    assert not b.due()
+    clock.now = 3.0
+    assert b.due()
+
+    b.delete('mode')
+    assert a.refresh() and a.get('mode', 'gone') == 'gone' and seen_a == [None]
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+
+def test_bump_is_atomic_across_processes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    code = ('import shared_state\n'
+            's = shared_state.SharedState(%r)\n'
+            'for _ in range(50): s.bump("n")\n' % path)
+    procs = [subprocess.Popen([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+             for _ in range(4)]
+    assert [p.wait(30) for p in procs] == [0] * 4
+    assert shared_state.SharedState(path).get('n') == 200
+
+
+def test_workers_share_keys_and_cache_clears(tmp_path, monkeypatch):
+    path = str(tmp_path / 'state.db')
+    monkeypatch.setenv('ADMIN_TOKEN', 'tok')
+    monkeypatch.setattr(server, 'shared', None)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-env')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    server.key_pool.add('sk-a')
+    server._attach_shared(shared_state.SharedState(path, interval=0))
+    other = shared_state.SharedState(path, interval=0)
+    # the first worker seeds the shared pool
+    assert other.get('keys') == [['sk-a', keypool.key_id('sk-a'), 'active']]
+    assert other.get('runtime_api_key') == 'sk-env'
+
+    client = server.app.test_client()
+    client.post('/admin/set_key', json={'key': 'sk-new', 'admin_token': 'tok'})
+    assert [state for _, _, state in other.get('keys')] == ['draining', 'active']
+    assert other.get('runtime_api_key') == 'sk-new'
+
+    # another worker removes every key and clears the runtime key
+    other.set('keys', [])
+    other.set('runtime_api_key', '')
+    resp = client.get('/admin/keys', headers={'X-Admin-Token': 'tok'})
+    assert resp.get_json() == {'keys': []} and server._api_key() == os.environ.get('OPENAI_API_KEY')
+
+    server.chat_cache.set('k', 'cached reply')
+    other.bump('cache_clears')
+    client.get('/admin/cache', headers={'X-Admin-Token': 'tok'})
+    assert len(server.chat_cache) == 0
+    client.post('/admin/cache/clear', json={'admin_token': 'tok'})
+    assert other.get('cache_clears') == 2
+    server.shared.close()
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+
+import response_cache
+import server
+import singleflight
+
+
+def _run_concurrently(n, target):
+    results = [None] * n
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, target())) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_calls_share_one_result():
+    sf = singleflight.SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'answer'
+
+    results = _run_concurrently(10, lambda: sf.do('k', slow))
+    assert len(calls) == 1
+    assert [r for r, _ in results] == ['answer'] * 10
+    assert sum(shared for _, shared in results) == 9
+    assert sf.stats()['collapsed'] == 9
+
+
+def test_errors_are_shared():
+    sf = singleflight.SingleFlight()
+    errors = []
+
+    def failing():
+        time.sleep(0.2)
+        raise RuntimeError('boom')
+
+    def call():
+        try:
+            sf.do('k', failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    _run_concurrently(5, call)
+    assert len(errors) == 5
+    assert sf.stats()['shared_errors'] == 4
+    # nothing is left in flight after a failure
+    assert sf.do('k', lambda: 'ok') == ('ok', False)
+
+
+def test_waiter_cap():
+    sf = singleflight.SingleFlight(max_waiters=2)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'x'
+
+    _run_concurrently(6, lambda: sf.do('k', slow))
+    stats = sf.stats()
+    assert stats['collapsed'] == 2
+    assert stats['overflow'] == 3
+    assert len(calls) == 4
+
+
+def test_api_chat_coalesces_burst(monkeypatch):
+    calls = []
+
+    def fake_upstream(message, api_key, history=None, deadline=None):
+        calls.append(message)
+        time.sleep(0.2)
+        return 'Check the label.'
+
+    monkeypatch.setattr(server, '_upstream_reply', fake_upstream)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+    monkeypatch.setattr(server, 'inflight', singleflight.SingleFlight())
+
+    def post():
+        client = server.app.test_client()
+        resp = client.post('/api/chat', data=json.dumps({'message': 'thrift tips?'}), content_type='application/json')
+        return resp.get_json()['reply']
+
+    assert _run_concurrently(8, post) == ['Check the label.'] * 8
+    assert len(calls) == 1
@@ -0,0 +1,69 @@
+import gzip
+
+import server
+import static_assets
+
+
+def _site(tmp_path):
+    (tmp_path / 'index.html').write_text('<link rel="stylesheet" href="./styles.css" /><a href="https://x.test/">x</a>')
+    (tmp_path / 'styles.css').write_text('body { color: #222; }\n' * 40)
+    return static_assets.StaticAssets(str(tmp_path))
+
+
+def test_hashed_urls_and_rewrite(tmp_path):
+    assets = _site(tmp_path)
+    css_url = assets.url_for('styles.css')
+    assert css_url.startswith('/styles.') and css_url.endswith('.css') and css_url != '/styles.css'
+    html = assets.get('index.html').body.decode()
+    assert 'href="%s"' % css_url in html
+    assert 'https://x.test/' in html
+    assert assets.get(css_url).cache_control == static_assets.IMMUTABLE
+    assert assets.get('styles.css').cache_control == static_assets.REVALIDATE
+
+
+def test_precompressed_variants_and_etags(tmp_path):
+    assets = _site(tmp_path)
+    status, headers, body = assets.respond('/styles.css', accept_encoding='gzip, deflate')
+    headers = dict(headers)
+    assert status == 200 and headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == (tmp_path / 'styles.css').read_bytes()
+    status, _, body = assets.respond('/styles.css', 'gzip', if_none_match=headers['ETag'])
+    assert status == 304 and body == b''
+    # the identity ETag does not validate the gzip variant
+    _, plain_headers, _ = assets.respond('/styles.css')
+    assert dict(plain_headers)['ETag'] != headers['ETag']
+    assert assets.respond('/missing.js')[0] == 404
+
+
+def test_accept_encoding_q_values(tmp_path):
+    asset = _site(tmp_path).get('styles.css')
+    asset.encodings['br'] = b'br-body'
+    assert asset.select('gzip, br')[1] == 'br'
+    assert asset.select('br;q=0, gzip')[1] == 'gzip'
+    assert asset.select('br;q=0.5, gzip;q=0.8')[1] == 'gzip'
+    assert asset.select('gzip;q=0, *')[1] == 'br'
+    assert asset.select('*;q=0, identity')[1] is None
+    assert asset.select('gzip;q=0')[1] is None
+    assert asset.select('gzip;q=nope, br;q=0')[1] is None
+
+
+def test_reload_on_change(tmp_path):
+    assets = _site(tmp_path)
+    old_url = assets.url_for('styles.css')
+    assert not assets.changed()
+    (tmp_path / 'styles.css').write_text('body { color: red; }')
+    assert assets.changed()
+    assets.load()
+    assert assets.url_for('styles.css') != old_url
+    assert assets.url_for('styles.css') in assets.get('index.html').body.decode()
+
+
+def test_server_serves_from_memory():
+    client = server.app.test_client()
+    resp = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert resp.status_code == 200 and resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': resp.headers['ETag']}).status_code == 304
+    css = client.get(server.assets.url_for('styles.css'))
+    assert css.status_code == 200 and 'immutable' in css.headers['Cache-Control']
+    assert client.get('/nope.txt').status_code == 404
@@ -0,0 +1,46 @@
+import json
+
+import response_cache
+import server
+
+
+def _events(resp):
+    out = []
+    for block in resp.get_data(as_text=True).strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        out.append((lines['event'], json.loads(lines['data'])))
+    return out
+
+
+def _post(client, payload):
+    return client.post('/api/chat/stream', data=json.dumps(payload), content_type='application/json')
+
+
+def test_stream_forwards_upstream_tokens(monkeypatch):
+    monkeypatch.setattr(server, '_upstream_stream', lambda m, k, h=None, d=None: iter(['Check ', 'the ', 'label.']))
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    resp = _post(server.app.test_client(), {'message': 'is this jacket vintage'})
+    assert resp.mimetype == 'text/event-stream'
+    events = _events(resp)
+    assert [e for e, _ in events] == ['token', 'token', 'token', 'done']
+    assert events[-1][1] == {'reply': 'Check the label.'}
+    # the finished reply is cached for both endpoints
+    assert server.chat_cache.get(response_cache.make_key('is this jacket vintage', server.UPSTREAM_MODEL, server.SYSTEM_PROMPT))
+
+
+def test_stream_guard_replaces_off_topic_reply(monkeypatch):
+    monkeypatch.setattr(server, '_upstream_stream', lambda m, k, h=None, d=None: iter(['Paris is ', 'in France.']))
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-test')
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache())
+    events = _events(_post(server.app.test_client(), {'message': 'where is paris'}))
+    assert events[-2][0] == 'replace'
+    assert events[-1][1]['reply'].startswith('I can only assist with thrift-related questions')
+
+
+def test_stream_local_answer_is_single_event(monkeypatch):
+    monkeypatch.setattr(server, 'runtime_api_key', None)
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    events = _events(_post(server.app.test_client(), {'message': 'laptop'}))
+    assert [e for e, _ in events] == ['token', 'done']
+    assert events[-1][1]['choices'] == server.product_catalog.choices('laptop')
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import response_cache
+import server
+import upstream
+from stub_upstream import StubUpstream
+
+
+@pytest.fixture
+def stub():
+    with StubUpstream() as s:
+        yield s
+
+
+def test_connections_are_reused(stub):
+    client = upstream.UpstreamClient('sk-a', base_url=stub.base_url)
+    for i in range(5):
+        assert 'q%d' % i in client.complete('sys', 'q%d' % i)
+    assert stub.connections == 1
+    assert client.variant == upstream.CHAT
+    assert {auth for _, auth, _ in stub.requests} == {'Bearer sk-a'}
+
+
+def test_key_is_per_instance(stub):
+    upstream.UpstreamClient('sk-a', base_url=stub.base_url).complete('sys', 'x')
+    upstream.UpstreamClient('sk-b', base_url=stub.base_url).complete('sys', 'x')
+    assert [auth for _, auth, _ in stub.requests] == ['Bearer sk-a', 'Bearer sk-b']
+
+
+def test_remembers_completion_variant_and_rechecks(stub):
+    stub.chat_available = False
+    now = [0.0]
+    client = upstream.UpstreamClient('sk', base_url=stub.base_url, recheck_interval=60, clock=lambda: now[0])
+    client.complete('sys', 'one')
+    client.complete('sys', 'two')
+    paths = [p for p, _, _ in stub.requests]
+    # only the first request probed the chat API
+    assert paths == ['/v1/chat/completions', '/v1/completions', '/v1/completions']
+    assert client.variant == upstream.COMPLETION
+
+    stub.chat_available = True
+    now[0] = 61
+    client.complete('sys', 'three')
+    assert stub.requests[-1][0] == '/v1/chat/completions'
+    assert client.variant == upstream.CHAT
+
+
+def test_stream_both_variants(stub):
+    client = upstream.UpstreamClient('sk', base_url=stub.base_url)
+    assert ''.join(client.stream('sys', 'lamp')) == stub.reply_for('lamp')
+    stub.chat_available = False
+    client = upstream.UpstreamClient('sk', base_url=stub.base_url)
+    assert ''.join(client.stream('sys', 'lamp')) == stub.reply_for('lamp')
+    assert ''.join(client.stream('sys', 'vase')) == stub.reply_for('vase')
+
+
+def test_errors_do_not_trigger_fallback(stub):
+    stub.fail_status = 429
+    client = upstream.UpstreamClient('sk', base_url=stub.base_url)
+    with pytest.raises(upstream.UpstreamError) as exc:
+        client.complete('sys', 'x')
+    assert exc.value.status == 429
+    assert len(stub.requests) == 1
+    assert client.variant is None
+
+
+def test_server_uses_pooled_client(stub, monkeypatch):
+    monkeypatch.setenv('OPENAI_BASE_URL', stub.base_url)
+    monkeypatch.setattr(server, 'runtime_api_key', 'sk-server')
+    monkeypatch.setattr(server, '_upstream_clients', {})
+    monkeypatch.setattr(server, 'chat_cache', response_cache.ResponseCache(max_entries=0))
+    client = server.app.test_client()
+    for msg in ('vintage lamp', 'vintage vase'):
+        resp = client.post('/api/chat', data=json.dumps({'message': msg}), content_type='application/json')
+        assert resp.get_json()['reply'] == stub.reply_for(msg)
+    assert stub.connections == 1
@@ -0,0 +1,492 @@
+"""
+Persistent client for the OpenAI completion APIs.
+
+One `UpstreamClient` is created per API key and reused for every request:
+it keeps HTTP connections alive in a small pool, holds its key on the
+instance instead of in `openai.api_key`, and remembers whether the chat or
+the legacy completion API works so that requests stop paying for a failed
+probe. The choice is re-checked every `recheck_interval` seconds.
+
+`AsyncUpstreamClient` is the asyncio equivalent used by the ASGI mode in
+`asgi.py`.
+
+Set `base_url` (or `OPENAI_BASE_URL` in the server) to point it at a local
+stub such as `stub_upstream.py`. An `observer(api_key, status, headers)`
+callback sees the status and headers (with lowercase names) of every
+response, e.g. to track rate limits in a `keypool.KeyPool`.
+"""
+import asyncio
+import contextlib
+import http.client
+import json
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+CHAT = 'chat'
+COMPLETION = 'completion'
+
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+
+# how history turns are written into a legacy completion prompt
+_PROMPT_LABELS = {'user': 'User', 'assistant': 'Assistant'}
+
+# connection errors that mean a pooled keep-alive socket went stale
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                 ConnectionResetError, BrokenPipeError)
+
+
+def _time_left(deadline, default):
+    """Timeout for a call that must finish by `deadline` (a time.monotonic() value)."""
+    if deadline is None:
+        return default
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError('upstream deadline exceeded')
+    return min(default, left)
+
+
+class UpstreamError(Exception):
+    """Non-2xx response from the upstream API."""
+
+    def __init__(self, status, body, headers=None):
+        super().__init__('upstream returned %s: %s' % (status, body[:200]))
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+class ConnectionPool:
+    """LIFO pool of keep-alive HTTP(S) connections to one host."""
+
+    def __init__(self, base_url, size=8, timeout=30.0):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self.created = 0
+
+    def _new(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        self.created += 1
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self, timeout=None):
+        """Return (connection, reused); `timeout` overrides the socket timeout until release."""
+        try:
+            conn, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            conn, reused = self._new(), False
+        if timeout is not None:
+            self.set_timeout(conn, timeout)
+        return conn, reused
+
+    def set_timeout(self, conn, timeout):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+
+    def release(self, conn):
+        if conn.timeout != self.timeout:
+            self.set_timeout(conn, self.timeout)
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _ClientBase:
+    """API-variant selection and payload building shared by both clients."""
+
+    def __init__(self, api_key, prefix, chat_model, completion_model, recheck_interval, clock, observer=None):
+        self.api_key = api_key
+        self.observer = observer
+        self.chat_model = chat_model
+        self.completion_model = completion_model
+        self.recheck_interval = recheck_interval
+        self._prefix = prefix
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._variant = None
+        self._variant_at = 0.0
+
+    def _observe(self, status, headers):
+        if self.observer is not None:
+            self.observer(self.api_key, status, headers)
+
+    @property
+    def variant(self):
+        """The API variant currently in use (CHAT, COMPLETION or None if unknown)."""
+        return self._variant
+
+    def _variants(self):
+        with self._lock:
+            variant = self._variant
+            stale = variant == COMPLETION and self._clock() - self._variant_at >= self.recheck_interval
+        if variant is None or stale:
+            # probe the preferred API first, then the legacy one
+            return (CHAT, COMPLETION)
+        return (variant,)
+
+    def _remember(self, variant, probed):
+        with self._lock:
+            if probed or variant != self._variant:
+                self._variant_at = self._clock()
+            self._variant = variant
+
+    @staticmethod
+    def _variant_unavailable(variant, err):
+        # 404 (endpoint/model gone) or 400 (model not valid for this endpoint)
+        # means "try the other API"; auth, rate-limit and server errors do not
+        return variant == CHAT and err.status in (400, 404)
+
+    def _path(self, variant):
+        return self._prefix + ('/chat/completions' if variant == CHAT else '/completions')
+
+    def _payload(self, variant, system_prompt, message, max_tokens, history=None):
+        # history: earlier {'role', 'content'} messages of the conversation
+        history = history or []
+        if variant == CHAT:
+            return {
+                'model': self.chat_model,
+                'messages': [{'role': 'system', 'content': system_prompt}] + list(history) + [
+                    {'role': 'user', 'content': message},
+                ],
+                'max_tokens': max_tokens,
+            }
+        lines = ''.join('%s: %s\n' % (_PROMPT_LABELS.get(m['role'], 'System'), m['content']) for m in history)
+        return {
+            'model': self.completion_model,
+            'prompt': system_prompt + '\n\n' + lines + 'User: ' + message + '\nAssistant:',
+            'max_tokens': max_tokens,
+        }
+
+    @staticmethod
+    def _reply_text(variant, body):
+        data = json.loads(body)
+        if variant == CHAT:
+            return data['choices'][0]['message']['content'].strip()
+        return data['choices'][0]['text'].strip()
+
+    @staticmethod
+    def _sse_piece(variant, raw):
+        """Return the text in one SSE line, '' for none, or None at [DONE]."""
+        line = raw.strip()
+        if not line.startswith(b'data:'):
+            return ''
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            return None
+        choice = json.loads(data)['choices'][0]
+        if variant == CHAT:
+            return choice.get('delta', {}).get('content') or ''
+        return choice.get('text') or ''
+
+    def _headers(self):
+        return {
+            'Authorization': 'Bearer ' + self.api_key,
+            'Content-Type': 'application/json',
+            'Connection': 'keep-alive',
+        }
+
+
+class UpstreamClient(_ClientBase):
+    """Chat/completion client bound to a single API key."""
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, chat_model='gpt-3.5-turbo',
+                 completion_model='text-davinci-003', pool_size=8, timeout=30.0,
+                 recheck_interval=600.0, clock=time.monotonic, observer=None):
+        self.pool = ConnectionPool(base_url, size=pool_size, timeout=timeout)
+        super().__init__(api_key, self.pool.prefix, chat_model, completion_model, recheck_interval, clock,
+                         observer)
+
+    def close(self):
+        self.pool.close()
+
+    def complete(self, system_prompt, message, max_tokens=250, history=None, deadline=None):
+        """Return the reply text for `message`, after the optional `history` messages.
+
+        With a `deadline` (time.monotonic()), socket waits are cut to the time
+        left and TimeoutError is raised once it has passed, including before
+        falling back to the legacy API.
+        """
+        variants = self._variants()
+        for variant in variants:
+            payload = self._payload(variant, system_prompt, message, max_tokens, history)
+            try:
+                body = self._post(self._path(variant), payload, deadline)
+            except UpstreamError as e:
+                if not self._variant_unavailable(variant, e):
+                    raise
+                continue
+            self._remember(variant, probed=len(variants) > 1)
+            return self._reply_text(variant, body)
+        raise UpstreamError(404, 'no completion API variant available')
+
+    def stream(self, system_prompt, message, max_tokens=250, history=None, deadline=None):
+        """Yield reply text pieces as the upstream API produces them.
+
+        A `deadline` bounds the wait for the response to start, not the
+        length of the stream.
+        """
+        variants = self._variants()
+        for variant in variants:
+            payload = self._payload(variant, system_prompt, message, max_tokens, history)
+            payload['stream'] = True
+            try:
+                conn, resp = self._open(self._path(variant), payload, deadline)
+            except UpstreamError as e:
+                if not self._variant_unavailable(variant, e):
+                    raise
+                continue
+            self._remember(variant, probed=len(variants) > 1)
+            self.pool.set_timeout(conn, self.pool.timeout)
+            yield from self._iter_sse(conn, resp, variant)
+            return
+        raise UpstreamError(404, 'no completion API variant available')
+
+    def _open(self, path, payload, deadline=None):
+        """Send a request and return (connection, response) with the body unread."""
+        body = json.dumps(payload).encode('utf-8')
+        while True:
+            conn, reused = self.pool.acquire(_time_left(deadline, self.pool.timeout))
+            try:
+                conn.request('POST', path, body=body, headers=self._headers())
+                resp = conn.getresponse()
+            except _STALE_ERRORS:
+                conn.close()
+                if reused:
+                    # the server closed an idle keep-alive socket; retry on a fresh one
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            headers = {k.lower(): v for k, v in resp.getheaders()}
+            self._observe(resp.status, headers)
+            if resp.status >= 400:
+                data = resp.read().decode('utf-8', 'replace')
+                self._finish(conn, resp)
+                raise UpstreamError(resp.status, data, headers)
+            return conn, resp
+
+    def _post(self, path, payload, deadline=None):
+        conn, resp = self._open(path, payload, deadline)
+        try:
+            data = resp.read()
+        except Exception:
+            conn.close()
+            raise
+        self._finish(conn, resp)
+        return data
+
+    def _finish(self, conn, resp):
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.release(conn)
+
+    def _iter_sse(self, conn, resp, variant):
+        done = False
+        try:
+            for raw in resp:
+                piece = self._sse_piece(variant, raw)
+                if piece is None:
+                    done = True
+                    break
+                if piece:
+                    yield piece
+            if done:
+                # drain the terminating chunk so the socket can be reused
+                resp.read()
+        finally:
+            if done and not resp.will_close:
+                self.pool.release(conn)
+            else:
+                conn.close()
+
+
+class AsyncUpstreamClient(_ClientBase):
+    """asyncio version of UpstreamClient for the ASGI server mode.
+
+    Requests are awaited on keep-alive connections from an idle pool instead
+    of holding a thread for the length of the upstream call.
+    max_connections optionally caps concurrent upstream connections.
+    """
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, chat_model='gpt-3.5-turbo',
+                 completion_model='text-davinci-003', pool_size=64, max_connections=None,
+                 timeout=30.0, recheck_interval=600.0, clock=time.monotonic, observer=None):
+        parts = urlsplit(base_url)
+        super().__init__(api_key, parts.path.rstrip('/'), chat_model, completion_model, recheck_interval, clock,
+                         observer)
+        self.host = parts.hostname
+        self.ssl = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._max_connections = max_connections
+        self._slots = None
+        self._idle = []
+        self.created = 0
+
+    async def aclose(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+    async def complete(self, system_prompt, message, max_tokens=250, history=None, deadline=None):
+        """Return the reply text for `message`, after the optional `history` messages."""
+        async with self._slot():
+            variants = self._variants()
+            for variant in variants:
+                payload = self._payload(variant, system_prompt, message, max_tokens, history)
+                try:
+                    body = await asyncio.wait_for(self._post(self._path(variant), payload),
+                                                  _time_left(deadline, self.timeout))
+                except UpstreamError as e:
+                    if not self._variant_unavailable(variant, e):
+                        raise
+                    continue
+                self._remember(variant, probed=len(variants) > 1)
+                return self._reply_text(variant, body)
+        raise UpstreamError(404, 'no completion API variant available')
+
+    async def stream(self, system_prompt, message, max_tokens=250, history=None, deadline=None):
+        """Yield reply text pieces as the upstream API produces them."""
+        async with self._slot():
+            variants = self._variants()
+            for variant in variants:
+                payload = self._payload(variant, system_prompt, message, max_tokens, history)
+                payload['stream'] = True
+                try:
+                    conn, headers = await asyncio.wait_for(self._open(self._path(variant), payload),
+                                                           _time_left(deadline, self.timeout))
+                except UpstreamError as e:
+                    if not self._variant_unavailable(variant, e):
+                        raise
+                    continue
+                self._remember(variant, probed=len(variants) > 1)
+                done = False
+                buf = b''
+                try:
+                    async for chunk in self._iter_body(conn[0], headers):
+                        buf += chunk
+                        *lines, buf = buf.split(b'\n')
+                        for raw in lines:
+                            piece = self._sse_piece(variant, raw)
+                            if piece is None:
+                                done = True
+                            elif piece and not done:
+                                yield piece
+                    done = True
+                finally:
+                    self._finish(conn, headers, reusable=done)
+                return
+        raise UpstreamError(404, 'no completion API variant available')
+
+    def _slot(self):
+        if not self._max_connections:
+            return contextlib.nullcontext()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_connections)
+        return self._slots
+
+    async def _acquire(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return (reader, writer), True
+            writer.close()
+        self.created += 1
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+        return (reader, writer), False
+
+    def _finish(self, conn, headers, reusable=True):
+        reader, writer = conn
+        if reusable and headers.get('connection', '').lower() != 'close' and len(self._idle) < self.pool_size:
+            self._idle.append(conn)
+        else:
+            writer.close()
+
+    async def _open(self, path, payload):
+        """Send a request and return (connection, headers) with the body unread."""
+        body = json.dumps(payload).encode('utf-8')
+        head = ['POST %s HTTP/1.1' % path, 'Host: %s' % self.host, 'Content-Length: %d' % len(body)]
+        head += ['%s: %s' % kv for kv in self._headers().items()]
+        request = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+        while True:
+            conn, reused = await self._acquire()
+            reader, writer = conn
+            try:
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+                if not status_line:
+                    raise ConnectionResetError('connection closed by upstream')
+                status = int(status_line.split()[1])
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    # the server closed an idle keep-alive socket; retry on a fresh one
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            self._observe(status, headers)
+            if status >= 400:
+                data = await self._read_body(reader, headers)
+                self._finish(conn, headers)
+                raise UpstreamError(status, data.decode('utf-8', 'replace'), headers)
+            return conn, headers
+
+    async def _post(self, path, payload):
+        conn, headers = await self._open(path, payload)
+        try:
+            data = await self._read_body(conn[0], headers)
+        except BaseException:
+            conn[1].close()
+            raise
+        self._finish(conn, headers)
+        return data
+
+    async def _read_body(self, reader, headers):
+        return b''.join([chunk async for chunk in self._iter_body(reader, headers)])
+
+    @staticmethod
+    async def _iter_body(reader, headers):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    # skip trailers up to the blank line ending the message
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length:
+                yield await reader.readexactly(length)
+        else:
+            headers['connection'] = 'close'
+            yield await reader.read()